@@ -26,7 +26,7 @@
 import hashlib
 import hmac
 
-from .util import bfh, bh2u, BitcoinException, print_error, assert_bytes, to_bytes, inv_dict
+from .util import bfh, bh2u, BitcoinException, print_error, assert_bytes, to_bytes, inv_dict, LRUCache
 from . import version
 from . import segwit_addr
 from . import constants
@@ -62,9 +62,7 @@ def int_to_hex(i: int, length: int=1) -> str:
     if i < 0:
         # two's complement
         i = range_size + i
-    s = hex(i)[2:].rstrip('L')
-    s = "0"*(2*length - len(s)) + s
-    return rev_hex(s)
+    return bh2u(i.to_bytes(length, 'little'))
 
 def script_num_to_hex(i: int) -> str:
     """See CScriptNum in Bitcoin Core.
@@ -199,7 +197,17 @@ def hash160_to_b58_address(h160: bytes, addrtype):
     return base_encode(s+Hash(s)[0:4], base=58)
 
 
+# Memo for address <-> script <-> scripthash conversions. Keys include
+# the network, as the same string decodes differently on each of them.
+ADDRESS_CACHE_SIZE = 10000
+address_cache = LRUCache(ADDRESS_CACHE_SIZE)
+
+
 def b58_address_to_hash160(addr):
+    # the result does not depend on the network
+    return address_cache.get(('b58', addr), _b58_address_to_hash160, addr)
+
+def _b58_address_to_hash160(addr):
     addr = to_bytes(addr, 'ascii')
     _bytes = base_decode(addr, 25, base=58)
     return _bytes[0], _bytes[1:21]
@@ -238,6 +246,10 @@ def p2wsh_nested_script(witness_script):
     return '00' + push_script(wsh)
 
 def pubkey_to_address(txin_type, pubkey):
+    return address_cache.get(('pubkey', constants.net, txin_type, pubkey),
+                             _pubkey_to_address, txin_type, pubkey)
+
+def _pubkey_to_address(txin_type, pubkey):
     if txin_type == 'p2pkh':
         return public_key_to_p2pkh(bfh(pubkey))
     elif txin_type == 'p2wpkh':
@@ -269,6 +281,9 @@ def script_to_address(script, *, net=None):
 def address_to_script(addr, *, net=None):
     if net is None:
         net = constants.net
+    return address_cache.get(('script', net, addr), _address_to_script, addr, net)
+
+def _address_to_script(addr, net):
     witver, witprog = segwit_addr.decode(net.SEGWIT_HRP, addr)
     if witprog is not None:
         if not (0 <= witver <= 16):
@@ -291,6 +306,9 @@ def address_to_script(addr, *, net=None):
     return script
 
 def address_to_scripthash(addr):
+    return address_cache.get(('scripthash', constants.net, addr), _address_to_scripthash, addr)
+
+def _address_to_scripthash(addr):
     script = address_to_script(addr)
     return script_to_scripthash(script)
 
@@ -586,6 +604,18 @@ def CKD_pub(cK, c, n):
     if n & BIP32_PRIME: raise Exception()
     return _CKD_pub(cK, c, bfh(rev_hex(int_to_hex(n,4))))
 
+def CKD_pub_many(cK, c, indices):
+    '''Child public keys of (cK, c) for each of the given indices, without
+    their chain codes. Faster than calling CKD_pub for each index.'''
+    indices = list(indices)
+    if any(n < 0 for n in indices): raise ValueError('the bip32 index needs to be non-negative')
+    if any(n & BIP32_PRIME for n in indices): raise Exception()
+    tweaks = [hmac_oneshot(c, cK + n.to_bytes(4, 'big'), hashlib.sha512)[0:32] for n in indices]
+    children = ecc.add_tweaks_to_pubkey(cK, tweaks)
+    if None in children:
+        raise ecc.InvalidECPointException()
+    return children
+
 # helper function, callable with arbitrary string.
 # note: 's' does not need to fit into 32 bits here! (c.f. trustedcoin billing)
 def _CKD_pub(cK, c, s):
@@ -21,7 +21,9 @@
 # CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
 # SOFTWARE.
 import os
+import mmap
 import threading
+from hashlib import sha256
 
 from . import util
 from .bitcoin import Hash, hash_encode, int_to_hex, rev_hex
@@ -29,6 +31,7 @@ from . import constants
 from .util import bfh, bh2u
 
 MAX_TARGET = 0x00000000FFFF0000000000000000000000000000000000000000000000000000
+NULL_HEADER = bytes(80)
 
 
 class MissingHeader(Exception):
@@ -116,6 +119,13 @@ class Blockchain(util.PrintError):
         self.checkpoints = constants.net.CHECKPOINTS
         self.parent_id = parent_id
         self.lock = threading.Lock()
+        # the headers file is read through an mmap, and the hashes and
+        # targets read from it are cached. Both are reset on writes.
+        self._mmap = None
+        self._hashes = []  # height - checkpoint -> hash, or None if not cached
+        self._targets = {}  # chunk index -> target
+        self._generation = 0  # bumped when the cache is invalidated
+        self._unsynced = False  # whether writes have not been fsynced yet
         with self.lock:
             self.update_size()
 
@@ -172,14 +182,35 @@ class Blockchain(util.PrintError):
             raise Exception("insufficient proof of work: %s vs target %s" % (int('0x' + _hash, 16), target))
 
     def verify_chunk(self, index, data):
+        # same checks as verify_header, done on the raw chunk: hashes are
+        # compared as bytes in internal byte order, and bits as the packed
+        # little-endian field, so that no header dict or hex string is built
         num = len(data) // 80
         prev_hash = self.get_hash(index * 2016 - 1)
         target = self.get_target(index-1)
+        check_pow = not constants.net.TESTNET
+        if check_pow:
+            bits = self.target_to_bits(target)
+            raw_bits = bits.to_bytes(4, 'little')
+        mv = memoryview(data)
+        prev = bfh(prev_hash)[::-1]
         for i in range(num):
-            raw_header = data[i*80:(i+1) * 80]
-            header = deserialize_header(raw_header, index*2016 + i)
-            self.verify_header(header, prev_hash, target)
-            prev_hash = hash_header(header)
+            raw_header = mv[i*80:(i+1)*80]
+            if raw_header[4:36] != prev:
+                raise Exception("prev hash mismatch: %s vs %s" % (hash_encode(prev), hash_encode(bytes(raw_header[4:36]))))
+            _hash = sha256(sha256(raw_header).digest()).digest()
+            if check_pow:
+                if raw_header[72:76] != raw_bits:
+                    raise Exception("bits mismatch: %s vs %s" % (bits, int.from_bytes(raw_header[72:76], 'little')))
+                if int.from_bytes(_hash, 'little') > target:
+                    raise Exception("insufficient proof of work: %s vs target %s" % (int.from_bytes(_hash, 'little'), target))
+            prev = _hash
+        prev_hash = hash_encode(prev)
+        if index < len(self.checkpoints):
+            # chunks below the last checkpoint may be connected out of
+            # order, so they must also end at their checkpoint
+            if num != 2016 or prev_hash != self.checkpoints[index][0]:
+                raise Exception("chunk %d does not match checkpoint" % index)
 
     def path(self):
         d = util.get_headers_dir(self.config)
@@ -218,6 +249,8 @@ class Blockchain(util.PrintError):
         # store file path
         for b in blockchains.values():
             b.old_path = b.path()
+            with b.lock:
+                b.reset_cache()
         # swap parameters
         self.parent_id = parent.parent_id; parent.parent_id = parent_id
         self.checkpoint = parent.checkpoint; parent.checkpoint = checkpoint
@@ -241,19 +274,65 @@ class Blockchain(util.PrintError):
             raise FileNotFoundError('Cannot find headers file but headers_dir is there. Should be at {}'.format(path))
 
     def write(self, data, offset, truncate=True):
+        # not fsynced here, so that syncing many headers costs one fsync;
+        # see sync()
         filename = self.path()
         with self.lock:
             self.assert_headers_file_available(filename)
+            # the file can be neither truncated nor renamed while mapped on Windows
+            self.close_mmap()
+            self.invalidate_cache(offset // 80)
             with open(filename, 'rb+') as f:
                 if truncate and offset != self._size*80:
                     f.seek(offset)
                     f.truncate()
                 f.seek(offset)
                 f.write(data)
-                f.flush()
-                os.fsync(f.fileno())
+            self._unsynced = True
             self.update_size()
 
+    def sync(self):
+        '''Flushes the headers written since the last call to disk.'''
+        with self.lock:
+            if not self._unsynced:
+                return
+            self._unsynced = False
+            filename = self.path()
+            if not os.path.exists(filename):
+                return
+            with open(filename, 'rb+') as f:
+                os.fsync(f.fileno())
+
+    def close_mmap(self):
+        if self._mmap is not None:
+            self._mmap.close()
+            self._mmap = None
+
+    def reset_cache(self):
+        self.close_mmap()
+        self._hashes = []
+        self._targets = {}
+        self._generation += 1
+
+    def invalidate_cache(self, delta):
+        '''Forgets what was cached about the headers from checkpoint+delta on.'''
+        del self._hashes[delta:]
+        self._generation += 1
+        first_index = (self.checkpoint + delta) // 2016
+        for index in [i for i in self._targets if i >= first_index]:
+            del self._targets[index]
+
+    def read_raw_header(self, delta):
+        with self.lock:
+            if self._mmap is None:
+                name = self.path()
+                self.assert_headers_file_available(name)
+                if os.path.getsize(name) == 0:
+                    return b''
+                with open(name, 'rb') as f:
+                    self._mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            return self._mmap[delta * 80:(delta + 1) * 80]
+
     def save_header(self, header):
         delta = header.get('block_height') - self.checkpoint
         data = bfh(serialize_header(header))
@@ -271,14 +350,10 @@ class Blockchain(util.PrintError):
         if height > self.height():
             return
         delta = height - self.checkpoint
-        name = self.path()
-        self.assert_headers_file_available(name)
-        with open(name, 'rb') as f:
-            f.seek(delta * 80)
-            h = f.read(80)
-            if len(h) < 80:
-                raise Exception('Expected to read a full header. This was only {} bytes'.format(len(h)))
-        if h == bytes([0])*80:
+        h = self.read_raw_header(delta)
+        if len(h) < 80:
+            raise Exception('Expected to read a full header. This was only {} bytes'.format(len(h)))
+        if h == NULL_HEADER:
             return None
         return deserialize_header(h, height)
 
@@ -292,8 +367,32 @@ class Blockchain(util.PrintError):
             index = height // 2016
             h, t = self.checkpoints[index]
             return h
+        elif height < self.checkpoint:
+            return self.parent().get_hash(height)
         else:
-            return hash_header(self.read_header(height))
+            delta = height - self.checkpoint
+            try:
+                h = self._hashes[delta]
+            except IndexError:
+                h = None
+            if h is not None:
+                return h
+            if height > self.height():
+                return hash_header(None)
+            generation = self._generation
+            raw = self.read_raw_header(delta)
+            if len(raw) < 80:
+                raise Exception('Expected to read a full header. This was only {} bytes'.format(len(raw)))
+            if raw == NULL_HEADER:
+                return hash_header(None)
+            h = hash_encode(Hash(raw))
+            with self.lock:
+                if generation != self._generation:
+                    return h  # written meanwhile; do not cache
+                if delta >= len(self._hashes):
+                    self._hashes.extend([None] * (delta + 1 - len(self._hashes)))
+                self._hashes[delta] = h
+            return h
 
     def get_target(self, index):
         # compute target from chunk x, used in chunk x+1
@@ -304,7 +403,11 @@ class Blockchain(util.PrintError):
         if index < len(self.checkpoints):
             h, t = self.checkpoints[index]
             return t
+        target = self._targets.get(index)
+        if target is not None:
+            return target
         # new target
+        generation = self._generation
         first = self.read_header(index * 2016)
         last = self.read_header(index * 2016 + 2015)
         if not first or not last:
@@ -316,6 +419,11 @@ class Blockchain(util.PrintError):
         nActualTimespan = max(nActualTimespan, nTargetTimespan // 4)
         nActualTimespan = min(nActualTimespan, nTargetTimespan * 4)
         new_target = min(MAX_TARGET, (target * nActualTimespan) // nTargetTimespan)
+        if index * 2016 >= self.checkpoint:
+            # only cached if both headers are in our own file
+            with self.lock:
+                if generation == self._generation:
+                    self._targets[index] = new_target
         return new_target
 
     def bits_to_target(self, bits):
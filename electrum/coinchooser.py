@@ -22,6 +22,7 @@
 # ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN
 # CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
 # SOFTWARE.
+import struct
 from collections import defaultdict, namedtuple
 from math import floor, log10
 
@@ -36,16 +37,36 @@ from .util import NotEnoughFunds, PrintError
 # so if sending twice from the same UTXO set we choose the same UTXOs
 # to spend.  This prevents attacks on users by malicious or stale
 # servers.
+UNPACK_FORMATS = {1: 'B', 2: 'H', 4: 'I'}
+
 class PRNG:
+    # number of hashes computed at once when the pool runs out
+    block_hashes = 32
+
     def __init__(self, seed):
         self.sha = sha256(seed)
-        self.pool = bytearray()
+        self.pool = b''
+        self.pos = 0  # bytes of the pool used so far
+
+    def refill(self, n):
+        # keep the unused bytes, add hashes until at least n are available
+        blocks = [self.pool[self.pos:]]
+        available = len(blocks[0])
+        sha = self.sha
+        while available < n:
+            for i in range(self.block_hashes):
+                blocks.append(sha)
+                sha = sha256(sha)
+            available += 32 * self.block_hashes
+        self.sha = sha
+        self.pool = b''.join(blocks)
+        self.pos = 0
 
     def get_bytes(self, n):
-        while len(self.pool) < n:
-            self.pool.extend(self.sha)
-            self.sha = sha256(self.sha)
-        result, self.pool = self.pool[:n], self.pool[n:]
+        if self.pos + n > len(self.pool):
+            self.refill(n)
+        result = self.pool[self.pos:self.pos + n]
+        self.pos += n
         return result
 
     def randint(self, start, end):
@@ -54,7 +75,10 @@ class PRNG:
         r = 0
         p = 1
         while p < n:
-            r = self.get_bytes(1)[0] + (r << 8)
+            if self.pos >= len(self.pool):
+                self.refill(1)
+            r = self.pool[self.pos] + (r << 8)
+            self.pos += 1
             p = p << 8
         return start + (r % n)
 
@@ -62,10 +86,23 @@ class PRNG:
         return seq[self.randint(0, len(seq))]
 
     def shuffle(self, x):
-        for i in reversed(range(1, len(x))):
-            # pick an element in x[:i+1] with which to exchange x[i]
-            j = self.randint(0, i+1)
-            x[i], x[j] = x[j], x[i]
+        i = len(x) - 1
+        while i >= 1:
+            # randint(0, i+1) draws as many bytes for all the i down to
+            # low; read and convert those draws in one go
+            size = (i.bit_length() + 7) // 8
+            low = 256 ** (size - 1) if size > 1 else 1
+            data = self.get_bytes(size * (i - low + 1))
+            if size in UNPACK_FORMATS:
+                draws = struct.unpack('>%d%s' % (i - low + 1, UNPACK_FORMATS[size]), data)
+            else:
+                draws = [int.from_bytes(data[k:k + size], 'big')
+                         for k in range(0, len(data), size)]
+            for r in draws:
+                # pick an element in x[:i+1] with which to exchange x[i]
+                j = r % (i + 1)
+                x[i], x[j] = x[j], x[i]
+                i -= 1
 
 
 Bucket = namedtuple('Bucket',
@@ -76,15 +113,95 @@ Bucket = namedtuple('Bucket',
                      'min_height',  # min block height where a coin was confirmed
                      'witness'])    # whether any coin uses segwit
 
+
+class BucketTotals(namedtuple('BucketTotals',
+                              ['value',                 # in satoshis
+                               'weight',                # of the inputs
+                               'witness',               # whether any bucket uses segwit
+                               'num_legacy_inputs'])):  # coins in non-segwit buckets
+    '''What sufficient_funds needs to know about a list of buckets.
+    Totals can be added up as the list grows, instead of summing over
+    the whole list each time it is checked.'''
+
+    @classmethod
+    def of(cls, buckets):
+        return cls(sum(bucket.value for bucket in buckets),
+                   sum(bucket.weight for bucket in buckets),
+                   any(bucket.witness for bucket in buckets),
+                   sum((not bucket.witness) * len(bucket.coins) for bucket in buckets))
+
+    def add(self, other):
+        return BucketTotals(self.value + other.value,
+                            self.weight + other.weight,
+                            self.witness or other.witness,
+                            self.num_legacy_inputs + other.num_legacy_inputs)
+
+NO_BUCKETS = BucketTotals(0, 0, False, 0)
+
 def strip_unneeded(bkts, sufficient_funds):
     '''Remove buckets that are unnecessary in achieving the spend amount'''
     bkts = sorted(bkts, key = lambda bkt: bkt.value)
+    # totals[i] are those of bkts[i:]
+    totals = [NO_BUCKETS] * (len(bkts) + 1)
+    for i in reversed(range(len(bkts))):
+        totals[i] = totals[i + 1].add(BucketTotals.of([bkts[i]]))
     for i in range(len(bkts)):
-        if not sufficient_funds(bkts[i + 1:]):
+        if not sufficient_funds(None, totals=totals[i + 1]):
             return bkts[i:]
     # Shouldn't get here
     return bkts
 
+def branch_and_bound(values, target, cost_of_change, max_tries=100000):
+    '''Depth-first search for a subset of values whose sum is in
+    [target, target + cost_of_change), with as few values as possible and
+    then the least excess over target.  values must be positive and
+    sorted in decreasing order.  Returns the indices of the subset, or
+    None if there is none or none was found within max_tries steps.'''
+    n = len(values)
+    # remaining[i] is the sum of values[i:]
+    remaining = [0] * (n + 1)
+    for i in reversed(range(n)):
+        remaining[i] = remaining[i + 1] + values[i]
+    if remaining[0] < target:
+        return None
+    upper = target + cost_of_change
+    best, best_count, best_excess = None, n + 1, cost_of_change
+    selection = []
+    total = 0
+    i = 0
+    for tries in range(max_tries):
+        if total >= upper or total + remaining[i] < target:
+            backtrack = True
+        elif total >= target:
+            count, excess = len(selection), total - target
+            if count < best_count or excess < best_excess:
+                best, best_count, best_excess = selection[:], count, excess
+                if count == 1 and excess == 0:
+                    break
+            backtrack = True
+        elif len(selection) >= best_count:
+            # another value would make more than the best so far
+            backtrack = True
+        else:
+            # include values[i]
+            selection.append(i)
+            total += values[i]
+            i += 1
+            backtrack = False
+        if backtrack:
+            if not selection:
+                break
+            # exclude the last included value instead.  If the values after
+            # it are equal to it, including them instead would only repeat
+            # the branch already searched
+            j = selection.pop()
+            total -= values[j]
+            i = j + 1
+            while i < n and values[i] == values[j]:
+                i += 1
+    return best
+
+
 class CoinChooserBase(PrintError):
 
     enable_output_value_rounding = False
@@ -211,31 +328,47 @@ class CoinChooserBase(PrintError):
         def fee_estimator_w(weight):
             return fee_estimator(Transaction.virtual_size_from_weight(weight))
 
-        def get_tx_weight(buckets):
-            total_weight = base_weight + sum(bucket.weight for bucket in buckets)
-            is_segwit_tx = any(bucket.witness for bucket in buckets)
-            if is_segwit_tx:
+        def get_tx_weight(buckets, *, totals=None):
+            if totals is None:
+                totals = BucketTotals.of(buckets)
+            total_weight = base_weight + totals.weight
+            if totals.witness:
                 total_weight += 2  # marker and flag
                 # non-segwit inputs were previously assumed to have
                 # a witness of '' instead of '00' (hex)
                 # note that mixed legacy/segwit buckets are already ok
-                num_legacy_inputs = sum((not bucket.witness) * len(bucket.coins)
-                                        for bucket in buckets)
-                total_weight += num_legacy_inputs
+                total_weight += totals.num_legacy_inputs
 
             return total_weight
 
-        def sufficient_funds(buckets):
-            '''Given a list of buckets, return True if it has enough
-            value to pay for the transaction'''
-            total_input = sum(bucket.value for bucket in buckets)
-            total_weight = get_tx_weight(buckets)
-            return total_input >= spent_amount + fee_estimator_w(total_weight)
+        def get_excess(buckets, *, totals=None):
+            '''Given a list of buckets, return the value left after paying
+            for the outputs and the fee of a transaction without change.
+            If their totals are given, buckets is not used and can be None.'''
+            if totals is None:
+                totals = BucketTotals.of(buckets)
+            total_weight = get_tx_weight(buckets, totals=totals)
+            return totals.value - spent_amount - fee_estimator_w(total_weight)
+
+        def sufficient_funds(buckets, *, totals=None):
+            '''Given a list of buckets, or their totals, return True if
+            it has enough value to pay for the transaction'''
+            return get_excess(buckets, totals=totals) >= 0
+
+        if not coins:
+            raise NotEnoughFunds()
+
+        # For choosers that select on effective values: an excess below
+        # cost_of_change is not worth a change output and goes to fees
+        change_addr = change_addrs[0] if change_addrs else coins[0]['address']
+        change_weight = 4 * Transaction.estimated_output_size(change_addr)
+        cost_of_change = (fee_estimator_w(base_weight + change_weight)
+                          - fee_estimator_w(base_weight) + dust_threshold)
 
         # Collect the coins into buckets, choose a subset of the buckets
         buckets = self.bucketize_coins(coins)
         buckets = self.choose_buckets(buckets, sufficient_funds,
-                                      self.penalty_func(tx))
+                                      self.penalty_func(tx), get_excess, cost_of_change)
 
         tx.add_inputs([coin for b in buckets for coin in b.coins])
         tx_weight = get_tx_weight(buckets)
@@ -258,7 +391,8 @@ class CoinChooserBase(PrintError):
 
         return tx
 
-    def choose_buckets(self, buckets, sufficient_funds, penalty_func):
+    def choose_buckets(self, buckets, sufficient_funds, penalty_func,
+                       get_excess, cost_of_change):
         raise NotImplemented('To be subclassed')
 
 
@@ -270,10 +404,11 @@ class CoinChooserRandom(CoinChooserBase):
             raise NotEnoughFunds()
 
         candidates = set()
+        totals = [BucketTotals.of([bucket]) for bucket in buckets]
 
         # Add all singletons
         for n, bucket in enumerate(buckets):
-            if sufficient_funds([bucket]):
+            if sufficient_funds(None, totals=totals[n]):
                 candidates.add((n, ))
 
         # And now some random ones
@@ -283,10 +418,10 @@ class CoinChooserRandom(CoinChooserBase):
             # Get a random permutation of the buckets, and
             # incrementally combine buckets until sufficient
             self.p.shuffle(permutation)
-            bkts = []
+            bkts_totals = NO_BUCKETS
             for count, index in enumerate(permutation):
-                bkts.append(buckets[index])
-                if sufficient_funds(bkts):
+                bkts_totals = bkts_totals.add(totals[index])
+                if sufficient_funds(None, totals=bkts_totals):
                     candidates.add(tuple(sorted(permutation[:count + 1])))
                     break
             else:
@@ -317,9 +452,12 @@ class CoinChooserRandom(CoinChooserBase):
         already_selected_buckets = []
 
         for bkts_choose_from in bucket_sets:
+            already_selected_totals = BucketTotals.of(already_selected_buckets)
             try:
-                def sfunds(bkts):
-                    return sufficient_funds(already_selected_buckets + bkts)
+                def sfunds(bkts, *, totals=None):
+                    if totals is None:
+                        totals = BucketTotals.of(bkts)
+                    return sufficient_funds(None, totals=already_selected_totals.add(totals))
 
                 candidates = self.bucket_candidates_any(bkts_choose_from, sfunds)
                 break
@@ -331,7 +469,8 @@ class CoinChooserRandom(CoinChooserBase):
         candidates = [(already_selected_buckets + c) for c in candidates]
         return [strip_unneeded(c, sufficient_funds) for c in candidates]
 
-    def choose_buckets(self, buckets, sufficient_funds, penalty_func):
+    def choose_buckets(self, buckets, sufficient_funds, penalty_func,
+                       get_excess, cost_of_change):
         candidates = self.bucket_candidates_prefer_confirmed(buckets, sufficient_funds)
         penalties = [penalty_func(cand) for cand in candidates]
         winner = candidates[penalties.index(min(penalties))]
@@ -375,8 +514,52 @@ class CoinChooserPrivacy(CoinChooserRandom):
         return penalty
 
 
+class CoinChooserBranchAndBound(CoinChooserPrivacy):
+    """Looks for coins that pay for the transaction exactly, so that no
+    change output is needed.  This makes the transaction smaller and
+    does not link a change address to the payment.
+    Coins of the same address are spent together, and confirmed coins
+    are preferred.  If no such set of coins is found, coins are chosen
+    as with Privacy.
+    """
+
+    max_tries = 100000
+
+    def choose_buckets(self, buckets, sufficient_funds, penalty_func,
+                       get_excess, cost_of_change):
+        # target and effective values are relative to the transaction
+        # without inputs, see get_excess in make_tx
+        target = -get_excess([])
+        conf_buckets = [bkt for bkt in buckets if bkt.min_height > 0]
+        unconf_buckets = [bkt for bkt in buckets if bkt.min_height == 0]
+        bucket_sets = [conf_buckets, conf_buckets + unconf_buckets, buckets]
+        tried = set()
+        for bkts in bucket_sets:
+            if not bkts or len(bkts) in tried:
+                continue
+            tried.add(len(bkts))
+            bkts = [(get_excess([bkt]) + target, bkt) for bkt in bkts]
+            bkts = sorted((x for x in bkts if x[0] > 0), key=lambda x: -x[0])
+            values = [x[0] for x in bkts]
+            selected = branch_and_bound(values, target, cost_of_change,
+                                        self.max_tries)
+            if not selected:
+                continue
+            winner = [bkts[i][1] for i in selected]
+            # effective values add up to the real excess only up to rounding
+            excess = get_excess(winner)
+            if 0 <= excess < cost_of_change:
+                self.print_error("Bucket sets:", len(buckets))
+                self.print_error("Changeless selection, excess:", excess)
+                return winner
+        self.print_error("no changeless selection found")
+        return super().choose_buckets(buckets, sufficient_funds, penalty_func,
+                                      get_excess, cost_of_change)
+
+
 COIN_CHOOSERS = {
     'Privacy': CoinChooserPrivacy,
+    'BranchAndBound': CoinChooserBranchAndBound,
 }
 
 def get_name(config):
@@ -41,6 +41,8 @@ from .i18n import _
 from .transaction import Transaction, multisig_script
 from .paymentrequest import PR_PAID, PR_UNPAID, PR_UNKNOWN, PR_EXPIRED
 from .plugin import run_hook
+from .payout import PayoutEngine
+from .wallet import MAX_RESERVE_ATTEMPTS
 
 known_commands = {}
 
@@ -242,7 +244,7 @@ class Commands:
             x_pubkey = 'fd' + bh2u(b'\x00' + h160)
             tx.sign({x_pubkey:(privkey2, compressed)})
         else:
-            self.wallet.sign_transaction(tx, password)
+            self.wallet.sign_transaction(tx, password, self.config.get('sign_processes', 0))
         return tx.as_dict()
 
     @command('')
@@ -255,7 +257,11 @@ class Commands:
     def broadcast(self, tx):
         """Broadcast a transaction to the network. """
         tx = Transaction(tx)
-        return self.network.broadcast_transaction(tx)
+        result = self.network.broadcast_transaction(tx)
+        if not result[0] and self.wallet:
+            # the coins can be spent by other transactions
+            self.wallet.release_coins(tx.inputs())
+        return result
 
     @command('')
     def createmultisig(self, num, pubkeys):
@@ -344,6 +350,18 @@ class Commands:
         from .version import ELECTRUM_VERSION
         return ELECTRUM_VERSION
 
+    @command('')
+    def cryptobackends(self):
+        """Return the implementations used for elliptic curve operations
+        and for RIPEMD-160, and the other RIPEMD-160 ones available."""
+        from .ecc_fast import is_using_fast_ecc
+        from . import crypto
+        return {
+            'ecc': 'libsecp256k1' if is_using_fast_ecc() else 'python-ecdsa',
+            'ripemd160': crypto.RIPEMD160_BACKEND,
+            'ripemd160_available': list(crypto.get_ripemd160_backends().keys()),
+        }
+
     @command('w')
     def getmpk(self):
         """Get master public key. Return your wallet\'s master public key"""
@@ -407,18 +425,27 @@ class Commands:
         message = util.to_bytes(message)
         return ecc.verify_message_with_address(address, sig, message)
 
-    def _mktx(self, outputs, fee, change_addr, domain, nocheck, unsigned, rbf, password, locktime=None):
+    def _mktx(self, outputs, fee, change_addr, domain, nocheck, unsigned, rbf, password, locktime=None, noreserve=False):
         self.nocheck = nocheck
         change_addr = self._resolver(change_addr)
-        domain = None if domain is None else map(self._resolver, domain)
+        domain = None if domain is None else list(map(self._resolver, domain))
         final_outputs = []
         for address, amount in outputs:
             address = self._resolver(address)
             amount = satoshis(amount)
             final_outputs.append((TYPE_ADDRESS, address, amount))
 
-        coins = self.wallet.get_spendable_coins(domain, self.config)
-        tx = self.wallet.make_unsigned_transaction(coins, final_outputs, self.config, fee, change_addr)
+        # the coins of a signed tx are reserved until it is broadcast;
+        # unsigned txs are only previews
+        reserve = not unsigned and not noreserve
+        for i in range(MAX_RESERVE_ATTEMPTS):
+            coins = self.wallet.get_spendable_coins(domain, self.config)
+            tx = self.wallet.make_unsigned_transaction(coins, final_outputs, self.config, fee, change_addr)
+            # another call may have reserved some of the coins since we got them
+            if not reserve or self.wallet.reserve_coins(tx.inputs()):
+                break
+        else:
+            raise Exception('Could not reserve coins, they are being spent by other transactions')
         if locktime != None: 
             tx.locktime = locktime
         if rbf is None:
@@ -426,25 +453,46 @@ class Commands:
         if rbf:
             tx.set_rbf(True)
         if not unsigned:
-            self.wallet.sign_transaction(tx, password)
+            try:
+                self.wallet.sign_transaction(tx, password, self.config.get('sign_processes', 0))
+            except BaseException:
+                if reserve:
+                    self.wallet.release_coins(tx.inputs())
+                raise
         return tx
 
     @command('wp')
-    def payto(self, destination, amount, fee=None, from_addr=None, change_addr=None, nocheck=False, unsigned=False, rbf=None, password=None, locktime=None):
+    def payto(self, destination, amount, fee=None, from_addr=None, change_addr=None, nocheck=False, unsigned=False, rbf=None, password=None, locktime=None, noreserve=False):
         """Create a transaction. """
         tx_fee = satoshis(fee)
         domain = from_addr.split(',') if from_addr else None
-        tx = self._mktx([(destination, amount)], tx_fee, change_addr, domain, nocheck, unsigned, rbf, password, locktime)
+        tx = self._mktx([(destination, amount)], tx_fee, change_addr, domain, nocheck, unsigned, rbf, password, locktime, noreserve)
         return tx.as_dict()
 
     @command('wp')
-    def paytomany(self, outputs, fee=None, from_addr=None, change_addr=None, nocheck=False, unsigned=False, rbf=None, password=None, locktime=None):
+    def paytomany(self, outputs, fee=None, from_addr=None, change_addr=None, nocheck=False, unsigned=False, rbf=None, password=None, locktime=None, noreserve=False):
         """Create a multi-output transaction. """
         tx_fee = satoshis(fee)
         domain = from_addr.split(',') if from_addr else None
-        tx = self._mktx(outputs, tx_fee, change_addr, domain, nocheck, unsigned, rbf, password, locktime)
+        tx = self._mktx(outputs, tx_fee, change_addr, domain, nocheck, unsigned, rbf, password, locktime, noreserve)
         return tx.as_dict()
 
+    @command('wpn')
+    def paybatch(self, outputs, feerate=None, max_outputs=100, max_size=100000, nocheck=False, rbf=None, password=None):
+        """Pay many outputs in batches. Payments are grouped into as few
+        transactions as allowed by max_outputs and max_size, and each
+        transaction is signed and broadcast while the next ones are built.
+        Returns the txid, or an error, for each payment."""
+        self.nocheck = nocheck
+        payments = [(self._resolver(address), satoshis(amount)) for address, amount in outputs]
+        if any(amount == '!' for address, amount in payments):
+            raise Exception("Cannot send the maximum available in a batch")
+        if rbf is None:
+            rbf = self.config.get('use_rbf', True)
+        engine = PayoutEngine(self.wallet, self.config, self.network, fee_per_kb=feerate,
+                              max_outputs=max_outputs, max_size=max_size, rbf=rbf)
+        return engine.run(payments, password)
+
     @command('w')
     def history(self, year=None, show_addresses=False, show_fiat=False):
         """Wallet history. Returns the transaction history of your wallet."""
@@ -719,6 +767,7 @@ command_options = {
     'language':    ("-L", "Default language for wordlist"),
     'privkey':     (None, "Private key. Set to '?' to get a prompt."),
     'unsigned':    ("-u", "Do not sign transaction"),
+    'noreserve':   (None, "Do not reserve the coins of the transaction until it is broadcast"),
     'rbf':         (None, "Replace-by-fee transaction"),
     'locktime':    (None, "Set locktime block number"),
     'domain':      ("-D", "List of addresses"),
@@ -733,7 +782,10 @@ command_options = {
     'show_fiat':   (None, "Show fiat value of transactions"),
     'year':        (None, "Show history for a given year"),
     'fee_method':  (None, "Fee estimation method to use"),
-    'fee_level':   (None, "Float between 0.0 and 1.0, representing fee slider position")
+    'fee_level':   (None, "Float between 0.0 and 1.0, representing fee slider position"),
+    'feerate':     (None, "Fee rate in sat/kvByte. Default is the current suggested fee rate"),
+    'max_outputs': (None, "Maximum number of payments per transaction"),
+    'max_size':    (None, "Maximum size of a transaction in vbytes"),
 }
 
 
@@ -755,6 +807,9 @@ arg_types = {
     'locktime': int,
     'fee_method': str,
     'fee_level': json_loads,
+    'feerate': int,
+    'max_outputs': int,
+    'max_size': int,
 }
 
 config_variables = {
@@ -25,12 +25,17 @@
 
 import base64
 import os
+import sys
 import hashlib
 import hmac
+import ctypes
+from ctypes.util import find_library
+from collections import OrderedDict
 
 import pyaes
 
-from .util import assert_bytes, InvalidPassword, to_bytes, to_string
+from .util import assert_bytes, InvalidPassword, to_bytes, to_string, print_error
+from . import ripemd
 
 
 try:
@@ -132,15 +137,78 @@ def Hash(x: bytes) -> bytes:
     return out
 
 
+RIPEMD160_TEST_VECTOR = (b'abc', bytes.fromhex('8eb208f7e05d987a9b044a8e98c6b087f15a0bfc'))
+
+
+def _ripemd160_hashlib(x: bytes) -> bytes:
+    return hashlib.new('ripemd160', x).digest()
+
+
+def load_libcrypto():
+    # OpenSSL 3 only provides RIPEMD-160 to hashlib through its legacy
+    # provider, but libcrypto still exports the RIPEMD160 function
+    if sys.platform == 'darwin':
+        names = ['libcrypto.dylib', 'libcrypto.3.dylib', 'libcrypto.1.1.dylib']
+    elif sys.platform in ('windows', 'win32'):
+        names = ['libcrypto-3-x64.dll', 'libcrypto-3.dll', 'libcrypto-1_1-x64.dll', 'libcrypto-1_1.dll']
+    else:
+        names = ['libcrypto.so.3', 'libcrypto.so.1.1', 'libcrypto.so']
+    path = find_library('crypto')
+    if path:
+        names.insert(0, path)
+    for name in names:
+        try:
+            libcrypto = ctypes.cdll.LoadLibrary(name)
+            libcrypto.RIPEMD160.argtypes = [ctypes.c_char_p, ctypes.c_size_t, ctypes.c_char_p]
+            libcrypto.RIPEMD160.restype = ctypes.c_void_p
+            return libcrypto
+        except (OSError, AttributeError):
+            continue
+    return None
+
+
+def _make_ripemd160_libcrypto(libcrypto):
+    def ripemd160(x: bytes) -> bytes:
+        md = ctypes.create_string_buffer(20)
+        libcrypto.RIPEMD160(x, len(x), md)
+        return md.raw
+    return ripemd160
+
+
+RIPEMD160_CANDIDATES = [
+    ('hashlib', lambda: _ripemd160_hashlib),
+    ('libcrypto', lambda: _make_ripemd160_libcrypto(load_libcrypto())),
+    ('python', lambda: ripemd.ripemd160),
+]
+
+
+def _iter_ripemd160_backends():
+    """Yields (name, function) for the working RIPEMD-160
+    implementations, fastest first. Each one is only loaded and
+    tested when the previous one has been yielded."""
+    data, digest = RIPEMD160_TEST_VECTOR
+    for name, make in RIPEMD160_CANDIDATES:
+        try:
+            f = make()
+            if f(data) == digest:
+                yield name, f
+        except Exception:
+            pass
+
+
+def get_ripemd160_backends():
+    """Returns the working RIPEMD-160 implementations, fastest first,
+    as an OrderedDict name -> function."""
+    return OrderedDict(_iter_ripemd160_backends())
+
+
+# only the backends up to the first working one are loaded
+RIPEMD160_BACKEND, ripemd160 = next(_iter_ripemd160_backends())
+if RIPEMD160_BACKEND != 'hashlib':
+    print_error('[crypto] hashlib has no ripemd160, using', RIPEMD160_BACKEND)
+
 def hash_160(x: bytes) -> bytes:
-    try:
-        md = hashlib.new('ripemd160')
-        md.update(sha256(x))
-        return md.digest()
-    except BaseException:
-        from . import ripemd
-        md = ripemd.new(sha256(x))
-        return md.digest()
+    return ripemd160(sha256(x))
 
 
 def hmac_oneshot(key: bytes, msg: bytes, digest) -> bytes:
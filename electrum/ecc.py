@@ -38,6 +38,7 @@ from ecdsa.util import string_to_number, number_to_string
 from .util import bfh, bh2u, assert_bytes, print_error, to_bytes, InvalidPassword, profiler
 from .crypto import (Hash, aes_encrypt_with_iv, aes_decrypt_with_iv, hmac_oneshot)
 from .ecc_fast import do_monkey_patching_of_python_ecdsa_internals_with_libsecp256k1
+from .ecc_fast import is_using_fast_ecc, pubkey_tweak_add_many
 
 
 do_monkey_patching_of_python_ecdsa_internals_with_libsecp256k1()
@@ -297,6 +298,27 @@ class ECPubkey(object):
         return self == point_at_infinity()
 
 
+def add_tweaks_to_pubkey(pubkey: bytes, tweaks) -> list:
+    """Returns pubkey + tweak*G, compressed, for each 32-byte tweak,
+    or None where the tweak or the result is invalid.
+    The pubkey is only parsed once, which matters when deriving many
+    children of the same BIP32 node."""
+    assert_bytes(pubkey)
+    valid = [is_secret_within_curve_range(tweak) for tweak in tweaks]
+    if is_using_fast_ecc():
+        children = pubkey_tweak_add_many(pubkey, tweaks)
+        return [child if ok else None for child, ok in zip(children, valid)]
+    point = _ser_to_python_ecdsa_point(pubkey)
+    children = []
+    for tweak, ok in zip(tweaks, valid):
+        if not ok:
+            children.append(None)
+            continue
+        child = generator_secp256k1 * string_to_number(tweak) + point
+        children.append(point_to_ser(child))  # None at infinity
+    return children
+
+
 def msg_magic(message: bytes) -> bytes:
     from .bitcoin import var_int
     length = bfh(var_int(len(message)))
@@ -78,6 +78,9 @@ def load_library():
         secp256k1.secp256k1_ec_pubkey_tweak_mul.argtypes = [c_void_p, c_char_p, c_char_p]
         secp256k1.secp256k1_ec_pubkey_tweak_mul.restype = c_int
 
+        secp256k1.secp256k1_ec_pubkey_tweak_add.argtypes = [c_void_p, c_char_p, c_char_p]
+        secp256k1.secp256k1_ec_pubkey_tweak_add.restype = c_int
+
         secp256k1.ctx = secp256k1.secp256k1_context_create(SECP256K1_CONTEXT_SIGN | SECP256K1_CONTEXT_VERIFY)
         r = secp256k1.secp256k1_context_randomize(secp256k1.ctx, os.urandom(32))
         if r:
@@ -209,6 +212,31 @@ def is_using_fast_ecc():
     return _patched_functions.monkey_patching_active
 
 
+def pubkey_tweak_add_many(pubkey_bytes, tweaks):
+    # Returns the compressed serialization of pubkey + tweak*G for each
+    # tweak, or None if the result is invalid. The pubkey is parsed once.
+    parent = create_string_buffer(64)
+    r = _libsecp256k1.secp256k1_ec_pubkey_parse(
+        _libsecp256k1.ctx, parent, pubkey_bytes, len(pubkey_bytes))
+    if not r:
+        raise ValueError('invalid pubkey')
+    child = create_string_buffer(64)
+    child_serialized = create_string_buffer(33)
+    child_size = c_size_t(33)
+    result = []
+    for tweak in tweaks:
+        ctypes.memmove(child, parent, 64)
+        r = _libsecp256k1.secp256k1_ec_pubkey_tweak_add(_libsecp256k1.ctx, child, tweak)
+        if not r:
+            result.append(None)
+            continue
+        child_size.value = 33
+        _libsecp256k1.secp256k1_ec_pubkey_serialize(
+            _libsecp256k1.ctx, child_serialized, byref(child_size), child, SECP256K1_EC_COMPRESSED)
+        result.append(child_serialized.raw)
+    return result
+
+
 try:
     _libsecp256k1 = load_library()
 except:
@@ -853,7 +853,7 @@ class ElectrumWindow(App):
 
     def _sign_tx(self, tx, password, on_success, on_failure):
         try:
-            self.wallet.sign_transaction(tx, password)
+            self.wallet.sign_transaction(tx, password, self.electrum_config.get('sign_processes', 0))
         except InvalidPassword:
             Clock.schedule_once(lambda dt: on_failure(_("Invalid PIN")))
             return
@@ -169,7 +169,7 @@ class TxDialog(Factory.Popup):
 
     def __do_sign(self, password):
         try:
-            self.app.wallet.sign_transaction(self.tx, password)
+            self.app.wallet.sign_transaction(self.tx, password, self.app.electrum_config.get('sign_processes', 0))
         except InvalidPassword:
             self.app.show_error(_("Invalid PIN"))
         self.update()
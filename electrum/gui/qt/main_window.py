@@ -1598,7 +1598,8 @@ class ElectrumWindow(QMainWindow, MessageBoxMixin, PrintError):
             # can sign directly
             task = partial(Transaction.sign, tx, self.tx_external_keypairs)
         else:
-            task = partial(self.wallet.sign_transaction, tx, password)
+            task = partial(self.wallet.sign_transaction, tx, password,
+                           self.config.get('sign_processes', 0))
         msg = _('Signing transaction...')
         WaitingDialog(self, msg, task, on_success, on_failure)
 
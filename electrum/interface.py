@@ -37,6 +37,19 @@ from .util import print_error
 
 ca_path = requests.certs.where()
 
+# Requests are sent as JSON-RPC 2.0 batches of up to this many.
+# A batch size of 1 sends every request on its own. Not all servers
+# support batches, so batching is only used if enabled in the config
+# ('rpc_batch_size').
+DEFAULT_BATCH_SIZE = 1
+# Bounds of the cap on unanswered requests. The cap grows by about one
+# per round trip while the server answers faster than TARGET_LATENCY,
+# and is halved otherwise.
+MIN_IN_FLIGHT = 10
+INITIAL_IN_FLIGHT = 100
+MAX_IN_FLIGHT = 2000
+TARGET_LATENCY = 1.0
+
 from . import util
 from . import x509
 from . import pem
@@ -255,7 +268,8 @@ class Interface(util.PrintError):
     - Member variable server.
     """
 
-    def __init__(self, server, socket):
+    def __init__(self, server, socket, batch_size=DEFAULT_BATCH_SIZE,
+                 max_in_flight=MAX_IN_FLIGHT):
         self.server = server
         self.host, _, _ = server.rsplit(':', 2)
         self.socket = socket
@@ -268,6 +282,12 @@ class Interface(util.PrintError):
         self.unanswered_requests = {}
         self.last_send = time.time()
         self.closed_remotely = False
+        self.batch_size = max(1, batch_size)
+        self.max_in_flight = max(MIN_IN_FLIGHT, max_in_flight)
+        self.in_flight = min(INITIAL_IN_FLIGHT, self.max_in_flight)
+        self.latency = None  # moving average of the round trip time
+        self.send_times = {}  # wire id -> time sent
+        self.last_backoff = 0
 
     def diagnostic_name(self):
         return self.host
@@ -292,18 +312,26 @@ class Interface(util.PrintError):
         self.unsent_requests.append(args)
 
     def num_requests(self):
-        '''Keep unanswered requests below 100'''
-        n = 100 - len(self.unanswered_requests)
-        return min(n, len(self.unsent_requests))
+        '''Keep unanswered requests below self.in_flight'''
+        n = int(self.in_flight) - len(self.unanswered_requests)
+        return max(0, min(n, len(self.unsent_requests)))
 
     def send_requests(self):
         '''Sends queued requests.  Returns False on failure.'''
         self.last_send = time.time()
-        make_dict = lambda m, p, i: {'method': m, 'params': p, 'id': i}
+        if self.batch_size > 1:
+            make_dict = lambda m, p, i: {'jsonrpc': '2.0', 'method': m, 'params': p, 'id': i}
+        else:
+            make_dict = lambda m, p, i: {'method': m, 'params': p, 'id': i}
         n = self.num_requests()
         wire_requests = self.unsent_requests[0:n]
+        messages = [make_dict(*r) for r in wire_requests]
+        if self.batch_size > 1:
+            messages = [messages[i:i+self.batch_size]
+                        for i in range(0, len(messages), self.batch_size)]
+            messages = [m[0] if len(m) == 1 else m for m in messages]
         try:
-            self.pipe.send_all([make_dict(*r) for r in wire_requests])
+            self.pipe.send_all(messages)
         except BaseException as e:
             self.print_error("pipe send error:", e)
             return False
@@ -312,8 +340,27 @@ class Interface(util.PrintError):
             if self.debug:
                 self.print_error("-->", request)
             self.unanswered_requests[request[2]] = request
+            self.send_times[request[2]] = self.last_send
         return True
 
+    def update_in_flight(self, rtt):
+        '''Adapts the cap on unanswered requests to the server latency:
+        additive increase while responses are fast, multiplicative
+        decrease (at most once per round trip) when they are slow.
+        Each response adds 1/in_flight, so a full window of responses
+        raises the cap by about one.'''
+        if self.latency is None:
+            self.latency = rtt
+        else:
+            self.latency = 0.9 * self.latency + 0.1 * rtt
+        if self.latency < TARGET_LATENCY:
+            self.in_flight = min(self.max_in_flight, self.in_flight + 1 / self.in_flight)
+        else:
+            now = time.time()
+            if now - self.last_backoff > self.latency:
+                self.last_backoff = now
+                self.in_flight = max(MIN_IN_FLIGHT, self.in_flight / 2)
+
     def ping_required(self):
         '''Returns True if a ping should be sent.'''
         return time.time() - self.last_send > 300
@@ -342,27 +389,46 @@ class Interface(util.PrintError):
                 response = self.pipe.get()
             except util.timeout:
                 break
-            if not type(response) is dict:
+            if type(response) is list and response:  # batch response
+                batch = response
+            elif type(response) is dict:
+                batch = [response]
+            else:
                 responses.append((None, None))
                 if response is None:
                     self.closed_remotely = True
                     self.print_error("connection closed remotely")
                 break
+            if not self.add_responses(batch, responses):
+                break
+
+        return responses
+
+    def add_responses(self, batch, responses):
+        '''Pairs the messages of batch with their requests, and appends
+        them to responses.  Returns False if the server misbehaved.'''
+        now = time.time()
+        for response in batch:
+            if not type(response) is dict:
+                responses.append((None, None))
+                return False
             if self.debug:
                 self.print_error("<--", response)
             wire_id = response.get('id', None)
             if wire_id is None:  # Notification
                 responses.append((None, response))
+                continue
+            request = self.unanswered_requests.pop(wire_id, None)
+            if request:
+                responses.append((request, response))
+                sent = self.send_times.pop(wire_id, None)
+                if sent is not None:
+                    self.update_in_flight(now - sent)
             else:
-                request = self.unanswered_requests.pop(wire_id, None)
-                if request:
-                    responses.append((request, response))
-                else:
-                    self.print_error("unknown wire ID", wire_id)
-                    responses.append((None, None)) # Signal
-                    break
-
-        return responses
+                self.print_error("unknown wire ID", wire_id)
+                responses.append((None, None)) # Signal
+                return False
+        return True
 
 
 def check_cert(host, cert):
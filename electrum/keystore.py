@@ -100,7 +100,7 @@ class Software_KeyStore(KeyStore):
         decrypted = ec.decrypt_message(message)
         return decrypted
 
-    def sign_transaction(self, tx, password):
+    def sign_transaction(self, tx, password, num_processes=0):
         if self.is_watching_only():
             return
         # Raise if password is not correct.
@@ -111,7 +111,7 @@ class Software_KeyStore(KeyStore):
             keypairs[k] = self.get_private_key(v, password)
         # Sign
         if keypairs:
-            tx.sign(keypairs)
+            tx.sign(keypairs, num_processes)
 
 
 class Imported_KeyStore(Software_KeyStore):
@@ -165,9 +165,8 @@ class Imported_KeyStore(Software_KeyStore):
         return privkey, compressed
 
     def get_pubkey_derivation(self, x_pubkey):
-        if x_pubkey[0:2] in ['02', '03', '04']:
-            if x_pubkey in self.keypairs.keys():
-                return x_pubkey
+        if x_pubkey in self.keypairs:
+            return x_pubkey
         elif x_pubkey[0:2] == 'fd':
             addr = bitcoin.script_to_address(x_pubkey[2:])
             if addr in self.addresses:
@@ -226,19 +225,56 @@ class Xpub:
         self.xpub = None
         self.xpub_receive = None
         self.xpub_change = None
+        # for_change -> (cK, c) of the branch node, and index -> pubkey
+        self._branch_nodes = {}
+        self._derived_pubkeys = {0: {}, 1: {}}
+        # reverse indexes: pubkey or x_pubkey -> derivation
+        self._pubkey_derivations = {}
+        self._xpubkey_derivations = {}
+        self._xpubkey_prefix = (None, None)  # (xpub, 'ff' + hex of serialized xpub)
 
     def get_master_public_key(self):
         return self.xpub
 
+    def get_branch_node(self, for_change):
+        for_change = int(for_change)
+        node = self._branch_nodes.get(for_change)
+        if node is None:
+            xpub = self.xpub_change if for_change else self.xpub_receive
+            if xpub is None:
+                xpub = bip32_public_derivation(self.xpub, "", "/%d"%for_change)
+                if for_change:
+                    self.xpub_change = xpub
+                else:
+                    self.xpub_receive = xpub
+            _, _, _, _, c, cK = deserialize_xpub(xpub)
+            node = self._branch_nodes[for_change] = (cK, c)
+        return node
+
     def derive_pubkey(self, for_change, n):
-        xpub = self.xpub_change if for_change else self.xpub_receive
-        if xpub is None:
-            xpub = bip32_public_derivation(self.xpub, "", "/%d"%for_change)
-            if for_change:
-                self.xpub_change = xpub
-            else:
-                self.xpub_receive = xpub
-        return self.get_pubkey_from_xpub(xpub, (n,))
+        pubkey = self._derived_pubkeys[int(for_change)].get(n)
+        if pubkey is None:
+            pubkey = self.derive_pubkey_range(for_change, n, n + 1)[0]
+        return pubkey
+
+    def derive_pubkey_range(self, for_change, start, stop):
+        derived = self._derived_pubkeys[int(for_change)]
+        missing = [n for n in range(start, stop) if n not in derived]
+        if missing:
+            cK, c = self.get_branch_node(for_change)
+            for n, pubkey in zip(missing, CKD_pub_many(cK, c, missing)):
+                self.add_derived_pubkey(for_change, n, bh2u(pubkey))
+        return [derived[n] for n in range(start, stop)]
+
+    def add_derived_pubkey(self, for_change, n, pubkey):
+        self._derived_pubkeys[int(for_change)][n] = pubkey
+        self.add_pubkey_derivation(for_change, n, pubkey)
+
+    def add_pubkey_derivation(self, for_change, n, pubkey):
+        """Lets get_pubkey_derivation recognize a pubkey that was derived
+        earlier, e.g. read from the wallet file. Unlike add_derived_pubkey,
+        derive_pubkey will not return it."""
+        self._pubkey_derivations[pubkey] = [int(for_change), n]
 
     @classmethod
     def get_pubkey_from_xpub(self, xpub, sequence):
@@ -247,9 +283,18 @@ class Xpub:
             cK, c = CKD_pub(cK, c, i)
         return bh2u(cK)
 
+    def get_xpubkey_prefix(self):
+        if self._xpubkey_prefix[0] != self.xpub:
+            prefix = 'ff' + bh2u(bitcoin.DecodeBase58Check(self.xpub))
+            self._xpubkey_prefix = (self.xpub, prefix)
+            self._xpubkey_derivations = {}
+        return self._xpubkey_prefix[1]
+
     def get_xpubkey(self, c, i):
         s = ''.join(map(lambda x: bitcoin.int_to_hex(x,2), (c, i)))
-        return 'ff' + bh2u(bitcoin.DecodeBase58Check(self.xpub)) + s
+        x_pubkey = self.get_xpubkey_prefix() + s
+        self._xpubkey_derivations[x_pubkey] = [int(c), i]
+        return x_pubkey
 
     @classmethod
     def parse_xpubkey(self, pubkey):
@@ -267,12 +312,18 @@ class Xpub:
         return xkey, s
 
     def get_pubkey_derivation(self, x_pubkey):
-        if x_pubkey[0:2] != 'ff':
-            return
-        xpub, derivation = self.parse_xpubkey(x_pubkey)
-        if self.xpub != xpub:
-            return
-        return derivation
+        # compares the serialized xpub in x_pubkey with ours as hex,
+        # instead of base58-encoding it
+        prefix = self.get_xpubkey_prefix()
+        derivation = self._xpubkey_derivations.get(x_pubkey)
+        if derivation is None:
+            if not x_pubkey.startswith(prefix):
+                return
+            dd = x_pubkey[len(prefix):]
+            assert len(dd) == 8
+            derivation = [int(bitcoin.rev_hex(dd[0:4]), 16), int(bitcoin.rev_hex(dd[4:8]), 16)]
+            self._xpubkey_derivations[x_pubkey] = derivation
+        return list(derivation)
 
 
 class BIP32_KeyStore(Deterministic_KeyStore, Xpub):
@@ -333,6 +384,13 @@ class BIP32_KeyStore(Deterministic_KeyStore, Xpub):
         pk = bip32_private_key(sequence, k, c)
         return pk, True
 
+    def get_pubkey_derivation(self, x_pubkey):
+        # plain pubkeys of addresses we have derived are recognized too
+        derivation = self._pubkey_derivations.get(x_pubkey)
+        if derivation is not None:
+            return list(derivation)
+        return Xpub.get_pubkey_derivation(self, x_pubkey)
+
 
 
 class Old_KeyStore(Deterministic_KeyStore):
@@ -406,6 +464,9 @@ class Old_KeyStore(Deterministic_KeyStore):
     def derive_pubkey(self, for_change, n):
         return self.get_pubkey_from_mpk(self.mpk, for_change, n)
 
+    def derive_pubkey_range(self, for_change, start, stop):
+        return [self.derive_pubkey(for_change, n) for n in range(start, stop)]
+
     def get_private_key_from_stretched_exponent(self, for_change, n, secexp):
         secexp = (secexp + self.get_sequence(self.mpk, for_change, n)) % ecc.CURVE_ORDER
         pk = number_to_string(secexp, ecc.CURVE_ORDER)
@@ -22,11 +22,11 @@
 # SOFTWARE.
 import time
 import queue
+import asyncio
+import itertools
 import os
-import errno
 import random
 import re
-import select
 from collections import defaultdict
 import threading
 import socket
@@ -43,7 +43,7 @@ from .util import print_error
 from . import bitcoin
 from .bitcoin import COIN
 from . import constants
-from .interface import Connection, Interface
+from .interface import Connection, Interface, DEFAULT_BATCH_SIZE, MAX_IN_FLIGHT
 from . import blockchain
 from .version import ELECTRUM_VERSION, PROTOCOL_VERSION
 from .i18n import _
@@ -52,6 +52,15 @@ from .blockchain import InvalidHeader
 
 NODES_RETRY_INTERVAL = 60
 SERVER_RETRY_INTERVAL = 10
+# the network loop is woken up by socket and send events; this is
+# how often it runs when none happen
+MAINTENANCE_INTERVAL = 1.0
+# number of header chunks requested at once while catching up
+CHUNK_PIPELINE = 8
+# chunk requests are sent to another server after this many seconds
+CHUNK_TIMEOUT = 60
+# headers written are flushed to disk at most this often
+HEADERS_SYNC_INTERVAL = 5
 
 
 def parse_servers(result):
@@ -158,12 +167,30 @@ def serialize_server(host, port, protocol):
     return str(':'.join([host, port, protocol]))
 
 
+class SocketQueue(queue.Queue):
+    '''Queue of (server, socket) from Connection threads.
+    Wakes up the network loop when a connection is made.'''
+
+    def __init__(self, wakeup):
+        queue.Queue.__init__(self)
+        self.wakeup = wakeup
+
+    def put(self, item, *args, **kwargs):
+        queue.Queue.put(self, item, *args, **kwargs)
+        self.wakeup()
+
+
 class Network(util.DaemonThread):
     """The Network class manages a set of connections to remote electrum
     servers, each connected socket is handled by an Interface() object.
     Connections are initiated by a Connection() thread which stops once
     the connection succeeds or fails.
 
+    The network thread runs an asyncio event loop that reads from, and
+    writes to, the sockets of all interfaces as they become ready.
+    Other threads talk to it through send() and the callbacks, which
+    wake the loop up.
+
     Our external API:
 
     - Member functions get_header(), get_interfaces(), get_local_height(),
@@ -235,8 +262,19 @@ class Network(util.DaemonThread):
         self.interfaces = {}               # note: needs self.interface_lock
         self.auto_connect = self.config.get('auto_connect', True)
         self.connecting = set()
-        self.requested_chunks = set()
-        self.socket_queue = queue.Queue()
+        # chunk index -> (server, owner, time requested); owner is the
+        # interface whose blockchain the chunk is for
+        self.requested_chunks = {}
+        # chunk index -> (server, owner, hexdata), waiting for the previous chunks
+        self.received_chunks = {}
+        self.chunk_pipeline = self.config.get('chunk_pipeline', CHUNK_PIPELINE)
+        self.headers_sync_time = time.time()
+        # event loop, owned by the network thread
+        self.loop = None
+        self.wakeup_event = None
+        self.watched = {}  # interface -> fd registered with the loop
+        self.writing = set()  # interfaces watched for writability
+        self.socket_queue = SocketQueue(self.wakeup)
         self.start_network(deserialize_server(self.default_server)[2],
                            deserialize_proxy(self.config.get('proxy')))
 
@@ -330,6 +368,8 @@ class Network(util.DaemonThread):
         if self.debug:
             self.print_error(interface.host, "-->", method, params, message_id)
         interface.queue_request(method, params, message_id)
+        if threading.current_thread() is not self:
+            self.wakeup()
         return message_id
 
     @with_interface_lock
@@ -508,7 +548,7 @@ class Network(util.DaemonThread):
         assert not self.interfaces
         self.connecting = set()
         # Get a new queue - no old pending connections thanks!
-        self.socket_queue = queue.Queue()
+        self.socket_queue = SocketQueue(self.wakeup)
 
     def set_parameters(self, host, port, protocol, proxy, auto_connect):
         proxy_str = serialize_proxy(proxy)
@@ -590,7 +630,9 @@ class Network(util.DaemonThread):
                 self.interfaces.pop(interface.server)
             if interface.server == self.default_server:
                 self.interface = None
-            interface.close()
+            # the socket must be unregistered from the loop before it is
+            # closed, as its fd may otherwise be reused by a new socket
+            self.call_in_loop(self.unwatch_interface, interface)
 
     @with_recent_servers_lock
     def add_recent_server(self, server):
@@ -716,6 +758,7 @@ class Network(util.DaemonThread):
         messages = list(messages)
         with self.pending_sends_lock:
             self.pending_sends.append((messages, callback))
+        self.wakeup()
 
     @with_interface_lock
     def process_pending_sends(self):
@@ -777,7 +820,9 @@ class Network(util.DaemonThread):
     def new_interface(self, server, socket):
         # todo: get tip first, then decide which checkpoint to use.
         self.add_recent_server(server)
-        interface = Interface(server, socket)
+        interface = Interface(server, socket,
+                              batch_size=self.config.get('rpc_batch_size', DEFAULT_BATCH_SIZE),
+                              max_in_flight=self.config.get('rpc_max_in_flight', MAX_IN_FLIGHT))
         interface.blockchain = None
         interface.tip_header = None
         interface.tip = 0
@@ -844,43 +889,157 @@ class Network(util.DaemonThread):
                     self.request_fee_estimates()
 
     def request_chunk(self, interface, index):
-        if index in self.requested_chunks:
+        if index in self.requested_chunks or index in self.received_chunks:
             return
+        if interface.mode == 'catch_up' and index >= len(interface.blockchain.checkpoints):
+            self.request_next_chunks(interface, index)
+        else:
+            self.send_chunk_request(interface, index)
+
+    def request_next_chunks(self, owner, index):
+        '''Keeps up to self.chunk_pipeline chunks in flight while owner is
+        catching up, starting at index.'''
+        last = owner.tip // 2016
+        pending = [i for i, r in itertools.chain(self.requested_chunks.items(),
+                                                  self.received_chunks.items())
+                   if r[1] is owner]
+        n = self.chunk_pipeline - len(pending)
+        while n > 0 and index <= last:
+            if index not in self.requested_chunks and index not in self.received_chunks:
+                if not self.send_chunk_request(owner, index):
+                    break
+                n -= 1
+            index += 1
+
+    @with_interface_lock
+    def pick_chunk_server(self, owner, index, exclude=()):
+        '''Returns the least busy interface that has all the headers of
+        chunk index, preferring owner.'''
+        last_height = index * 2016 + 2015
+        load = defaultdict(int)
+        for server, _, _ in self.requested_chunks.values():
+            load[server] += 1
+        candidates = [i for i in self.interfaces.values()
+                      if i.server not in exclude and (
+                          i is owner or (i.tip >= last_height and i.blockchain is not None
+                                         and self.same_headers(i.blockchain, owner.blockchain,
+                                                               last_height)))]
+        if not candidates:
+            return None
+        return min(candidates, key=lambda i: (load[i.server], i is not owner))
+
+    @staticmethod
+    def same_headers(a, b, height):
+        '''Whether blockchains a and b have the same headers up to height,
+        i.e. whether they fork above it.'''
+        while height < a.checkpoint:
+            a = a.parent()
+        while height < b.checkpoint:
+            b = b.parent()
+        return a is b
+
+    def on_bad_chunk(self, owner, index, server):
+        '''A chunk for owner did not connect. If owner sent it, its chain
+        is wrong; else the server may just be on another branch, and the
+        chunk is asked from someone else.'''
+        if server == owner.server:
+            self.connection_down(server)
+        elif owner.server in self.interfaces:
+            self.send_chunk_request(owner, index, exclude={server})
+
+    def send_chunk_request(self, owner, index, exclude=()):
+        interface = self.pick_chunk_server(owner, index, exclude)
+        if interface is None:
+            owner.print_error("no server for chunk %d" % index)
+            return False
         interface.print_error("requesting chunk %d" % index)
-        self.requested_chunks.add(index)
+        self.requested_chunks[index] = (interface.server, owner, time.time())
         height = index * 2016
         self.queue_request('blockchain.block.headers', [height, 2016],
                            interface)
+        return True
+
+    def retry_chunk(self, index, server):
+        '''Requests chunk index again, from another server than server.'''
+        r = self.requested_chunks.pop(index, None)
+        if r is None:
+            return
+        owner = r[1]
+        if owner.server not in self.interfaces:
+            return
+        if index < len(owner.blockchain.checkpoints):
+            # wanted by the verifier, which will ask again
+            return
+        if not self.send_chunk_request(owner, index, exclude={server}):
+            self.send_chunk_request(owner, index)
+
+    def maintain_chunk_requests(self):
+        now = time.time()
+        for index, (server, owner, t) in list(self.requested_chunks.items()):
+            if owner.server not in self.interfaces:
+                self.requested_chunks.pop(index)
+            elif server not in self.interfaces or now - t > CHUNK_TIMEOUT:
+                self.print_error("chunk %d from %s timed out" % (index, server))
+                self.retry_chunk(index, server)
+        for index, (server, owner, hexdata) in list(self.received_chunks.items()):
+            if owner.server not in self.interfaces:
+                self.received_chunks.pop(index)
 
     def on_block_headers(self, interface, response):
         '''Handle receiving a chunk of block headers'''
         error = response.get('error')
         result = response.get('result')
         params = response.get('params')
-        blockchain = interface.blockchain
-        if result is None or params is None or error is not None:
-            interface.print_error(error or 'bad response')
+        if params is None:
+            interface.print_error('bad response')
             return
         # Ignore unsolicited chunks
         height = params[0]
         index = height // 2016
-        if index * 2016 != height or index not in self.requested_chunks:
+        r = self.requested_chunks.get(index)
+        if index * 2016 != height or r is None or r[0] != interface.server:
             interface.print_error("received chunk %d (unsolicited)" % index)
             return
-        else:
-            interface.print_error("received chunk %d" % index)
-        self.requested_chunks.remove(index)
-        hexdata = result['hex']
-        connect = blockchain.connect_chunk(index, hexdata)
-        if not connect:
-            self.connection_down(interface.server)
+        if result is None or error is not None:
+            interface.print_error(error or 'bad response')
+            self.retry_chunk(index, interface.server)
             return
-        # If not finished, get the next chunk
-        if index >= len(blockchain.checkpoints) and blockchain.height() < interface.tip:
-            self.request_chunk(interface, index+1)
+        interface.print_error("received chunk %d" % index)
+        owner = r[1]
+        self.requested_chunks.pop(index)
+        blockchain = owner.blockchain
+        if index < len(blockchain.checkpoints):
+            # anchored on both ends by checkpoints, so it can be
+            # connected in any order
+            if not blockchain.connect_chunk(index, result['hex']):
+                self.on_bad_chunk(owner, index, interface.server)
+            self.notify('updated')
+            return
+        self.received_chunks[index] = (interface.server, owner, result['hex'])
+        self.connect_received_chunks(owner)
+
+    def connect_received_chunks(self, owner):
+        '''Connects the chunks received for owner that follow its chain tip'''
+        blockchain = owner.blockchain
+        connected = False
+        while True:
+            index = (blockchain.height() + 1) // 2016
+            r = self.received_chunks.get(index)
+            if r is None or r[1] is not owner:
+                break
+            server, _, hexdata = self.received_chunks.pop(index)
+            if not blockchain.connect_chunk(index, hexdata):
+                self.on_bad_chunk(owner, index, server)
+                break
+            connected = True
+        if not connected:
+            return
+        # If not finished, get the next chunks
+        if blockchain.height() < owner.tip:
+            self.request_next_chunks(owner, (blockchain.height() + 1) // 2016)
         else:
-            interface.mode = 'default'
-            interface.print_error('catch up done', blockchain.height())
+            owner.mode = 'default'
+            owner.print_error('catch up done', blockchain.height())
             blockchain.catch_up = None
         self.notify('updated')
 
@@ -1023,28 +1182,84 @@ class Network(util.DaemonThread):
                 interface.print_error("blockchain request timed out")
                 self.connection_down(interface.server)
                 continue
+        self.maintain_chunk_requests()
+        if time.time() - self.headers_sync_time > HEADERS_SYNC_INTERVAL:
+            self.sync_headers()
 
-    def wait_on_sockets(self):
-        # Python docs say Windows doesn't like empty selects.
-        # Sleep to prevent busy looping
-        if not self.interfaces:
-            time.sleep(0.1)
+    def sync_headers(self):
+        self.headers_sync_time = time.time()
+        with self.blockchains_lock:
+            chains = list(self.blockchains.values())
+        for b in chains:
+            b.sync()
+
+    def wakeup(self):
+        '''Wakes up the network loop. Can be called from any thread.'''
+        loop = self.loop
+        if loop is None:
             return
-        with self.interface_lock:
-            interfaces = list(self.interfaces.values())
-        rin = [i for i in interfaces]
-        win = [i for i in interfaces if i.num_requests()]
         try:
-            rout, wout, xout = select.select(rin, win, [], 0.1)
-        except socket.error as e:
-            if e.errno == errno.EINTR:
+            loop.call_soon_threadsafe(self.wakeup_event.set)
+        except RuntimeError:
+            pass  # loop closed
+
+    def call_in_loop(self, func, *args):
+        '''Calls func in the network thread, or right away if the loop
+        is not running.'''
+        loop = self.loop
+        if loop is not None and threading.current_thread() is not self:
+            try:
+                loop.call_soon_threadsafe(func, *args)
                 return
-            raise
-        assert not xout
-        for interface in wout:
-            interface.send_requests()
-        for interface in rout:
-            self.process_responses(interface)
+            except RuntimeError:
+                pass  # loop closed
+        func(*args)
+
+    def watch_interfaces(self):
+        '''Registers the sockets of new interfaces with the loop, and
+        watches for writability the ones that have requests to send.'''
+        with self.interface_lock:
+            interfaces = list(self.interfaces.values())
+        for interface in interfaces:
+            fd = self.watched.get(interface)
+            if fd is None:
+                fd = self.watched[interface] = interface.fileno()
+                self.loop.add_reader(fd, self.on_readable, interface)
+            if interface.num_requests():
+                if interface not in self.writing:
+                    self.writing.add(interface)
+                    self.loop.add_writer(fd, self.on_writable, interface)
+            elif interface in self.writing:
+                self.writing.remove(interface)
+                self.loop.remove_writer(fd)
+
+    def unwatch_interface(self, interface):
+        fd = self.watched.pop(interface, None)
+        if fd is not None and self.loop is not None:
+            self.loop.remove_reader(fd)
+            self.loop.remove_writer(fd)
+        self.writing.discard(interface)
+        interface.close()
+
+    def is_open(self, interface):
+        # an interface closed by connection_down stays registered with
+        # the loop until unwatch_interface runs, and may fire until then
+        return self.interfaces.get(interface.server) is interface
+
+    def on_readable(self, interface):
+        if not self.is_open(interface):
+            return
+        self.process_responses(interface)
+        # let jobs see the responses, and send what they queued
+        self.wakeup_event.set()
+
+    def on_writable(self, interface):
+        if not self.is_open(interface):
+            return
+        interface.send_requests()
+        if not interface.num_requests():
+            self.writing.discard(interface)
+            self.loop.remove_writer(self.watched[interface])
 
     def init_headers_file(self):
         b = self.blockchains[0]
@@ -1060,14 +1275,35 @@ class Network(util.DaemonThread):
 
     def run(self):
         self.init_headers_file()
+        loop = asyncio.SelectorEventLoop()
+        asyncio.set_event_loop(loop)
+        try:
+            loop.run_until_complete(self.main_loop(loop))
+            self.stop_network()
+            self.sync_headers()
+        finally:
+            self.loop = None
+            loop.close()
+        self.on_stop()
+
+    async def main_loop(self, loop):
+        self.wakeup_event = asyncio.Event()
+        self.loop = loop
         while self.is_running():
             self.maintain_sockets()
-            self.wait_on_sockets()
             self.maintain_requests()
             self.run_jobs()    # Synchronizer and Verifier
             self.process_pending_sends()
-        self.stop_network()
-        self.on_stop()
+            self.watch_interfaces()
+            try:
+                await asyncio.wait_for(self.wakeup_event.wait(), MAINTENANCE_INTERVAL)
+            except asyncio.TimeoutError:
+                pass
+            self.wakeup_event.clear()
+
+    def stop(self):
+        util.DaemonThread.stop(self)
+        self.wakeup()
 
     def on_notify_header(self, interface, header_dict):
         try:
@@ -1205,6 +1441,9 @@ class Network(util.DaemonThread):
         hash2address = {
             bitcoin.address_to_scripthash(address): address
             for address in addresses}
+        self.subscribe_to_scripthashes(hash2address, callback)
+
+    def subscribe_to_scripthashes(self, hash2address, callback):
         self.h2addr.update(hash2address)
         msgs = [
             ('blockchain.scripthash.subscribe', [x])
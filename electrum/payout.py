@@ -0,0 +1,164 @@
+# Electrum - Lightweight Bitcoin Client
+# Copyright (c) 2018 The Electrum developers
+#
+# Permission is hereby granted, free of charge, to any person
+# obtaining a copy of this software and associated documentation files
+# (the "Software"), to deal in the Software without restriction,
+# including without limitation the rights to use, copy, modify, merge,
+# publish, distribute, sublicense, and/or sell copies of the Software,
+# and to permit persons to whom the Software is furnished to do so,
+# subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be
+# included in all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+# EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF
+# MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND
+# NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS
+# BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN
+# ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN
+# CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+import queue
+import threading
+from collections import deque
+
+from .bitcoin import TYPE_ADDRESS
+from .simple_config import SimpleConfig
+from .util import NotEnoughFunds, NoDynamicFeeEstimates, PrintError
+from .wallet import coin_key, MAX_RESERVE_ATTEMPTS
+
+
+class PayoutEngine(PrintError):
+    """Pays a list of payments with as few transactions as the limits
+    allow. Coins are read from the wallet once per run, and reserved in
+    the wallet as they are spent, so that runs in parallel never spend
+    the same coin. Each transaction is signed and broadcast by worker
+    threads while the next one is built."""
+
+    def __init__(self, wallet, config, network=None, *, fee_per_kb=None,
+                 max_outputs=100, max_size=100000, rbf=True):
+        self.wallet = wallet
+        self.config = config
+        self.network = network
+        self.max_outputs = max_outputs
+        self.max_size = max_size  # in vbytes
+        self.rbf = rbf
+        if fee_per_kb is None:
+            fee_per_kb = config.fee_per_kb()
+            if fee_per_kb is None:
+                raise NoDynamicFeeEstimates()
+        self.fee_per_kb = fee_per_kb
+
+    def diagnostic_name(self):
+        return 'Payout'
+
+    def fee_estimator(self, size):
+        return SimpleConfig.estimate_fee_for_feerate(self.fee_per_kb, size)
+
+    def build(self, payments, results):
+        '''Yields (indices of payments, unsigned transaction), with the
+        coins of each transaction reserved.'''
+        coins = self.wallet.get_spendable_coins(None, self.config)
+        attempts = {}  # batch -> failed reservations
+        batches = deque(list(range(i, min(i + self.max_outputs, len(payments))))
+                        for i in range(0, len(payments), self.max_outputs))
+        while batches:
+            batch = batches.popleft()
+            outputs = [(TYPE_ADDRESS,) + tuple(payments[i]) for i in batch]
+            try:
+                tx = self.wallet.make_unsigned_transaction(
+                    coins, outputs, self.config, fixed_fee=self.fee_estimator)
+            except NotEnoughFunds:
+                self.set_error(results, batch, 'Insufficient funds')
+                continue
+            except Exception as e:
+                self.set_error(results, batch, str(e))
+                continue
+            if tx.estimated_size() > self.max_size and len(batch) > 1:
+                # try again with half the payments in each transaction
+                half = len(batch) // 2
+                batches.extendleft([batch[half:], batch[:half]])
+                continue
+            if not self.wallet.reserve_coins(tx.inputs()):
+                # reserved by another run since we got the coins
+                coins = self.wallet.get_spendable_coins(None, self.config)
+                key = tuple(batch)
+                attempts[key] = attempts.get(key, 0) + 1
+                if attempts[key] >= MAX_RESERVE_ATTEMPTS:
+                    self.set_error(results, batch, 'Could not reserve coins, they are being spent by other transactions')
+                    continue
+                batches.appendleft(batch)
+                continue
+            spent = set(coin_key(txin) for txin in tx.inputs())
+            coins = [coin for coin in coins if coin_key(coin) not in spent]
+            yield batch, tx
+
+    def sign_loop(self, inbox, outbox, password, results):
+        while True:
+            item = inbox.get()
+            if item is None:
+                outbox.put(None)
+                return
+            batch, tx = item
+            try:
+                if self.rbf:
+                    tx.set_rbf(True)
+                self.wallet.sign_transaction(tx, password, self.config.get('sign_processes', 0))
+                if not tx.is_complete():
+                    raise Exception('Transaction not signed')
+            except BaseException as e:
+                self.wallet.release_coins(tx.inputs())
+                self.set_error(results, batch, str(e))
+                continue
+            outbox.put(item)
+
+    def broadcast_loop(self, inbox, results):
+        while True:
+            item = inbox.get()
+            if item is None:
+                return
+            batch, tx = item
+            if self.network:
+                ok, msg = self.network.broadcast_transaction(tx)
+                if not ok:
+                    self.wallet.release_coins(tx.inputs())
+                    self.set_error(results, batch, msg)
+                    continue
+            txid = tx.txid()
+            self.print_error('paid %d outputs with' % len(batch), txid)
+            for i in batch:
+                results[i]['txid'] = txid
+                if not self.network:
+                    results[i]['hex'] = str(tx)
+
+    def set_error(self, results, batch, msg):
+        self.print_error('could not pay %d outputs:' % len(batch), msg)
+        for i in batch:
+            results[i]['error'] = msg
+
+    def run(self, payments, password=None):
+        '''payments is a list of (address, amount in satoshis). Returns a
+        dict per payment, in the same order, with the txid of the
+        transaction that pays it, or an error. Transactions are broadcast
+        if there is a network, else their hex is returned.'''
+        results = [{'address': address, 'amount': amount, 'txid': None}
+                   for address, amount in payments]
+        sign_queue, broadcast_queue = queue.Queue(), queue.Queue()
+        workers = [
+            threading.Thread(target=self.sign_loop,
+                             args=(sign_queue, broadcast_queue, password, results)),
+            threading.Thread(target=self.broadcast_loop,
+                             args=(broadcast_queue, results)),
+        ]
+        for worker in workers:
+            worker.start()
+        try:
+            for item in self.build(payments, results):
+                sign_queue.put(item)
+        finally:
+            sign_queue.put(None)
+            for worker in workers:
+                worker.join()
+        return results
@@ -5,6 +5,7 @@ import traceback
 
 from electrum import bitcoin
 from electrum.bitcoin import TYPE_ADDRESS, int_to_hex, var_int
+from electrum.crypto import hash_160
 from electrum.i18n import _
 from electrum.plugin import BasePlugin
 from electrum.keystore import Hardware_KeyStore
@@ -104,9 +105,7 @@ class Ledger_Client():
             prevPath = "/".join(splitPath[0:len(splitPath) - 1])
             nodeData = self.dongleObject.getWalletPublicKey(prevPath)
             publicKey = compress_public_key(nodeData['publicKey'])
-            h = hashlib.new('ripemd160')
-            h.update(hashlib.sha256(publicKey).digest())
-            fingerprint = unpack(">I", h.digest()[0:4])[0]
+            fingerprint = unpack(">I", hash_160(publicKey)[0:4])[0]
         nodeData = self.dongleObject.getWalletPublicKey(bip32_path)
         publicKey = compress_public_key(nodeData['publicKey'])
         depth = len(splitPath)
@@ -0,0 +1,96 @@
+#!/usr/bin/env python3
+
+# Subscribes to the scripthashes of a large wallet through an Interface
+# connected to a local mock server, with and without JSON-RPC batching.
+# The mock server answers each message after a fixed delay, to simulate
+# the round trip to a remote server.
+# usage: python3 -m electrum.scripts.bench_batch_rpc [num_addresses] [rtt_ms]
+
+import json
+import queue
+import select
+import socket
+import sys
+import threading
+import time
+
+from electrum.interface import Interface, MAX_IN_FLIGHT
+from electrum.crypto import sha256
+from electrum.util import bh2u
+
+BATCH_SIZE = 50
+
+
+def answer(request):
+    return {'jsonrpc': '2.0', 'id': request['id'], 'result': None}
+
+
+def mock_server(sock, rtt):
+    conn, _ = sock.accept()
+    out = queue.Queue()
+
+    def writer():
+        while True:
+            t, data = out.get()
+            if data is None:
+                return
+            delay = t + rtt - time.time()
+            if delay > 0:
+                time.sleep(delay)
+            conn.sendall(data)
+    threading.Thread(target=writer, daemon=True).start()
+
+    buf = b''
+    while True:
+        data = conn.recv(65536)
+        if not data:
+            out.put((0, None))
+            return
+        buf += data
+        *lines, buf = buf.split(b'\n')
+        now = time.time()
+        for line in lines:
+            msg = json.loads(line.decode('utf8'))
+            if type(msg) is list:
+                response = [answer(r) for r in msg]
+            else:
+                response = answer(msg)
+            out.put((now, (json.dumps(response) + '\n').encode('utf8')))
+
+
+def run(num_addresses, rtt, batch_size, max_in_flight):
+    server = socket.socket()
+    server.bind(('127.0.0.1', 0))
+    server.listen(1)
+    threading.Thread(target=mock_server, args=(server, rtt), daemon=True).start()
+    s = socket.create_connection(server.getsockname())
+    interface = Interface('127.0.0.1:%d:t' % server.getsockname()[1], s,
+                          batch_size=batch_size, max_in_flight=max_in_flight)
+    for i in range(num_addresses):
+        h = bh2u(sha256(str(i).encode()))
+        interface.queue_request('blockchain.scripthash.subscribe', [h], i)
+    t0 = time.time()
+    received = 0
+    while received < num_addresses:
+        w = [interface] if interface.num_requests() else []
+        r, w, x = select.select([interface], w, [], 0.1)
+        if w:
+            interface.send_requests()
+        if r:
+            received += len(interface.get_responses())
+    dt = time.time() - t0
+    interface.close()
+    server.close()
+    return dt, interface.in_flight
+
+
+if __name__ == '__main__':
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 20000
+    rtt = (float(sys.argv[2]) if len(sys.argv) > 2 else 20) / 1000
+    print('%d addresses, %d ms round trip' % (n, rtt * 1000))
+    for name, batch_size, max_in_flight in [
+            ('unbatched, 100 in flight', 1, 100),
+            ('batched, 100 in flight', BATCH_SIZE, 100),
+            ('batched, adaptive', BATCH_SIZE, MAX_IN_FLIGHT)]:
+        dt, in_flight = run(n, rtt, batch_size, max_in_flight)
+        print('%-26s %6.2fs  (final cap %d)' % (name, dt, in_flight))
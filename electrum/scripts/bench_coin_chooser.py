@@ -0,0 +1,62 @@
+#!/usr/bin/env python3
+
+# Selects coins from synthetic wallets of p2wpkh and p2pkh coins with
+# each coin chooser, for a few payment amounts. Prints the best of 3
+# selection times, and the size of the resulting transaction.
+# usage: python3 -m electrum.scripts.bench_coin_chooser [num_coins] [repeat]
+
+import random
+import sys
+import time
+
+from electrum.bitcoin import TYPE_ADDRESS, COIN, hash160_to_p2pkh, hash_to_segwit_addr
+from electrum.coinchooser import COIN_CHOOSERS
+from electrum.util import set_verbosity
+
+
+def make_wallet(num_coins, seed=0):
+    r = random.Random(seed)
+    coins = []
+    for i in range(num_coins):
+        h160 = bytes(r.getrandbits(8) for j in range(20))
+        segwit = r.random() < 0.7
+        coins.append({
+            'type': 'p2wpkh' if segwit else 'p2pkh',
+            'address': hash_to_segwit_addr(h160, witver=0) if segwit else hash160_to_p2pkh(h160),
+            'value': int(r.lognormvariate(13, 2)) + 1000,
+            'height': r.randint(0, 500000) if r.random() < 0.95 else 0,
+            'prevout_hash': '%064x' % r.getrandbits(256),
+            'prevout_n': r.randint(0, 3),
+            'num_sig': 1,
+            'signatures': [None],
+            'x_pubkeys': ['02' + '00' * 32],
+        })
+    return coins
+
+
+def fee_estimator(size):
+    return 20 * size
+
+
+if __name__ == '__main__':
+    set_verbosity(False)
+    num_coins = int(sys.argv[1]) if len(sys.argv) > 1 else 10000
+    repeat = int(sys.argv[2]) if len(sys.argv) > 2 else 3
+    coins = make_wallet(num_coins)
+    total = sum(coin['value'] for coin in coins)
+    print('%d coins, %.8f BTC' % (len(coins), total / COIN))
+    recipient = hash160_to_p2pkh(bytes(20))
+    change_addr = hash_to_segwit_addr(bytes(20), witver=0)
+    print('%-15s %12s %8s %7s %7s %8s %8s' % ('chooser', 'amount', 'time s', 'inputs',
+                                              'outputs', 'weight', 'fee'))
+    for amount in [10000, 250000, COIN // 10, COIN, 10 * COIN]:
+        outputs = [(TYPE_ADDRESS, recipient, amount)]
+        for name, klass in sorted(COIN_CHOOSERS.items()):
+            t = float('inf')
+            for i in range(repeat):
+                t0 = time.time()
+                tx = klass().make_tx(coins, outputs, [change_addr], fee_estimator, 546)
+                t = min(t, time.time() - t0)
+            print('%-15s %12d %8.3f %7d %7d %8d %8d' % (name, amount, t, len(tx.inputs()),
+                                                        len(tx.outputs()), tx.estimated_weight(),
+                                                        tx.get_fee()))
@@ -0,0 +1,44 @@
+#!/usr/bin/env python3
+
+# Derives the child pubkeys of a BIP32 branch one index at a time and
+# in one batch, then times the creation of a wallet with a large gap
+# limit, and the lookup of all its pubkeys after reopening it.
+# usage: python3 -m electrum.scripts.bench_derive_addresses [num_keys]
+
+import sys
+import time
+from unittest import mock
+
+from electrum import keystore, storage
+from electrum.bitcoin import CKD_pub, CKD_pub_many, deserialize_xpub
+from electrum.util import set_verbosity
+from electrum.wallet import Standard_Wallet
+
+SEED = 'cycle rocket west magnet parrot shuffle foot correct salt library feed song'
+
+
+def timeit(name, f):
+    t0 = time.time()
+    r = f()
+    print('%-28s %7.3fs' % (name, time.time() - t0))
+    return r
+
+
+if __name__ == '__main__':
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 2000
+    set_verbosity(False)
+    ks = keystore.from_seed(SEED, '', False)
+    _, _, _, _, c, cK = deserialize_xpub(ks.xpub)
+    print('%d keys' % n)
+    one = timeit('CKD_pub, one by one', lambda: [CKD_pub(cK, c, i)[0] for i in range(n)])
+    many = timeit('CKD_pub_many', lambda: CKD_pub_many(cK, c, range(n)))
+    assert one == many
+    with mock.patch.object(storage.WalletStorage, '_write'):
+        store = storage.WalletStorage('/nonexistent/bench_derive_addresses')
+        store.put('keystore', keystore.from_seed(SEED, '', False).dump())
+        store.put('gap_limit', n)
+        wallet = Standard_Wallet(store)
+        timeit('wallet synchronize', wallet.synchronize)
+        wallet = Standard_Wallet(store)
+        addresses = wallet.get_receiving_addresses()
+        timeit('get_public_key, reopened', lambda: [wallet.get_public_key(a) for a in addresses])
@@ -0,0 +1,53 @@
+#!/usr/bin/env python3
+
+# Deserializes a set of transactions, the way a wallet does when it
+# loads them. Prints the best of 3 times, and the peak memory used
+# while all of them are kept parsed. Transactions are read from a file
+# with one raw tx per line, or default to those of the unit tests.
+# usage: python3 -m electrum.scripts.bench_deserialize_tx [txs_file] [num_txs]
+
+import sys
+import time
+import tracemalloc
+
+from electrum.transaction import Transaction
+from electrum.util import set_verbosity
+from electrum.scripts.bench_output_scripts import load_corpus
+
+
+def run(name, corpus, f, repeat=3):
+    t = float('inf')
+    for i in range(repeat):
+        t0 = time.time()
+        txs = [f(raw_tx) for raw_tx in corpus]
+        t = min(t, time.time() - t0)
+        del txs
+    tracemalloc.start()
+    txs = [f(raw_tx) for raw_tx in corpus]
+    size, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    print('%-14s %8.3f s %8.1f MB peak' % (name, t, peak / 1e6))
+
+
+def parse_all(raw_tx):
+    tx = Transaction(raw_tx)
+    tx.deserialize()
+    tx.txid()
+    return tx
+
+
+def parse_outputs(raw_tx):
+    tx = Transaction(raw_tx)
+    tx.outputs()
+    tx.txid()
+    return tx
+
+
+if __name__ == '__main__':
+    set_verbosity(False)
+    corpus = load_corpus(sys.argv[1] if len(sys.argv) > 1 else None)
+    num_txs = int(sys.argv[2]) if len(sys.argv) > 2 else 20000
+    corpus = [corpus[i % len(corpus)] for i in range(num_txs)]
+    print('%d transactions, %.1f MB of hex' % (len(corpus), sum(map(len, corpus)) / 1e6))
+    run('deserialize', corpus, parse_all)
+    run('outputs only', corpus, parse_outputs)
@@ -0,0 +1,30 @@
+#!/usr/bin/env python3
+
+# Times the hash functions used for addresses, with each RIPEMD-160
+# implementation that is available here, on 32 byte inputs like those
+# of hash_160.
+# usage: python3 -m electrum.scripts.bench_hash [repeat]
+
+import os
+import sys
+import time
+
+from electrum import crypto
+
+
+def timeit(name, f, data, repeat):
+    t0 = time.time()
+    for i in range(repeat):
+        f(data)
+    print('%-20s %10.2f us' % (name, (time.time() - t0) / repeat * 1e6))
+
+
+if __name__ == '__main__':
+    repeat = int(sys.argv[1]) if len(sys.argv) > 1 else 10000
+    data = os.urandom(32)
+    print('active ripemd160 backend:', crypto.RIPEMD160_BACKEND)
+    timeit('sha256', crypto.sha256, data, repeat)
+    timeit('Hash (sha256d)', crypto.Hash, data, repeat)
+    timeit('hash_160', crypto.hash_160, data, repeat)
+    for name, ripemd160 in crypto.get_ripemd160_backends().items():
+        timeit('ripemd160 ' + name, ripemd160, data, repeat if name != 'python' else repeat // 10)
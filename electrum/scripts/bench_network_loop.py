@@ -0,0 +1,97 @@
+#!/usr/bin/env python3
+
+# Runs a Network on regtest against a local mock server. Measures the
+# round-trip time of requests sent from another thread, and the CPU
+# used by the network thread while idle.
+# usage: python3 -m electrum.scripts.bench_network_loop [num_requests] [idle_seconds]
+
+import json
+import shutil
+import socket
+import sys
+import tempfile
+import threading
+import time
+
+from electrum import constants
+from electrum.network import Network
+from electrum.simple_config import SimpleConfig
+
+GENESIS_HEX = ('01000000' + '00' * 32 +
+               '3ba3edfd7a7b12b27ac72c3e67768f617fc81bc3888a51323a9fb8aa4b1e5e4a'
+               'dae5494dffff7f2002000000')
+
+RESULTS = {
+    'server.version': ['mock', '1.2'],
+    'blockchain.headers.subscribe': {'hex': GENESIS_HEX, 'height': 0},
+    'server.banner': '',
+    'server.donation_address': '',
+    'server.peers.subscribe': [],
+    'mempool.get_fee_histogram': [],
+    'blockchain.estimatefee': 0.0001,
+    'blockchain.relayfee': 0.00001,
+    'blockchain.scripthash.get_balance': {'confirmed': 0, 'unconfirmed': 0},
+}
+
+
+def answer(request):
+    return {'jsonrpc': '2.0', 'id': request['id'], 'result': RESULTS.get(request['method'])}
+
+
+def serve(conn):
+    buf = b''
+    while True:
+        data = conn.recv(65536)
+        if not data:
+            return
+        buf += data
+        *lines, buf = buf.split(b'\n')
+        for line in lines:
+            msg = json.loads(line.decode('utf8'))
+            response = [answer(r) for r in msg] if type(msg) is list else answer(msg)
+            conn.sendall((json.dumps(response) + '\n').encode('utf8'))
+
+
+def mock_server(sock):
+    while True:
+        try:
+            conn, _ = sock.accept()
+        except OSError:
+            return
+        threading.Thread(target=serve, args=(conn,), daemon=True).start()
+
+
+def thread_cpu_time(thread):
+    return time.clock_gettime(time.pthread_getcpuclockid(thread.ident))
+
+
+if __name__ == '__main__':
+    num_requests = int(sys.argv[1]) if len(sys.argv) > 1 else 200
+    idle = float(sys.argv[2]) if len(sys.argv) > 2 else 5
+    constants.set_regtest()
+    server = socket.socket()
+    server.bind(('127.0.0.1', 0))
+    server.listen(5)
+    threading.Thread(target=mock_server, args=(server,), daemon=True).start()
+    path = tempfile.mkdtemp()
+    try:
+        config = SimpleConfig({'electrum_path': path, 'oneserver': True, 'auto_connect': False,
+                               'server': '127.0.0.1:%d:t' % server.getsockname()[1]})
+        network = Network(config)
+        network.start()
+        while not network.is_connected():
+            time.sleep(0.01)
+        t0 = time.time()
+        for i in range(num_requests):
+            network.get_balance_for_scripthash('%064x' % i)
+        dt = time.time() - t0
+        print('round trip: %.2f ms' % (dt / num_requests * 1000))
+        c0 = thread_cpu_time(network)
+        time.sleep(idle)
+        c1 = thread_cpu_time(network)
+        print('idle CPU:   %.2f%% of a core' % ((c1 - c0) / idle * 100))
+        network.stop()
+        network.join()
+    finally:
+        server.close()
+        shutil.rmtree(path)
@@ -0,0 +1,76 @@
+#!/usr/bin/env python3
+
+# Parses the output scripts of a corpus of mainnet transactions, with the
+# template fast path of get_address_from_output_script and with the
+# generic parser. The corpus is read from a file with one raw tx per line,
+# or defaults to the mainnet transactions of the unit tests.
+# usage: python3 -m electrum.scripts.bench_output_scripts [txs_file] [repeat]
+
+import os
+import re
+import sys
+import time
+from collections import defaultdict
+
+import electrum
+from electrum.bitcoin import TYPE_PUBKEY, TYPE_SCRIPT
+from electrum.transaction import (Transaction, get_address_from_output_script,
+                                  get_address_from_output_script_generic)
+from electrum.util import bfh, set_verbosity
+
+
+def load_corpus(path=None):
+    if path:
+        with open(path) as f:
+            return [line.strip() for line in f if line.strip()]
+    path = os.path.join(os.path.dirname(electrum.__file__), 'tests', 'test_transaction.py')
+    with open(path) as f:
+        source = f.read()
+    # the testnet transactions come after this class
+    source = source.split('class TestTransactionTestnet')[0]
+    return re.findall(r"raw_tx = '([0-9a-f]+)'", source)
+
+
+def template(script):
+    _type, addr = get_address_from_output_script_generic(script)
+    if _type == TYPE_PUBKEY:
+        return 'p2pk'
+    if _type == TYPE_SCRIPT:
+        return 'other'
+    if script[0] == 0x76:
+        return 'p2pkh'
+    if script[0] == 0xa9:
+        return 'p2sh'
+    if script[0] == 0 and len(script) == 22:
+        return 'p2wpkh'
+    if script[0] == 0 and len(script) == 34:
+        return 'p2wsh'
+    return 'other'
+
+
+def timeit(f, scripts, repeat):
+    t0 = time.time()
+    for i in range(repeat):
+        for script in scripts:
+            f(script)
+    return (time.time() - t0) / repeat / len(scripts) * 1e6
+
+
+if __name__ == '__main__':
+    set_verbosity(False)
+    corpus = load_corpus(sys.argv[1] if len(sys.argv) > 1 else None)
+    repeat = int(sys.argv[2]) if len(sys.argv) > 2 else 200
+    groups = defaultdict(list)
+    for raw_tx in corpus:
+        tx = Transaction(raw_tx)
+        for _type, addr, value in tx.outputs():
+            script = bfh(tx.pay_script(_type, addr))
+            assert get_address_from_output_script(script) == get_address_from_output_script_generic(script)
+            groups[template(script)].append(script)
+    groups['all'] = sum(groups.values(), [])
+    print('%d transactions' % len(corpus))
+    print('%-8s %7s %12s %12s' % ('', 'scripts', 'fast us', 'generic us'))
+    for name, scripts in sorted(groups.items()):
+        print('%-8s %7d %12.2f %12.2f' % (name, len(scripts),
+                                         timeit(get_address_from_output_script, scripts, repeat),
+                                         timeit(get_address_from_output_script_generic, scripts, repeat)))
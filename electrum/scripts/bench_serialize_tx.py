@@ -0,0 +1,51 @@
+#!/usr/bin/env python3
+
+# Serializes a large complete transaction, computes its txid and wtxid,
+# and estimates the size of the same transaction while unsigned.
+# usage: python3 -m electrum.scripts.bench_serialize_tx [num_inputs] [repeat]
+
+import sys
+import time
+
+from electrum.bitcoin import TYPE_ADDRESS, pubkey_to_address
+from electrum.transaction import Transaction
+from electrum.util import bh2u
+
+PUBKEY = '0279be667ef9dcbbac55a06295ce870b07029bfcdb2dce28d959f2815b16f81798'
+DUMMY_SIG = '30' * 71 + '01'
+
+
+def make_tx(num_inputs, signed):
+    inputs = []
+    for i in range(num_inputs):
+        txin_type = ('p2pkh', 'p2wpkh', 'p2wpkh-p2sh')[i % 3]
+        inputs.append({
+            'type': txin_type, 'address': pubkey_to_address(txin_type, PUBKEY),
+            'prevout_hash': bh2u(i.to_bytes(32, 'big')), 'prevout_n': i % 5,
+            'value': 10000 + i, 'pubkeys': [PUBKEY], 'x_pubkeys': [PUBKEY],
+            'signatures': [DUMMY_SIG if signed else None], 'num_sig': 1})
+    outputs = [(TYPE_ADDRESS, pubkey_to_address('p2wpkh', PUBKEY), 5000 + i) for i in range(num_inputs // 2)]
+    tx = Transaction.from_io(inputs, outputs)
+    if signed:
+        tx = Transaction(tx.serialize())
+        tx.deserialize()
+    return tx
+
+
+def timeit(name, f, repeat):
+    t0 = time.time()
+    for i in range(repeat):
+        f()
+    print('%-22s %8.3f ms' % (name, (time.time() - t0) / repeat * 1000))
+
+
+if __name__ == '__main__':
+    num_inputs = int(sys.argv[1]) if len(sys.argv) > 1 else 1000
+    repeat = int(sys.argv[2]) if len(sys.argv) > 2 else 20
+    signed = make_tx(num_inputs, True)
+    unsigned = make_tx(num_inputs, False)
+    print('%d inputs, %d outputs' % (num_inputs, len(signed.outputs())))
+    timeit('serialize_to_network', signed.serialize_to_network, repeat)
+    timeit('txid', signed.txid, repeat)
+    timeit('wtxid', signed.wtxid, repeat)
+    timeit('estimated_size', unsigned.estimated_size, repeat)
@@ -0,0 +1,60 @@
+#!/usr/bin/env python3
+
+# Signs a consolidation transaction spending many p2wpkh (or p2pkh)
+# inputs of a single key, serially and in a process pool, and times the
+# computation of the sighash preimages on their own, with and without
+# the per-transaction cache.
+# usage: python3 -m electrum.scripts.bench_sign_tx [num_inputs] [p2wpkh|p2pkh] [num_processes]
+
+import os
+import sys
+import time
+
+from electrum import ecc
+from electrum.bitcoin import TYPE_ADDRESS, pubkey_to_address
+from electrum.transaction import Transaction
+from electrum.util import bh2u, set_verbosity
+
+
+def make_tx(num_inputs, txin_type):
+    secret = bytes(31) + b'\x01'
+    privkey = ecc.ECPrivkey(secret)
+    pubkey = privkey.get_public_key_hex(compressed=True)
+    address = pubkey_to_address(txin_type, pubkey)
+    inputs = [{'type': txin_type, 'address': address, 'prevout_hash': bh2u(i.to_bytes(32, 'big')),
+               'prevout_n': i % 3, 'value': 10000 + i, 'pubkeys': [pubkey], 'x_pubkeys': [pubkey],
+               'signatures': [None], 'num_sig': 1} for i in range(num_inputs)]
+    outputs = [(TYPE_ADDRESS, address, sum(x['value'] for x in inputs) - 1000 * num_inputs)]
+    tx = Transaction.from_io(inputs, outputs)
+    tx.BIP_LI01_sort()
+    return tx, {pubkey: (secret, True)}
+
+
+def time_preimages(tx, cached):
+    t0 = time.time()
+    for i in range(len(tx.inputs())):
+        if not cached:
+            tx._preimage_cache = None
+        tx.serialize_preimage(i)
+    return time.time() - t0
+
+
+if __name__ == '__main__':
+    num_inputs = int(sys.argv[1]) if len(sys.argv) > 1 else 500
+    txin_type = sys.argv[2] if len(sys.argv) > 2 else 'p2wpkh'
+    num_processes = int(sys.argv[3]) if len(sys.argv) > 3 else os.cpu_count()
+    set_verbosity(False)
+    tx, keypairs = make_tx(num_inputs, txin_type)
+    print('%d %s inputs' % (num_inputs, txin_type))
+    print('preimages, uncached: %.3fs' % time_preimages(tx, False))
+    tx._preimage_cache = None
+    print('preimages, cached:   %.3fs' % time_preimages(tx, True))
+    serialized = None
+    for name, n in [('sign, serial:', 0), ('sign, %d processes:' % num_processes, num_processes)]:
+        tx, keypairs = make_tx(num_inputs, txin_type)
+        t0 = time.time()
+        tx.sign(keypairs, n)
+        print('%-20s %.3fs' % (name, time.time() - t0))
+        assert tx.is_complete()
+        assert serialized in (None, tx.serialize())
+        serialized = tx.serialize()
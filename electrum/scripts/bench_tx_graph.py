@@ -0,0 +1,63 @@
+#!/usr/bin/env python3
+
+# Adds chains of unconfirmed transactions to a wallet, each spending the
+# previous one, then finds the descendants of the first transaction and
+# replaces it with a conflicting one, which removes the whole chain.
+# usage: python3 -m electrum.scripts.bench_tx_graph [max_length]
+
+import sys
+import time
+from unittest import mock
+
+from electrum import bitcoin, keystore, storage
+from electrum.transaction import Transaction
+from electrum.util import set_verbosity
+from electrum.wallet import Standard_Wallet, TX_HEIGHT_UNCONFIRMED
+
+SEED = 'cycle rocket west magnet parrot shuffle foot correct salt library feed song'
+
+
+def make_tx(prevout_hash, prevout_n, address, value):
+    raw_tx = '01000000' + '01' + bitcoin.rev_hex(prevout_hash) + bitcoin.int_to_hex(prevout_n, 4)
+    raw_tx += '00' + 'fdffffff' + '01'
+    script = bitcoin.address_to_script(address)
+    raw_tx += bitcoin.int_to_hex(value, 8) + bitcoin.var_int(len(script) // 2) + script
+    raw_tx += '00000000'
+    return Transaction(raw_tx)
+
+
+def add_tx(wallet, tx):
+    wallet.receive_tx_callback(tx.txid(), tx, TX_HEIGHT_UNCONFIRMED)
+    return tx.txid()
+
+
+def bench(length):
+    store = storage.WalletStorage('/nonexistent/bench_tx_graph')
+    store.put('keystore', keystore.from_seed(SEED, '', False).dump())
+    wallet = Standard_Wallet(store)
+    wallet.synchronize()
+    address = wallet.get_receiving_address()
+    funding_txid = add_tx(wallet, make_tx('11' * 32, 0, address, 10 ** 8))
+    t0 = time.time()
+    txid = funding_txid
+    for i in range(length):
+        txid = add_tx(wallet, make_tx(txid, 0, address, 10 ** 8 - 100 * (i + 1)))
+    t1 = time.time()
+    first = wallet.spent_outpoints.get(funding_txid, 0)
+    assert len(wallet.get_depending_transactions(first)) == length - 1
+    t2 = time.time()
+    add_tx(wallet, make_tx(funding_txid, 0, address, 10 ** 8 - 50))
+    t3 = time.time()
+    assert len(wallet.transactions) == 2
+    print('%7d %10.3f %12.4f %10.3f' % (length, t1 - t0, t2 - t1, t3 - t2))
+
+
+if __name__ == '__main__':
+    max_length = int(sys.argv[1]) if len(sys.argv) > 1 else 1000
+    set_verbosity(False)
+    print('%7s %10s %12s %10s' % ('length', 'add s', 'descendants s', 'replace s'))
+    with mock.patch.object(storage.WalletStorage, '_write'):
+        length = 125
+        while length <= max_length:
+            bench(length)
+            length *= 2
@@ -0,0 +1,57 @@
+#!/usr/bin/env python3
+
+# Compares the memory held by a wallet's transactions when kept as a dict
+# of Transaction objects, and when kept in a TxStore.
+# usage: python3 -m electrum.scripts.bench_tx_store [num_txs]
+
+import os
+import sys
+import time
+import tracemalloc
+
+from electrum.transaction import Transaction, TxStore
+from electrum.util import bh2u
+
+# 1 input, 2 outputs, p2pkh
+TEMPLATE = ('0100000001%s000000006b483045022100a3f8b6155c71a98ad9986edd6161b20d24fad99b6463c23b4638'
+            '56c0ee54826d02200f606017fd987696ebbe5200daedde922eee264325a184d5bbda965ba516082101210'
+            '2e5c473c051dae31043c335266d0ef89c1daab2f34d885cc7706b267f3269c609ffffffff0240420f000000'
+            '00001600148a28bddb7f61864bdcf58b2ad13d5aeb3abc3c42a2ddb90e000000001976a914c38495034'
+            '2cb6f8df55175b48586838b03130fad88ac00000000')
+
+
+def generate(n):
+    return {'%064x' % i: TEMPLATE % bh2u(os.urandom(32)) for i in range(n)}
+
+
+def measure(name, raw_txs, load):
+    tracemalloc.start()
+    t0 = time.time()
+    txs = load(raw_txs)
+    # simulate sync/history touching every transaction once
+    for txid, tx in txs.items():
+        tx.inputs()
+    dt = time.time() - t0
+    current, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    print('%-10s %8.1f MB held %8.1f MB peak %6.2fs' % (name, current / 1e6, peak / 1e6, dt))
+    return txs
+
+
+def load_dict(raw_txs):
+    return {txid: Transaction(raw) for txid, raw in raw_txs.items()}
+
+
+def load_store(raw_txs):
+    store = TxStore()
+    for txid, raw in raw_txs.items():
+        store.set_raw(txid, raw)
+    return store
+
+
+if __name__ == '__main__':
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 100000
+    raw_txs = generate(n)
+    print('%d transactions' % n)
+    measure('dict', raw_txs, load_dict)
+    measure('TxStore', raw_txs, load_store)
@@ -0,0 +1,97 @@
+#!/usr/bin/env python3
+
+# Compares the memory held by wallet.txi, wallet.txo and
+# wallet.spent_outpoints per 10k transactions, loaded from a wallet file,
+# in the old nested-dict representation and in the tables of txio.
+# usage: python3 -m electrum.scripts.bench_txio [num_txs]
+
+import json
+import os
+import sys
+import time
+import tracemalloc
+from collections import defaultdict
+
+from electrum.txio import TxInputs, TxOutputs, SpentOutpoints
+from electrum.util import bh2u
+
+ADDRESSES = ['1%033d' % i for i in range(1000)]
+
+
+def generate(n):
+    """Wallet file sections for a chain of n txs, each spending one wallet
+    coin of the previous tx and paying to the wallet and to a foreign address."""
+    txi, txo, spent = {}, {}, {}
+    prev = bh2u(os.urandom(32))
+    for i in range(n):
+        txid = bh2u(os.urandom(32))
+        addr = ADDRESSES[i % len(ADDRESSES)]
+        prev_addr = ADDRESSES[(i - 1) % len(ADDRESSES)]
+        txi[txid] = {prev_addr: [[prev + ':0', 100000 + i]]}
+        txo[txid] = {addr: [[0, 99000 + i, False]]}
+        spent[prev] = {'0': txid}
+        prev = txid
+    # one payout tx with many wallet outputs
+    txo['ff' * 32] = {addr: [[n, 1000 + n, False] for n in range(10 * j, 10 * j + 10)]
+                      for j, addr in enumerate(ADDRESSES[:100])}
+    return json.dumps({'txi': txi, 'txo': txo, 'spent_outpoints': spent})
+
+
+def load_old(d):
+    # as done by Abstract_Wallet.load_transactions before txio
+    txi = d['txi']
+    for txid, dd in list(txi.items()):
+        for addr, lst in dd.items():
+            txi[txid][addr] = set([tuple(x) for x in lst])
+    txo = d['txo']
+    spent_outpoints = defaultdict(dict)
+    for prevout_hash, dd in d['spent_outpoints'].items():
+        for prevout_n_str, spending_txid in dd.items():
+            spent_outpoints[prevout_hash][int(prevout_n_str)] = spending_txid
+    return txi, txo, spent_outpoints
+
+
+def load_new(d):
+    return (TxInputs.from_json(d['txi']), TxOutputs.from_json(d['txo']),
+            SpentOutpoints.from_json(d['spent_outpoints']))
+
+
+def lookup_old(txo, prevout_hash, prevout_n):
+    for addr, l in txo.get(prevout_hash, {}).items():
+        for n, v, is_cb in l:
+            if n == prevout_n:
+                return v
+
+
+def lookup_new(txo, prevout_hash, prevout_n):
+    r = txo.get_output(prevout_hash, prevout_n)
+    return r.value if r else None
+
+
+def measure(name, raw, load, lookup):
+    tracemalloc.start()
+    tables = load(json.loads(raw))
+    current, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    txo = tables[1]
+    txids = list(txo)
+    t0 = time.time()
+    for txid in txids:
+        lookup(txo, txid, 0)
+        lookup(txo, txid, 1)
+    dt = time.time() - t0
+    t0 = time.time()
+    for n in range(1000):
+        lookup(txo, 'ff' * 32, n)
+    dt_wide = time.time() - t0
+    per_10k = current * 10000 / len(txids)
+    print('%-4s %8.2f MB per 10k txs  %8.1f ns per txo lookup  %8.1f ns in a 1000 output tx'
+          % (name, per_10k / 1e6, dt / (2 * len(txids)) * 1e9, dt_wide / 1000 * 1e9))
+
+
+if __name__ == '__main__':
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 100000
+    raw = generate(n)
+    print('%d transactions' % n)
+    measure('old', raw, load_old, lookup_old)
+    measure('new', raw, load_new, lookup_new)
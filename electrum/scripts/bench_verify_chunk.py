@@ -0,0 +1,83 @@
+#!/usr/bin/env python3
+
+# Writes a synthetic header file the size of mainnet, then verifies it
+# chunk by chunk with Blockchain.verify_chunk and with the previous
+# per-header path (deserialize_header + verify_header). The target is
+# raised so that random headers pass the proof of work check, which is
+# still performed.
+# usage: python3 -m electrum.scripts.bench_verify_chunk [num_chunks]
+
+import os
+import shutil
+import sys
+import tempfile
+import time
+from hashlib import sha256
+
+from electrum import constants
+from electrum.blockchain import Blockchain, deserialize_header, hash_header
+from electrum.simple_config import SimpleConfig
+
+BITS = 0x1d00ffff
+
+
+class BenchBlockchain(Blockchain):
+
+    def get_target(self, index):
+        return 2 ** 256 - 1
+
+    def target_to_bits(self, target):
+        return BITS
+
+    def get_hash(self, height):
+        return '00' * 32 if height == -1 else super().get_hash(height)
+
+    def verify_chunk_dicts(self, index, data):
+        num = len(data) // 80
+        prev_hash = self.get_hash(index * 2016 - 1)
+        target = self.get_target(index-1)
+        for i in range(num):
+            raw_header = data[i*80:(i+1) * 80]
+            header = deserialize_header(raw_header, index*2016 + i)
+            self.verify_header(header, prev_hash, target)
+            prev_hash = hash_header(header)
+
+
+def write_headers(path, num):
+    prev = bytes(32)
+    with open(path, 'wb') as f:
+        for height in range(num):
+            raw = (b'\x01\x00\x00\x00' + prev + sha256(b'%d' % height).digest()
+                   + (1500000000 + height).to_bytes(4, 'little')
+                   + BITS.to_bytes(4, 'little') + bytes(4))
+            f.write(raw)
+            prev = sha256(sha256(raw).digest()).digest()
+
+
+def run(chain, verify, num_chunks):
+    t0 = time.time()
+    with open(chain.path(), 'rb') as f:
+        for index in range(num_chunks):
+            verify(index, f.read(2016 * 80))
+    return time.time() - t0
+
+
+if __name__ == '__main__':
+    num_chunks = int(sys.argv[1]) if len(sys.argv) > 1 else 270
+    constants.net.TESTNET = False
+    constants.net.CHECKPOINTS = []
+    path = tempfile.mkdtemp()
+    try:
+        config = SimpleConfig({'electrum_path': path})
+        chain = BenchBlockchain(config, 0, None)
+        write_headers(chain.path(), num_chunks * 2016)
+        chain.update_size()
+        num = num_chunks * 2016
+        print('%d chunks, %d headers' % (num_chunks, num))
+        for name, verify in [('dicts', chain.verify_chunk_dicts),
+                             ('raw bytes', chain.verify_chunk)]:
+            dt = run(chain, verify, num_chunks)
+            print('%-10s %6.2fs  %8d headers/s' % (name, dt, num / dt))
+        chain.reset_cache()
+    finally:
+        shutil.rmtree(path)
@@ -32,6 +32,7 @@ import stat
 import pbkdf2, hmac, hashlib
 import base64
 import zlib
+import struct
 from collections import defaultdict
 
 from . import util, bitcoin, ecc
@@ -44,7 +45,7 @@ from .keystore import bip44_derivation
 
 OLD_SEED_VERSION = 4        # electrum versions < 2.0
 NEW_SEED_VERSION = 11       # electrum versions >= 2.0
-FINAL_SEED_VERSION = 17     # electrum >= 2.7 will set this to prevent
+FINAL_SEED_VERSION = 18     # electrum >= 2.7 will set this to prevent
                             # old versions from overwriting new format
 
 
@@ -67,9 +68,21 @@ def get_derivation_used_for_hw_device_encryption():
 # storage encryption version
 STO_EV_PLAINTEXT, STO_EV_USER_PW, STO_EV_XPUB_PW = range(0, 3)
 
+# storage file format
+#   json: the whole wallet is one json document, rewritten on every save
+#   log:  append-only log of records, each holding the keys changed by a save
+STO_FMT_JSON, STO_FMT_LOG = range(0, 2)
+
+LOG_MAGIC = b'ELECTRUMLOG'
+LOG_VERSION = 1
+LOG_HEADER_SIZE = len(LOG_MAGIC) + 2
+# the log is compacted into a single record once it is more than twice
+# the size of the last compaction, plus this many bytes
+LOG_COMPACTION_SLACK = 1024 * 1024
+
 class WalletStorage(PrintError):
 
-    def __init__(self, path, manual_upgrades=False):
+    def __init__(self, path, manual_upgrades=False, file_format=None):
         self.print_error("wallet path", path)
         self.manual_upgrades = manual_upgrades
         self.lock = threading.RLock()
@@ -77,12 +90,37 @@ class WalletStorage(PrintError):
         self.path = path
         self.modified = False
         self.pubkey = None
+        # format used for writing. Existing files keep theirs, until
+        # convert_version_18 switches them to the log format, unless a
+        # format is given, in which case they are converted on write
+        self._requested_format = file_format
+        self.file_format = STO_FMT_LOG if file_format is None else file_format
+        self._loaded_format = None
+        self._records = []  # log records, not yet decrypted
+        self._log_size = 0  # size of the valid part of the log file
+        self._compacted_size = 0
+        self._needs_compaction = False
+        self._written = {}  # key -> value, as persisted
+        self._dirty = set()  # keys put since the last write
         if self.file_exists():
-            with open(self.path, "r", encoding='utf-8') as f:
-                self.raw = f.read()
-            self._encryption_version = self._init_encryption_version()
-            if not self.is_encrypted():
-                self.load_data(self.raw)
+            with open(self.path, "rb") as f:
+                raw = f.read()
+            if raw.startswith(LOG_MAGIC):
+                self._loaded_format = STO_FMT_LOG
+                if file_format is None:
+                    self.file_format = STO_FMT_LOG
+                self.raw = None
+                self._encryption_version = self._read_log(raw)
+                if not self.is_encrypted():
+                    self.load_data_from_records(self._records)
+            else:
+                self._loaded_format = STO_FMT_JSON
+                if file_format is None:
+                    self.file_format = STO_FMT_JSON
+                self.raw = raw.decode('utf-8')
+                self._encryption_version = self._init_encryption_version()
+                if not self.is_encrypted():
+                    self.load_data(self.raw)
         else:
             self._encryption_version = STO_EV_PLAINTEXT
             # avoid new wallets getting 'upgraded'
@@ -106,6 +144,22 @@ class WalletStorage(PrintError):
                     self.print_error('Failed to convert label to json format', key)
                     continue
                 self.data[key] = value
+        self._after_load()
+
+    def load_data_from_records(self, records):
+        data = {}
+        for payload in records:
+            for op in json.loads(payload.decode('utf8')):
+                self._apply_log_op(data, op)
+        self.data = data
+        self._records = []
+        self._after_load()
+
+    def _after_load(self):
+        self._written = dict(self.data)
+        self._dirty = set()
+        if self._loaded_format != self.file_format:
+            self._needs_compaction = True
 
         # check here if I need to load a plugin
         t = self.get('wallet_type')
@@ -118,6 +172,53 @@ class WalletStorage(PrintError):
             if self.requires_upgrade():
                 self.upgrade()
 
+    def _read_log(self, raw):
+        """Reads the log records into self._records, and returns the
+        encryption version. A truncated or corrupt last record is the
+        tail of an interrupted write; it is overwritten by the next
+        append. A corrupt record followed by others is an error."""
+        if len(raw) < LOG_HEADER_SIZE:
+            raise IOError("Cannot read wallet file '%s'" % self.path)
+        version, enc_version = raw[len(LOG_MAGIC)], raw[len(LOG_MAGIC) + 1]
+        if version != LOG_VERSION:
+            raise WalletFileException('unknown wallet file log version: %d' % version)
+        pos = LOG_HEADER_SIZE
+        records = []
+        while pos + 8 <= len(raw):
+            length, checksum = struct.unpack_from('<II', raw, pos)
+            payload = raw[pos + 8:pos + 8 + length]
+            if len(payload) != length or zlib.crc32(payload) != checksum:
+                if pos + 8 + length < len(raw):
+                    raise WalletFileException(
+                        "Wallet file '%s' is corrupt at byte %d" % (self.path, pos))
+                self.print_error('ignoring truncated record in', self.path)
+                break
+            records.append(payload)
+            pos += 8 + length
+        self._records = records
+        self._log_size = pos
+        self._compacted_size = pos
+        return enc_version
+
+    @staticmethod
+    def _apply_log_op(data, op):
+        action, key = op[0], op[1]
+        if action == 'put':
+            data[key] = op[2]
+        elif action == 'del':
+            data.pop(key, None)
+        elif action == 'set':
+            d = data.get(key)
+            if not isinstance(d, dict):
+                d = data[key] = {}
+            d[op[2]] = op[3]
+        elif action == 'pop':
+            d = data.get(key)
+            if isinstance(d, dict):
+                d.pop(op[2], None)
+        else:
+            raise WalletFileException('unknown wallet file log op: %s' % action)
+
     def is_past_initial_decryption(self):
         """Return if storage is in a usable state for normal operations.
 
@@ -180,6 +281,13 @@ class WalletStorage(PrintError):
 
     def decrypt(self, password):
         ec_key = self.get_eckey_from_password(password)
+        if self._loaded_format == STO_FMT_LOG:
+            enc_magic = self._get_encryption_magic()
+            records = [zlib.decompress(ec_key.decrypt_message(payload, enc_magic))
+                       for payload in self._records]
+            self.pubkey = ec_key.get_public_key_hex()
+            self.load_data_from_records(records)
+            return
         if self.raw:
             enc_magic = self._get_encryption_magic()
             s = zlib.decompress(ec_key.decrypt_message(self.raw, enc_magic))
@@ -213,6 +321,8 @@ class WalletStorage(PrintError):
         # make sure next storage.write() saves changes
         with self.lock:
             self.modified = True
+            # records written with the previous key cannot be appended to
+            self._needs_compaction = True
 
     def get(self, key, default=None):
         with self.lock:
@@ -235,9 +345,11 @@ class WalletStorage(PrintError):
                 if self.data.get(key) != value:
                     self.modified = True
                     self.data[key] = copy.deepcopy(value)
+                    self._dirty.add(key)
             elif key in self.data:
                 self.modified = True
                 self.data.pop(key)
+                self._dirty.add(key)
 
     @profiler
     def write(self):
@@ -250,6 +362,19 @@ class WalletStorage(PrintError):
             return
         if not self.modified:
             return
+        if self.file_format == STO_FMT_JSON:
+            self._write_json()
+        elif (self._needs_compaction or not os.path.exists(self.path)
+              or self._log_size > 2 * self._compacted_size + LOG_COMPACTION_SLACK):
+            self._compact_log()
+        else:
+            self._append_log()
+        self._written = dict(self.data)
+        self._dirty = set()
+        self._needs_compaction = False
+        self.modified = False
+
+    def _write_json(self):
         s = json.dumps(self.data, indent=4, sort_keys=True, cls=util.MyEncoder)
         if self.pubkey:
             s = bytes(s, 'utf8')
@@ -258,10 +383,13 @@ class WalletStorage(PrintError):
             public_key = ecc.ECPubkey(bfh(self.pubkey))
             s = public_key.encrypt_message(c, enc_magic)
             s = s.decode('utf8')
+        self._replace_file(s.encode('utf8'))
+        self.print_error("saved", self.path)
 
+    def _replace_file(self, b):
         temp_path = "%s.tmp.%s" % (self.path, os.getpid())
-        with open(temp_path, "w", encoding='utf-8') as f:
-            f.write(s)
+        with open(temp_path, "wb") as f:
+            f.write(b)
             f.flush()
             os.fsync(f.fileno())
 
@@ -273,8 +401,65 @@ class WalletStorage(PrintError):
             os.remove(self.path)
             os.rename(temp_path, self.path)
         os.chmod(self.path, mode)
+
+    def _encode_log_record(self, ops):
+        payload = bytes(json.dumps(ops, cls=util.MyEncoder), 'utf8')
+        if self.pubkey:
+            enc_magic = self._get_encryption_magic()
+            public_key = ecc.ECPubkey(bfh(self.pubkey))
+            payload = public_key.encrypt_message(zlib.compress(payload), enc_magic)
+        return struct.pack('<II', len(payload), zlib.crc32(payload)) + payload
+
+    def _get_dirty_log_ops(self):
+        ops = []
+        for key in sorted(self._dirty, key=str):
+            old = self._written.get(key)
+            new = self.data.get(key)
+            if new is None:
+                if old is not None:
+                    ops.append(['del', key])
+            elif isinstance(old, dict) and isinstance(new, dict):
+                # dicts such as 'transactions' are written item by item
+                item_ops = []
+                # json turns non-string dict keys into strings
+                json_key = lambda k: k if isinstance(k, str) else json.dumps(k)
+                for k, v in new.items():
+                    if k not in old or old[k] != v:
+                        item_ops.append(['set', key, json_key(k), v])
+                for k in old:
+                    if k not in new:
+                        item_ops.append(['pop', key, json_key(k)])
+                if len(item_ops) > len(new) // 2:
+                    ops.append(['put', key, new])
+                else:
+                    ops.extend(item_ops)
+            elif old != new:
+                ops.append(['put', key, new])
+        return ops
+
+    def _append_log(self):
+        ops = self._get_dirty_log_ops()
+        if not ops:
+            return
+        record = self._encode_log_record(ops)
+        with open(self.path, "r+b") as f:
+            # drop a partially written record, if any
+            f.seek(self._log_size)
+            f.truncate()
+            f.write(record)
+            f.flush()
+            os.fsync(f.fileno())
+        self._log_size += len(record)
+        self.print_error("appended %d changes to" % len(ops), self.path)
+
+    @profiler
+    def _compact_log(self):
+        header = LOG_MAGIC + bytes([LOG_VERSION, self._encryption_version])
+        ops = [['put', key, value] for key, value in sorted(self.data.items())]
+        b = header + self._encode_log_record(ops)
+        self._replace_file(b)
+        self._log_size = self._compacted_size = len(b)
         self.print_error("saved", self.path)
-        self.modified = False
 
     def requires_split(self):
         d = self.get('accounts', {})
@@ -341,6 +526,7 @@ class WalletStorage(PrintError):
         self.convert_version_15()
         self.convert_version_16()
         self.convert_version_17()
+        self.convert_version_18()
 
         self.put('seed_version', FINAL_SEED_VERSION)  # just to be sure
         self.write()
@@ -555,6 +741,17 @@ class WalletStorage(PrintError):
 
         self.put('seed_version', 17)
 
+    def convert_version_18(self):
+        # the file is written as an append-only log
+        if not self._is_upgrade_method_needed(17, 17):
+            return
+
+        if self._requested_format is None:
+            self.file_format = STO_FMT_LOG
+        if self._loaded_format != self.file_format:
+            self._needs_compaction = True
+        self.put('seed_version', 18)
+
     def convert_imported(self):
         if not self._is_upgrade_method_needed(0, 13):
             return
@@ -75,7 +75,8 @@ class Synchronizer(ThreadJob):
     def subscribe_to_addresses(self, addresses):
         if addresses:
             self.requested_addrs |= addresses
-            self.network.subscribe_to_addresses(addresses, self.on_address_status)
+            hash2address = self.wallet.get_scripthashes(addresses)
+            self.network.subscribe_to_scripthashes(hash2address, self.on_address_status)
 
     def get_status(self, h):
         if not h:
@@ -1,5 +1,6 @@
 import base64
 import unittest
+from unittest import mock
 import sys
 
 from electrum.bitcoin import (
@@ -11,8 +12,9 @@ from electrum.bitcoin import (
     deserialize_privkey, serialize_privkey, is_segwit_address,
     is_b58_address, address_to_scripthash, is_minikey, is_compressed, is_xpub,
     xpub_type, is_xprv, is_bip32_derivation, seed_type, EncodeBase58Check,
-    script_num_to_hex, push_script, add_number_to_script, int_to_hex)
-from electrum import ecc, crypto, constants
+    script_num_to_hex, push_script, add_number_to_script, int_to_hex,
+    deserialize_xpub, CKD_pub, CKD_pub_many, pubkey_to_address, address_cache)
+from electrum import ecc, crypto, constants, ripemd
 from electrum.ecc import number_to_string, string_to_number
 from electrum.transaction import opcodes
 from electrum.util import bfh, bh2u
@@ -89,6 +91,44 @@ class Test_bitcoin(SequentialTestCase):
         # we want the unit testing framework to test with libsecp256k1 available.
         self.assertTrue(bool(ecc_fast._libsecp256k1))
 
+    def test_ripemd160_backends(self):
+        vectors = [
+            (b'', '9c1185a5c5e9fc54612808977ee8f548b2258d31'),
+            (b'abc', '8eb208f7e05d987a9b044a8e98c6b087f15a0bfc'),
+            (b'message digest', '5d0689ef49d2fae572b881b123a85ffa21595f36'),
+            (b'12345678901234567890123456789012345678901234567890123456789012345678901234567890',
+             '9b752e45573d4b39f4dbd3323cab82bf63326bfb'),
+        ]
+        backends = crypto.get_ripemd160_backends()
+        self.assertIn('python', backends)
+        self.assertEqual(crypto.RIPEMD160_BACKEND, list(backends)[0])
+        for name, ripemd160 in backends.items():
+            for data, digest in vectors:
+                self.assertEqual(digest, bh2u(ripemd160(data)), name)
+
+    def test_ripemd160_first_backend_is_lazy(self):
+        load = mock.Mock(side_effect=AssertionError)
+        candidates = [('broken', lambda: lambda x: b''),
+                      ('python', lambda: ripemd.ripemd160),
+                      ('libcrypto', load)]
+        with mock.patch.object(crypto, 'RIPEMD160_CANDIDATES', candidates):
+            name, f = next(crypto._iter_ripemd160_backends())
+            self.assertEqual('python', name)
+            self.assertFalse(load.called)
+            self.assertEqual(['python'], list(crypto.get_ripemd160_backends()))
+            self.assertTrue(load.called)
+
+    def test_ripemd160_python_streaming(self):
+        data = bytes(range(256)) * 3
+        md = ripemd.new(data[:100])
+        md2 = md.copy()
+        md.update(data[100:])
+        md2.update(data[100:200])
+        md2.update(data[200:])
+        self.assertEqual(ripemd.ripemd160(data), md.digest())
+        self.assertEqual(md.digest(), md2.digest())
+        self.assertEqual(bh2u(md.digest()), md.hexdigest())
+
     def test_pycryptodomex_is_available(self):
         # we want the unit testing framework to test with pycryptodomex available.
         self.assertTrue(bool(crypto.AES))
@@ -371,6 +411,41 @@ class Test_bitcoin(SequentialTestCase):
         self.assertEqual(address_to_script('35ZqQJcBQMZ1rsv8aSuJ2wkC7ohUCQMJbT'), 'a9142a84cf00d47f699ee7bbc1dea5ec1bdecb4ac15487')
         self.assertEqual(address_to_script('3PyjzJ3im7f7bcV724GR57edKDqoZvH7Ji'), 'a914f47c8954e421031ad04ecd8e7752c9479206b9d387')
 
+    def test_address_cache(self):
+        pubkey = '02c6467b7e621144105ed3e4835b0b4ab7e35266a2ae1c4f8baa19e9ca93452997'
+        addr = pubkey_to_address('p2wpkh', pubkey)
+        self.assertEqual(addr, pubkey_to_address('p2wpkh', pubkey))
+        self.assertEqual(address_to_scripthash(addr), address_to_scripthash(addr))
+        # entries are keyed by network
+        constants.set_testnet()
+        try:
+            self.assertNotEqual(addr, pubkey_to_address('p2wpkh', pubkey))
+            with self.assertRaises(Exception):
+                address_to_script(addr)
+        finally:
+            constants.set_mainnet()
+        self.assertEqual(addr, pubkey_to_address('p2wpkh', pubkey))
+        self.assertEqual(address_to_script(addr, net=constants.BitcoinMainnet),
+                         address_to_script(addr))
+
+    def test_address_cache_bounded(self):
+        max_size = address_cache.max_size
+        address_cache.max_size = 3
+        try:
+            address_cache.clear()
+            for addr in ['14gcRovpkCoGkCNBivQBvw7eso7eiNAbxG', '1BEqfzh4Y3zzLosfGhw1AsqbEKVW6e1qHv',
+                         '35ZqQJcBQMZ1rsv8aSuJ2wkC7ohUCQMJbT', '3PyjzJ3im7f7bcV724GR57edKDqoZvH7Ji']:
+                address_to_script(addr)
+            self.assertEqual(3, len(address_cache))
+            # failed conversions are not cached
+            for i in range(2):
+                with self.assertRaises(Exception):
+                    address_to_script('not an address')
+            self.assertEqual(3, len(address_cache))
+        finally:
+            address_cache.max_size = max_size
+            address_cache.clear()
+
 
 class Test_bitcoin_testnet(TestCaseForTestnet):
 
@@ -431,6 +506,14 @@ class Test_xprv_xpub(SequentialTestCase):
         self.assertEqual("xpub6FnCn6nSzZAw5Tw7cgR9bi15UV96gLZhjDstkXXxvCLsUXBGXPdSnLFbdpq8p9HmGsApME5hQTZ3emM2rnY5agb9rXpVGyy3bdW6EEgAtqt", xpub)
         self.assertEqual("xprvA2nrNbFZABcdryreWet9Ea4LvTJcGsqrMzxHx98MMrotbir7yrKCEXw7nadnHM8Dq38EGfSh6dqA9QWTyefMLEcBYJUuekgW4BYPJcr9E7j", xprv)
 
+    @needs_test_with_all_ecc_implementations
+    def test_CKD_pub_many(self):
+        for xprv_details in self.xprv_xpub:
+            _, _, _, _, c, cK = deserialize_xpub(xprv_details['xpub'])
+            indices = [0, 1, 2, 7, 1000000000]
+            expected = [CKD_pub(cK, c, n)[0] for n in indices]
+            self.assertEqual(expected, CKD_pub_many(cK, c, indices))
+
     @needs_test_with_all_ecc_implementations
     def test_xpub_from_xprv(self):
         """We can derive the xpub key from a xprv."""
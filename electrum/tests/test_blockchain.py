@@ -0,0 +1,130 @@
+import os
+import shutil
+import tempfile
+from unittest import mock
+
+from electrum import constants
+from electrum.blockchain import Blockchain, hash_header, serialize_header
+from electrum.simple_config import SimpleConfig
+from electrum.util import bfh
+
+from . import SequentialTestCase
+
+
+def make_headers(n, prev_hash='00' * 32, nonce=0):
+    headers = []
+    for height in range(n):
+        header = {'version': 1, 'prev_block_hash': prev_hash, 'merkle_root': '11' * 32,
+                  'timestamp': 1500000000 + height, 'bits': 0x1d00ffff,
+                  'nonce': nonce, 'block_height': height}
+        headers.append(header)
+        prev_hash = hash_header(header)
+    return headers
+
+
+class TestBlockchainStore(SequentialTestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        constants.set_regtest()
+
+    @classmethod
+    def tearDownClass(cls):
+        super().tearDownClass()
+        constants.set_mainnet()
+
+    def setUp(self):
+        super().setUp()
+        self.electrum_path = tempfile.mkdtemp()
+        self.config = SimpleConfig({'electrum_path': self.electrum_path})
+        self.chain = Blockchain(self.config, 0, None)
+        open(self.chain.path(), 'wb').close()
+        self.chain.update_size()
+        self.headers = make_headers(50)
+        for header in self.headers:
+            self.chain.save_header(header)
+
+    def tearDown(self):
+        self.chain.reset_cache()
+        shutil.rmtree(self.electrum_path)
+        super().tearDown()
+
+    def test_read_header(self):
+        self.assertEqual(49, self.chain.height())
+        self.assertEqual(self.headers[17], self.chain.read_header(17))
+        self.assertIsNone(self.chain.read_header(50))
+
+    def test_get_hash_cached(self):
+        self.assertEqual(hash_header(self.headers[30]), self.chain.get_hash(30))
+        self.assertEqual(hash_header(self.headers[30]), self.chain._hashes[30])
+        self.assertEqual('0' * 64, self.chain.get_hash(60))
+
+    def test_write_invalidates_cache(self):
+        for height in range(50):
+            self.chain.get_hash(height)
+        other = make_headers(50, nonce=1)
+        data = b''.join(bfh(serialize_header(h)) for h in other[20:30])
+        self.chain.write(data, 20 * 80)
+        self.assertEqual(29, self.chain.height())
+        self.assertEqual(hash_header(self.headers[19]), self.chain.get_hash(19))
+        self.assertEqual(hash_header(other[25]), self.chain.get_hash(25))
+        self.assertEqual(other[29], self.chain.read_header(29))
+
+    def test_sync(self):
+        self.assertTrue(self.chain._unsynced)
+        self.chain.sync()
+        self.assertFalse(self.chain._unsynced)
+        self.assertEqual(50 * 80, os.path.getsize(self.chain.path()))
+
+
+class PowBlockchain(Blockchain):
+
+    target = 2 ** 256 - 1
+
+    def get_target(self, index):
+        return self.target
+
+    def target_to_bits(self, target):
+        return 0x1d00ffff
+
+
+class TestVerifyChunk(SequentialTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.electrum_path = tempfile.mkdtemp()
+        self.chain = PowBlockchain(SimpleConfig({'electrum_path': self.electrum_path}), 0, None)
+        self.chain.checkpoints = []
+        self.headers = make_headers(100)
+        self.data = bytearray(b''.join(bfh(serialize_header(h)) for h in self.headers))
+        patcher = mock.patch.object(constants.net, 'TESTNET', False)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def tearDown(self):
+        shutil.rmtree(self.electrum_path)
+        super().tearDown()
+
+    def test_valid_chunk(self):
+        self.chain.verify_chunk(0, bytes(self.data))
+
+    def test_prev_hash_mismatch(self):
+        self.data[80 * 40 + 4] ^= 1
+        with self.assertRaisesRegex(Exception, 'prev hash mismatch'):
+            self.chain.verify_chunk(0, bytes(self.data))
+
+    def test_bits_mismatch(self):
+        self.data[80 * 40 + 72] ^= 1
+        with self.assertRaisesRegex(Exception, 'bits mismatch'):
+            self.chain.verify_chunk(0, bytes(self.data))
+
+    def test_insufficient_pow(self):
+        self.chain.target = int(hash_header(self.headers[50]), 16) - 1
+        with self.assertRaisesRegex(Exception, 'insufficient proof of work'):
+            self.chain.verify_chunk(0, bytes(self.data))
+
+    def test_checkpoint(self):
+        self.chain.checkpoints = [(hash_header(self.headers[-1]), 0)]
+        with self.assertRaisesRegex(Exception, 'does not match checkpoint'):
+            self.chain.verify_chunk(0, bytes(self.data))
@@ -0,0 +1,180 @@
+import random
+
+from electrum import coinchooser
+from electrum.bitcoin import TYPE_ADDRESS, hash160_to_p2pkh, hash_to_segwit_addr, sha256
+from electrum.coinchooser import (PRNG, CoinChooserBranchAndBound, CoinChooserPrivacy,
+                                  branch_and_bound)
+from electrum.util import NotEnoughFunds
+
+from . import SequentialTestCase
+
+
+def make_coin(i, value, height=100, txin_type='p2wpkh'):
+    h160 = sha256(bytes([i % 256, i // 256]))[:20]
+    if txin_type == 'p2wpkh':
+        address = hash_to_segwit_addr(h160, witver=0)
+    else:
+        address = hash160_to_p2pkh(h160)
+    return {'type': txin_type, 'address': address, 'value': value,
+            'height': height, 'prevout_hash': sha256(bytes([i % 256, i // 256])).hex(),
+            'prevout_n': i % 3, 'num_sig': 1, 'signatures': [None],
+            'x_pubkeys': ['02' + '00' * 32]}
+
+
+def make_wallet():
+    # mixed script types and confirmation states, some addresses reused
+    r = random.Random(1)
+    coins = [make_coin(i, int(r.lognormvariate(12, 2)) + 1000,
+                       height=r.choice([0, 10, 20, -1]),
+                       txin_type=r.choice(['p2wpkh', 'p2pkh']))
+             for i in range(300)]
+    for i in range(250, 300):
+        coins[i]['address'] = coins[i - 250]['address']
+        coins[i]['type'] = coins[i - 250]['type']
+    return coins
+
+
+def fee_estimator(size):
+    return 10 * size
+
+
+class TestPRNG(SequentialTestCase):
+
+    def test_randint(self):
+        p = PRNG(b'electrum')
+        self.assertEqual([4, 3, 6, 9, 7, 0, 3, 5, 5, 8], [p.randint(0, 10) for i in range(10)])
+        self.assertEqual(881, p.randint(0, 1000))
+        self.assertEqual(55476, p.randint(5, 70000))
+        self.assertEqual(470812269480, p.randint(0, 2**40))
+        self.assertEqual('b', p.choice('abcdef'))
+
+    def test_shuffle(self):
+        p = PRNG(b'shuffle')
+        x = list(range(20))
+        p.shuffle(x)
+        self.assertEqual([2, 13, 17, 1, 18, 9, 8, 19, 11, 16, 0, 12, 5, 15, 4, 7, 14, 6, 10, 3], x)
+        # draws two bytes per element
+        x = list(range(1000))
+        p.shuffle(x)
+        self.assertEqual([285, 109, 305, 243, 283, 68, 878, 287, 622, 234], x[:10])
+        self.assertEqual(249580160, sum(i * v for i, v in enumerate(x)))
+
+    def test_shuffle_same_as_randint(self):
+        # shuffle reads its draws in batches; check it against one
+        # randint per element, up to draws of three bytes
+        for n in [2, 256, 257, 70000]:
+            p1, p2 = PRNG(b'shuffle'), PRNG(b'shuffle')
+            x1, x2 = list(range(n)), list(range(n))
+            p1.shuffle(x1)
+            for i in reversed(range(1, n)):
+                j = p2.randint(0, i + 1)
+                x2[i], x2[j] = x2[j], x2[i]
+            self.assertEqual(x2, x1)
+            self.assertEqual(p2.get_bytes(3), p1.get_bytes(3))
+
+    def test_get_bytes(self):
+        p = PRNG(b'electrum')
+        stream = sha256(b'electrum')
+        stream += sha256(stream)
+        stream += sha256(stream[32:])
+        self.assertEqual(stream[:5], bytes(p.get_bytes(5)))
+        self.assertEqual(stream[5:45], bytes(p.get_bytes(40)))
+        self.assertEqual(stream[45:46], bytes(p.get_bytes(1)))
+
+
+class TestBranchAndBound(SequentialTestCase):
+
+    def test_exact_match(self):
+        self.assertEqual([0, 3], branch_and_bound([10, 7, 5, 3, 1], 13, 1))
+        self.assertEqual([0, 4], branch_and_bound([10, 7, 5, 3, 1], 11, 1))
+
+    def test_least_excess(self):
+        self.assertEqual([1], branch_and_bound([10, 7, 5], 6, 5))
+
+    def test_no_match(self):
+        self.assertIsNone(branch_and_bound([10, 7], 8, 1))
+        self.assertIsNone(branch_and_bound([10, 7], 18, 1))
+        self.assertIsNone(branch_and_bound([], 1, 1))
+
+    def test_equal_values(self):
+        self.assertEqual([0, 1, 2], branch_and_bound([5] * 1000, 15, 1))
+        self.assertIsNone(branch_and_bound([6] * 1000, 15, 1, max_tries=10000))
+
+
+class TestCoinChooser(SequentialTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.change_addr = make_coin(9999, 0)['address']
+
+    def make_tx(self, chooser, coins, amount):
+        outputs = [(TYPE_ADDRESS, make_coin(10000, 0, txin_type='p2pkh')['address'], amount)]
+        return chooser.make_tx(coins, outputs, [self.change_addr], fee_estimator, 546)
+
+    def test_changeless(self):
+        coins = [make_coin(i, 100000 * 2 ** i) for i in range(10)]
+        # coins 2 and 4, less the fee of a 181 vbyte tx
+        amount = 400000 + 1600000 - 1810 - 200
+        tx = self.make_tx(CoinChooserBranchAndBound(), coins, amount)
+        self.assertEqual(1, len(tx.outputs()))
+        self.assertEqual({coins[2]['prevout_hash'], coins[4]['prevout_hash']},
+                         {txin['prevout_hash'] for txin in tx.inputs()})
+        self.assertTrue(0 <= tx.get_fee() - fee_estimator(tx.estimated_size()) < 1000)
+
+    def test_prefers_confirmed(self):
+        coins = [make_coin(0, 100000, height=0), make_coin(1, 100000),
+                 make_coin(2, 300000)]
+        tx = self.make_tx(CoinChooserBranchAndBound(), coins, 100000 - 1500)
+        self.assertEqual([coins[1]['prevout_hash']],
+                         [txin['prevout_hash'] for txin in tx.inputs()])
+        tx = self.make_tx(CoinChooserBranchAndBound(), coins, 200000 - 2000)
+        self.assertEqual(1, len(tx.outputs()))
+        self.assertEqual(2, len(tx.inputs()))
+
+    def test_fallback(self):
+        coins = [make_coin(i, 100000 * (i + 1)) for i in range(5)]
+        amount = 123456
+        tx1 = self.make_tx(CoinChooserBranchAndBound(), coins, amount)
+        tx2 = self.make_tx(CoinChooserPrivacy(), coins, amount)
+        self.assertEqual(2, len(tx1.outputs()))
+        self.assertEqual(tx2.serialize(), tx1.serialize())
+
+    def test_privacy_selection_unchanged(self):
+        coins = make_wallet()
+        index = {coin['prevout_hash']: i for i, coin in enumerate(coins)}
+        change_addrs = [make_coin(9999, 0)['address'], make_coin(9998, 0)['address']]
+        recipient = make_coin(10000, 0, txin_type='p2pkh')['address']
+        expected = [
+            (5000, [203], [5000, 4614]),
+            (200000, [41, 291], [200000, 149466]),
+            (3000000, [46, 296], [3000000, 3518069]),
+            (30000000, [46, 74, 127, 296], [30000000, 3294545]),
+            (150000000, [182], [150000000, 96814137]),
+            (400000000, [179, 182], [400000000, 37060102]),
+            # 135 coins, too many to list: their number and sum of indices
+            (600000000, (135, 20903), [600000000, 53465]),
+        ]
+        for amount, inputs, output_values in expected:
+            tx = CoinChooserPrivacy().make_tx(coins, [(TYPE_ADDRESS, recipient, amount)],
+                                              change_addrs, fee_estimator, 546)
+            selected = sorted(index[txin['prevout_hash']] for txin in tx.inputs())
+            if isinstance(inputs, tuple):
+                selected = len(selected), sum(selected)
+            self.assertEqual(inputs, selected)
+            self.assertEqual(output_values, [o[2] for o in tx.outputs()])
+
+    def test_no_coins(self):
+        outputs = [(TYPE_ADDRESS, self.change_addr, 1000)]
+        for chooser in [CoinChooserPrivacy(), CoinChooserBranchAndBound()]:
+            with self.assertRaises(NotEnoughFunds):
+                chooser.make_tx([], outputs, [], fee_estimator, 546)
+            with self.assertRaises(NotEnoughFunds):
+                chooser.make_tx([], outputs, [self.change_addr], fee_estimator, 546)
+
+    def test_get_coin_chooser(self):
+        class Config(dict):
+            pass
+        chooser = coinchooser.get_coin_chooser(Config(coin_chooser='BranchAndBound'))
+        self.assertIsInstance(chooser, CoinChooserBranchAndBound)
+        chooser = coinchooser.get_coin_chooser(Config(coin_chooser='Unknown'))
+        self.assertIs(type(chooser), CoinChooserPrivacy)
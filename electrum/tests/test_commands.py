@@ -31,3 +31,8 @@ class TestCommands(unittest.TestCase):
         self.assertEqual("2asd", Commands._setconfig_normalize_value('rpcpassword', '2asd'))
         self.assertEqual("['file:///var/www/','https://electrum.org']",
             Commands._setconfig_normalize_value('rpcpassword', "['file:///var/www/','https://electrum.org']"))
+
+    def test_cryptobackends(self):
+        backends = Commands(config=None, wallet=None, network=None).cryptobackends()
+        self.assertIn(backends['ecc'], ('libsecp256k1', 'python-ecdsa'))
+        self.assertEqual(backends['ripemd160'], backends['ripemd160_available'][0])
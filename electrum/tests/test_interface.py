@@ -1,3 +1,5 @@
+import json
+import socket
 import unittest
 
 from electrum import interface
@@ -26,3 +28,55 @@ class TestInterface(SequentialTestCase):
         self.assertTrue(i.check_host_name(
             peercert={'subject': [('commonName', 'foo.bar.com')]},
             name='foo.bar.com'))
+
+
+class TestInterfaceBatching(SequentialTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.client, self.server = socket.socketpair()
+        self.interface = interface.Interface('localhost:1:t', self.client, batch_size=2)
+
+    def tearDown(self):
+        self.client.close()
+        self.server.close()
+        super().tearDown()
+
+    def test_requests_sent_in_batches(self):
+        for i in range(5):
+            self.interface.queue_request('server.ping', [], i)
+        self.assertTrue(self.interface.send_requests())
+        lines = self.server.recv(65536).decode('utf8').splitlines()
+        messages = [json.loads(line) for line in lines]
+        self.assertEqual([2, 2], [len(m) for m in messages[:2]])
+        self.assertEqual(4, messages[2]['id'])
+        self.assertEqual('2.0', messages[0][0]['jsonrpc'])
+        self.assertEqual(5, len(self.interface.unanswered_requests))
+
+    def test_batch_response_demultiplexed(self):
+        for i in range(3):
+            self.interface.queue_request('server.ping', [], i)
+        self.interface.send_requests()
+        batch = [{'id': 1, 'result': 'b'}, {'id': 0, 'result': 'a'},
+                 {'method': 'blockchain.headers.subscribe', 'params': [{}]}]
+        self.server.sendall((json.dumps(batch) + '\n').encode('utf8'))
+        responses = self.interface.get_responses()
+        self.assertEqual([((u'server.ping', [], 1), 'b'), ((u'server.ping', [], 0), 'a')],
+                         [(req, resp['result']) for req, resp in responses[:2]])
+        self.assertIsNone(responses[2][0])
+        self.assertEqual([2], list(self.interface.unanswered_requests))
+
+    def test_in_flight_adapts_to_latency(self):
+        n = self.interface.in_flight
+        # a full window of fast responses raises the cap by about one
+        for i in range(n):
+            self.interface.update_in_flight(0.01)
+        self.assertGreater(self.interface.in_flight, n + 0.9)
+        self.assertLess(self.interface.in_flight, n + 1)
+        for i in range(2 * n):
+            self.interface.queue_request('server.ping', [], i)
+        self.assertEqual(n, self.interface.num_requests())
+        m = self.interface.in_flight
+        self.interface.latency = None
+        self.interface.update_in_flight(interface.TARGET_LATENCY * 2)
+        self.assertEqual(m / 2, self.interface.in_flight)
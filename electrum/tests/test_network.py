@@ -0,0 +1,275 @@
+import asyncio
+import socket
+import threading
+import time
+from collections import defaultdict
+
+from electrum.network import Network
+
+from . import SequentialTestCase
+
+
+class MockBlockchain:
+
+    def __init__(self, height, checkpoints=(), checkpoint=0, parent=None):
+        self._height = height
+        self.checkpoint = checkpoint
+        self._parent = parent
+        self.checkpoints = list(checkpoints)
+        self.catch_up = None
+        self.connected = []
+
+    def parent(self):
+        return self._parent
+
+    def height(self):
+        return self._height
+
+    def connect_chunk(self, index, hexdata):
+        if hexdata == 'bad':
+            return False
+        if index >= len(self.checkpoints):
+            assert index * 2016 == self._height + 1, index
+            self._height = index * 2016 + len(hexdata) - 1
+        self.connected.append(index)
+        return True
+
+
+class MockInterface:
+
+    def __init__(self, server, tip, blockchain):
+        self.server = server
+        self.tip = tip
+        self.blockchain = blockchain
+        self.mode = 'default'
+        self.requests = {}  # chunk index -> message id
+
+    def queue_request(self, method, params, message_id):
+        self.requests[params[0] // 2016] = message_id
+
+    def print_error(self, *msg):
+        pass
+
+    def close(self):
+        pass
+
+
+class SocketInterface(MockInterface):
+    """An interface over one end of a socket pair."""
+
+    def __init__(self, server):
+        super().__init__(server, 0, None)
+        self.socket, self.peer = socket.socketpair()
+        self.queued = 0
+        self.closed = False
+
+    def fileno(self):
+        return self.socket.fileno()
+
+    def num_requests(self):
+        return self.queued
+
+    def send_requests(self):
+        self.queued = 0
+
+    def close(self):
+        self.closed = True
+        self.socket.close()
+        self.peer.close()
+
+
+def make_network():
+    n = Network.__new__(Network)
+    n.interface_lock = threading.RLock()
+    n.callback_lock = threading.Lock()
+    n.blockchains_lock = threading.Lock()
+    n.callbacks = defaultdict(list)
+    n.blockchains = {}
+    n.message_id = 0
+    n.debug = False
+    n.loop = None
+    n.watched = {}
+    n.writing = set()
+    n.interface = None
+    n.default_server = None
+    n.disconnected_servers = set()
+    n.interfaces = {}
+    return n
+
+
+class TestNetworkLoop(SequentialTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.network = make_network()
+        self.loop = asyncio.SelectorEventLoop()
+        self.network.wakeup_event = asyncio.Event()
+        self.responses = []
+        self.network.process_responses = self.responses.append
+        self.interface = SocketInterface('server')
+        self.network.interfaces = {'server': self.interface}
+
+    def tearDown(self):
+        self.loop.close()
+        self.interface.close()
+        super().tearDown()
+
+    def run_loop_in_thread(self, coro):
+        result = []
+        thread = threading.Thread(target=lambda: result.append(self.loop.run_until_complete(coro)))
+        thread.start()
+        # wait for the loop to run
+        while not self.loop.is_running():
+            time.sleep(0.001)
+        return thread, result
+
+    def test_wakeup_from_other_thread(self):
+        self.network.wakeup()  # no loop yet
+        self.network.loop = self.loop
+        thread, result = self.run_loop_in_thread(
+            asyncio.wait_for(self.network.wakeup_event.wait(), 10))
+        self.network.wakeup()
+        thread.join()
+        self.assertEqual([True], result)
+
+    def test_call_in_loop(self):
+        threads = []
+        call = lambda: threads.append(threading.current_thread())
+        # called right away when there is no loop
+        self.network.call_in_loop(call)
+        self.assertEqual([threading.current_thread()], threads)
+        self.network.loop = self.loop
+        done = asyncio.Event()
+        thread, result = self.run_loop_in_thread(asyncio.wait_for(done.wait(), 10))
+        self.network.call_in_loop(call)
+        self.network.call_in_loop(done.set)
+        thread.join()
+        self.assertEqual([threading.current_thread(), thread], threads)
+
+    def test_watch_and_unwatch(self):
+        n = self.network
+        n.loop = self.loop
+        fd = self.interface.fileno()
+        n.watch_interfaces()
+        self.assertEqual({self.interface: fd}, n.watched)
+        self.assertEqual(set(), n.writing)
+        self.interface.queued = 1
+        n.watch_interfaces()
+        self.assertEqual({self.interface}, n.writing)
+        n.on_writable(self.interface)
+        self.assertEqual(set(), n.writing)
+        self.assertFalse(self.loop.remove_writer(fd))
+        n.on_readable(self.interface)
+        self.assertEqual([self.interface], self.responses)
+        n.unwatch_interface(self.interface)
+        self.assertEqual({}, n.watched)
+        self.assertFalse(self.loop.remove_reader(fd))
+        self.assertTrue(self.interface.closed)
+
+    def test_deferred_close(self):
+        n = self.network
+        n.loop = self.loop
+        n.watch_interfaces()
+        # closed from another thread than the network thread, the socket
+        # is only unwatched and closed when the loop runs
+        n.connection_down('server')
+        self.assertEqual({}, n.interfaces)
+        self.assertIn(self.interface, n.watched)
+        self.assertFalse(self.interface.closed)
+        # events that fire meanwhile are ignored
+        self.interface.queued = 1
+        n.on_readable(self.interface)
+        n.on_writable(self.interface)
+        self.assertEqual([], self.responses)
+        self.assertEqual(1, self.interface.queued)
+        self.loop.run_until_complete(asyncio.sleep(0))
+        self.assertEqual({}, n.watched)
+        self.assertTrue(self.interface.closed)
+
+
+class TestChunkPipeline(SequentialTestCase):
+
+    def setUp(self):
+        super().setUp()
+        n = self.network = make_network()
+        n.requested_chunks = {}
+        n.received_chunks = {}
+        n.chunk_pipeline = 4
+        self.blockchain = MockBlockchain(2015)
+        self.owner = MockInterface('owner', 20 * 2016 + 10, self.blockchain)
+        self.owner.mode = 'catch_up'
+        self.helper = MockInterface('helper', 30 * 2016, self.blockchain)
+        n.interfaces = {'owner': self.owner, 'helper': self.helper}
+
+    def respond(self, index, hexdata='x' * 2016):
+        server = self.network.requested_chunks[index][0]
+        interface = self.network.interfaces[server]
+        self.network.on_block_headers(interface, {
+            'result': {'hex': hexdata}, 'params': [index * 2016, 2016]})
+
+    def test_requests_spread_across_interfaces(self):
+        self.network.request_chunk(self.owner, 1)
+        self.assertEqual([1, 2, 3, 4], sorted(self.network.requested_chunks))
+        self.assertEqual(2, len(self.owner.requests))
+        self.assertEqual(2, len(self.helper.requests))
+
+    def test_chunks_connected_in_order(self):
+        self.network.request_chunk(self.owner, 1)
+        self.respond(3)
+        self.respond(2)
+        self.assertEqual([], self.blockchain.connected)
+        self.assertEqual([1, 4], sorted(self.network.requested_chunks))
+        self.respond(1)
+        self.assertEqual([1, 2, 3], self.blockchain.connected)
+        # the pipeline is refilled
+        self.assertEqual([4, 5, 6, 7], sorted(self.network.requested_chunks))
+
+    def test_partial_last_chunk_from_owner(self):
+        self.network.request_chunk(self.owner, 20)
+        self.assertEqual('owner', self.network.requested_chunks[20][0])
+
+    def test_catch_up_done(self):
+        self.blockchain._height = 19 * 2016 - 1
+        self.network.request_chunk(self.owner, 19)
+        self.respond(19)
+        self.respond(20, 'x' * 11)
+        self.assertEqual(self.owner.tip, self.blockchain.height())
+        self.assertEqual('default', self.owner.mode)
+        self.assertEqual({}, self.network.requested_chunks)
+
+    def test_bad_chunk_requested_from_other_server(self):
+        self.network.request_chunk(self.owner, 1)
+        bad = [i for i, r in self.network.requested_chunks.items() if r[0] == 'helper'][0]
+        for index in range(1, bad):
+            self.respond(index)
+        self.respond(bad, 'bad')
+        # only the owner is disconnected for a bad chunk
+        self.assertIn('helper', self.network.interfaces)
+        self.assertEqual('owner', self.network.requested_chunks[bad][0])
+        self.respond(bad)
+        self.assertIn(bad, self.blockchain.connected)
+        bad = min(self.network.requested_chunks)
+        self.assertEqual('owner', self.network.requested_chunks[bad][0])
+        self.respond(bad, 'bad')
+        self.assertNotIn('owner', self.network.interfaces)
+
+    def test_forked_server_not_used_nor_dropped(self):
+        # the helper is on a branch forking off in chunk 3
+        fork = MockBlockchain(30 * 2016, checkpoint=3 * 2016 + 5, parent=self.blockchain)
+        self.helper.blockchain = fork
+        self.network.request_chunk(self.owner, 1)
+        servers = {i: r[0] for i, r in self.network.requested_chunks.items()}
+        self.assertEqual({1: 'owner', 2: 'helper', 3: 'owner', 4: 'owner'}, servers)
+        self.respond(1)
+        self.respond(2, 'bad')
+        self.assertIn('helper', self.network.interfaces)
+        self.assertEqual('owner', self.network.requested_chunks[2][0])
+
+    def test_checkpointed_chunks_connected_out_of_order(self):
+        self.blockchain.checkpoints = [None] * 10
+        self.owner.mode = 'default'
+        self.network.request_chunk(self.owner, 7)
+        self.network.request_chunk(self.owner, 3)
+        self.respond(7)
+        self.respond(3)
+        self.assertEqual([7, 3], self.blockchain.connected)
@@ -1,6 +1,7 @@
 import unittest
+from unittest import mock
 
-from electrum import transaction
+from electrum import ecc, transaction
 from electrum.bitcoin import TYPE_ADDRESS
 from electrum.keystore import xpubkey_to_address
 from electrum.util import bh2u, bfh
@@ -158,6 +159,97 @@ class TestTransaction(SequentialTestCase):
         self.assertEqual(tx.estimated_weight(), 561)
         self.assertEqual(tx.estimated_size(), 141)
 
+    def test_serialize_to_network_bytes(self):
+        for blob in (signed_blob, v2_blob, signed_segwit_blob):
+            tx = transaction.Transaction(blob)
+            self.assertEqual(bfh(blob), tx.serialize_to_network_bytes())
+            self.assertEqual(blob, tx.serialize_to_network())
+
+    def test_txid_cached(self):
+        tx = transaction.Transaction(signed_blob)
+        txid = tx.txid()
+        self.assertEqual(txid, tx._cache['txid'])
+        self.assertEqual(txid, tx.txid())
+        tx.locktime = 1
+        self.assertNotIn('txid', tx._cache)
+        self.assertNotEqual(txid, tx.txid())
+        tx.locktime = 0
+        self.assertEqual(txid, tx.txid())
+
+    def test_inputs_parsed_on_demand(self):
+        tx = transaction.Transaction(signed_segwit_blob)
+        self.assertEqual(2, len(tx.outputs()))
+        self.assertIsNone(tx._inputs)
+        txin = tx._txin_records[0]
+        self.assertEqual('f0a6a816f21ed4c9a61550e850650ced4f68021df4eb27e863dbf28424726db6', txin.prevout_hash)
+        self.assertEqual(b'', txin.script_sig)
+        self.assertEqual(2, len(txin.witness_items()))
+        # the txid of a complete tx is known without serializing it again
+        self.assertEqual('0d4cb2606505a6590d6944510d4723adcc00b8d7ed338dbdbb33564ff3bb239b', tx.txid())
+        self.assertIsNone(tx._inputs)
+        self.assertEqual(transaction.deserialize(signed_segwit_blob)['inputs'], tx.inputs())
+        self.assertIsNone(tx._txin_records)
+        self.assertEqual(signed_segwit_blob, tx.serialize_to_network())
+
+    def test_partial_tx_not_cached(self):
+        tx = transaction.Transaction(unsigned_blob)
+        tx.serialize_to_network()
+        self.assertEqual({'complete': False}, tx._cache)
+        tx.add_signature_to_txin(0, 0, signed_blob_signatures[0])
+        self.assertEqual(signed_blob, tx.serialize_to_network())
+        self.assertEqual(bfh(signed_blob), tx._cache[('ser', False, True)])
+
+    def test_check_tx_cache(self):
+        tx = transaction.Transaction(signed_blob)
+        tx.txid()
+        tx.inputs()[0]['sequence'] = 0
+        with mock.patch.object(transaction, 'CHECK_TX_CACHE', True):
+            with self.assertRaises(AssertionError):
+                tx.txid()
+
+    def test_sign_parallel(self):
+        secret = bytes(31) + b'\x07'
+        pubkey = ecc.ECPrivkey(secret).get_public_key_hex(compressed=True)
+        def make_tx():
+            inputs = [{'type': ('p2pkh', 'p2wpkh')[n % 2], 'address': '1446oU3z268EeFgfcwJv6X2VBXHfoYxfuD',
+                       'prevout_hash': '%064x' % n, 'prevout_n': 0, 'value': 1000,
+                       'pubkeys': [pubkey], 'x_pubkeys': [pubkey], 'signatures': [None],
+                       'num_sig': 1} for n in range(transaction.PARALLEL_SIGN_MIN_INPUTS)]
+            outputs = [(TYPE_ADDRESS, '14gcRovpkCoGkCNBivQBvw7eso7eiNAbxG', 1000)]
+            return transaction.Transaction.from_io(inputs, outputs)
+        serial, parallel = make_tx(), make_tx()
+        serial.sign({pubkey: (secret, True)})
+        parallel.sign({pubkey: (secret, True)}, num_processes=3)
+        self.assertTrue(parallel.is_complete())
+        self.assertEqual(serial.serialize(), parallel.serialize())
+
+    def _preimages(self, tx):
+        return [tx.serialize_preimage(i) for i in range(len(tx.inputs()))]
+
+    def _fresh(self, tx):
+        return transaction.Transaction.from_io([dict(txin) for txin in tx.inputs()],
+                                               list(tx.outputs()), tx.locktime)
+
+    def test_preimage_cache_invalidated(self):
+        pubkey = '02e61d176da16edd1d258a200ad9759ef63adf8e14cd97f53227bae35cdb84d2f6'
+        for txin_type in ('p2pkh', 'p2wpkh'):
+            inputs = [{'type': txin_type, 'address': '1446oU3z268EeFgfcwJv6X2VBXHfoYxfuD',
+                       'prevout_hash': '%064x' % (3 - n), 'prevout_n': n, 'value': 1000 * (n + 1),
+                       'pubkeys': [pubkey], 'x_pubkeys': [pubkey], 'signatures': [None],
+                       'num_sig': 1} for n in range(3)]
+            outputs = [(TYPE_ADDRESS, '14gcRovpkCoGkCNBivQBvw7eso7eiNAbxG', 2000)]
+            tx = transaction.Transaction.from_io(inputs, outputs)
+            before = self._preimages(tx)
+            tx.set_rbf(True)
+            self.assertNotEqual(before, self._preimages(tx))
+            self.assertEqual(self._preimages(self._fresh(tx)), self._preimages(tx))
+            tx.add_outputs([(TYPE_ADDRESS, '35ZqQJcBQMZ1rsv8aSuJ2wkC7ohUCQMJbT', 1000)])
+            self.assertEqual(self._preimages(self._fresh(tx)), self._preimages(tx))
+            tx.BIP_LI01_sort()
+            self.assertEqual(self._preimages(self._fresh(tx)), self._preimages(tx))
+            tx.add_inputs([dict(inputs[0], prevout_n=7)])
+            self.assertEqual(self._preimages(self._fresh(tx)), self._preimages(tx))
+
     def test_errors(self):
         with self.assertRaises(TypeError):
             transaction.Transaction.pay_script(output_type=None, addr='')
@@ -193,6 +285,27 @@ class TestTransaction(SequentialTestCase):
         self.assertEqual((ADDR, '35ZqQJcBQMZ1rsv8aSuJ2wkC7ohUCQMJbT'), addr_from_script('a9142a84cf00d47f699ee7bbc1dea5ec1bdecb4ac15487'))
         self.assertEqual((ADDR, '3PyjzJ3im7f7bcV724GR57edKDqoZvH7Ji'), addr_from_script('a914f47c8954e421031ad04ecd8e7752c9479206b9d387'))
 
+    def test_output_script_fast_path(self):
+        # the fast path agrees with the generic parser, including on
+        # scripts that only look like the standard templates
+        scripts = [
+            '76a91428662c67561b95c79d2257d2a93d9d151c977e9188ac',
+            '76a91428662c67561b95c79d2257d2a93d9d151c977e9188ad',
+            '76a94c1428662c67561b95c79d2257d2a93d9d151c977e9188ac',
+            'a9142a84cf00d47f699ee7bbc1dea5ec1bdecb4ac15487',
+            'a9142a84cf00d47f699ee7bbc1dea5ec1bdecb4ac15488',
+            '0014751e76e8199196d454941c45d1b3a323f1433bd6',
+            '5114751e76e8199196d454941c45d1b3a323f1433bd6',
+            '00201863143c14c5166804bd19203356da136c985678cd4d27a1b8c6329604903262',
+            '21' + '02' + '11' * 32 + 'ac',
+            '41' + '04' + '11' * 64 + 'ac',
+            '41' + '04' + '11' * 64 + 'ad',
+            '6a' + '14' + '11' * 20,
+        ]
+        for script in scripts:
+            self.assertEqual(transaction.get_address_from_output_script_generic(bfh(script)),
+                             transaction.get_address_from_output_script(bfh(script)))
+
 #####
 
     def _run_naive_tests_on_tx(self, raw_tx, txid):
@@ -804,6 +917,74 @@ class TestTransactionTestnet(TestCaseForTestnet):
 # end partial txns <---
 
 
+class TestTxStore(SequentialTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.txs = [transaction.Transaction(blob)
+                    for blob in (signed_blob, v2_blob, signed_segwit_blob)]
+        self.txids = [tx.txid() for tx in self.txs]
+
+    def make_store(self, max_parsed):
+        store = transaction.TxStore(max_parsed=max_parsed)
+        for txid, tx in zip(self.txids, self.txs):
+            store[txid] = tx
+        return store
+
+    def test_lru_eviction(self):
+        store = self.make_store(max_parsed=2)
+        self.assertEqual(3, len(store))
+        self.assertEqual(self.txids[1:], list(store._parsed))
+        # a lookup makes a tx the most recently used
+        self.assertIs(self.txs[1], store[self.txids[1]])
+        self.assertEqual([self.txids[2], self.txids[1]], list(store._parsed))
+        # an evicted tx is parsed again, and evicts the least recently used
+        tx = store[self.txids[0]]
+        self.assertIsNot(self.txs[0], tx)
+        self.assertEqual(signed_blob, tx.serialize())
+        self.assertEqual([self.txids[1], self.txids[0]], list(store._parsed))
+        self.assertIs(tx, store[self.txids[0]])
+        self.assertIn(self.txids[2], store)
+        self.assertIsNone(store.get('00' * 32))
+        with self.assertRaises(KeyError):
+            store['00' * 32]
+
+    def test_pop(self):
+        store = self.make_store(max_parsed=1)
+        # parsed and evicted txs alike
+        self.assertIs(self.txs[2], store.pop(self.txids[2]))
+        self.assertEqual(v2_blob, store.pop(self.txids[1]).serialize())
+        self.assertEqual([self.txids[0]], store.keys())
+        self.assertNotIn(self.txids[1], store)
+        self.assertIsNone(store.pop(self.txids[1], None))
+        self.assertEqual('default', store.pop(self.txids[1], 'default'))
+        with self.assertRaises(KeyError):
+            store.pop(self.txids[1])
+
+    def test_raw(self):
+        store = transaction.TxStore(max_parsed=1)
+        store.set_raw(self.txids[0], signed_blob)
+        store.set_raw(self.txids[1], v2_blob)
+        self.assertEqual({}, store._parsed)
+        self.assertEqual(v2_blob, store.get_raw(self.txids[1]))
+        self.assertIsNone(store.get_raw(self.txids[2]))
+        self.assertEqual([(self.txids[0], signed_blob), (self.txids[1], v2_blob)],
+                         list(store.raw_items()))
+        self.assertEqual(self.txids[1], store[self.txids[1]].txid())
+        # set_raw replaces the parsed tx
+        store.set_raw(self.txids[1], v2_blob)
+        self.assertEqual({}, store._parsed)
+
+    def test_items_parse_evicted(self):
+        store = self.make_store(max_parsed=1)
+        self.assertEqual(self.txids, list(store))
+        items = list(store.items())
+        self.assertEqual(self.txids, [txid for txid, tx in items])
+        self.assertEqual(self.txids, [tx.txid() for txid, tx in items])
+        self.assertEqual(self.txids, [tx.txid() for tx in store.values()])
+        self.assertEqual(1, len(store._parsed))
+
+
 class NetworkMock(object):
 
     def __init__(self, unspent):
@@ -0,0 +1,65 @@
+from electrum.txio import TxInputs, TxOutputs, SpentOutpoints
+
+from . import SequentialTestCase
+
+
+TXID1 = '8e1d0d8fad9fd7b2b6fc5ad8c36b3f4d4fdb5dc7bb2d4bbb0b7c3c54e6a0b2d1'
+TXID2 = '42b3a8ff5be9bd9e0f9ad8d5a8bca43b3f0e6f4c3b6a8f3c4d0c2b2a1f0e9d8c'
+TXID3 = 'e0b2c44d3a6f1e2d8b9c7a5f3e1d0c9b8a7f6e5d4c3b2a190817263544536271'
+ADDR1 = '1KSezYMhAJMWqFbVFB2JshYg69UpmEXR4D'
+ADDR2 = '1BvBMSEYstWetqTFn5Au4m4GFg7xJaNVN2'
+
+
+class TestTxIO(SequentialTestCase):
+
+    def test_txi_json_roundtrip(self):
+        d = {TXID2: {ADDR1: [[TXID1 + ':0', 1000], [TXID1 + ':3', 2000]],
+                     ADDR2: [[TXID1 + ':1', 3000]]},
+             TXID1: {}}
+        txi = TxInputs.from_json(d)
+        self.assertEqual(d, txi.to_json())
+        self.assertEqual([], txi.get(TXID1))
+        self.assertEqual({ADDR1, ADDR2}, txi.addresses(TXID2))
+        self.assertFalse(txi.add(TXID2, ADDR1, TXID1, 3, 2000))
+        self.assertTrue(txi.add(TXID2, ADDR1, TXID1, 4, 500))
+        self.assertEqual(4, len(txi.get(TXID2)))
+
+    def test_txo_json_roundtrip(self):
+        d = {TXID1: {ADDR1: [[0, 1000, False], [3, 2000, False]],
+                     ADDR2: [[1, 3000, False]]}}
+        txo = TxOutputs.from_json(d)
+        self.assertEqual(d, txo.to_json())
+        self.assertEqual(ADDR2, txo.get_output(TXID1, 1).address)
+        self.assertEqual(2000, txo.get_output(TXID1, 3).value)
+        self.assertIsNone(txo.get_output(TXID1, 2))
+        self.assertIsNone(txo.get_output(TXID2, 0))
+        self.assertIn(TXID1, txo)
+        self.assertEqual([TXID1], list(txo))
+
+    def test_spent_outpoints(self):
+        d = {TXID1: {'0': TXID2, '5': TXID2}}
+        spent = SpentOutpoints.from_json(d)
+        self.assertEqual(TXID2, spent.get(TXID1, 5))
+        self.assertIsNone(spent.get(TXID1, 1))
+        self.assertEqual({TXID1: {0: TXID2, 5: TXID2}}, spent.to_json())
+        spent.remove(TXID1, 0)
+        self.assertIsNone(spent.get(TXID1, 0))
+        spent.add(TXID2, 0, TXID1)
+        spent.remove_spender(TXID2)
+        self.assertEqual({TXID2: {0: TXID1}}, spent.to_json())
+
+    def test_spent_outpoints_index(self):
+        spent = SpentOutpoints()
+        spent.add(TXID1, 0, TXID2)
+        spent.add(TXID1, 1, TXID2)
+        self.assertEqual({TXID2}, spent.get_spenders(TXID1))
+        self.assertEqual(set(), spent.get_spenders(TXID2))
+        # the outpoint is spent by another tx now
+        spent.add(TXID1, 1, TXID3)
+        self.assertEqual({TXID2, TXID3}, spent.get_spenders(TXID1))
+        spent.remove_spender(TXID2)
+        self.assertEqual({TXID3}, spent.get_spenders(TXID1))
+        self.assertEqual({TXID1: {1: TXID3}}, spent.to_json())
+        spent.remove(TXID1, 1)
+        self.assertEqual(set(), spent.get_spenders(TXID1))
+        self.assertEqual((0, {}, {}), (len(spent), spent._by_spender, spent._by_parent))
@@ -6,7 +6,9 @@ import os
 import json
 
 from io import StringIO
-from electrum.storage import WalletStorage, FINAL_SEED_VERSION
+from electrum.storage import (WalletStorage, FINAL_SEED_VERSION, STO_FMT_JSON,
+                              STO_EV_USER_PW)
+from electrum.util import WalletFileException
 
 from . import SequentialTestCase
 
@@ -54,7 +56,7 @@ class TestWalletStorage(WalletTestCase):
 
     def test_write_dictionary_to_file(self):
 
-        storage = WalletStorage(self.wallet_path)
+        storage = WalletStorage(self.wallet_path, file_format=STO_FMT_JSON)
 
         some_dict = {
             u"a": u"b",
@@ -69,3 +71,95 @@ class TestWalletStorage(WalletTestCase):
         with open(self.wallet_path, "r") as f:
             contents = f.read()
         self.assertEqual(some_dict, json.loads(contents))
+
+    def test_write_log_appends_changed_items(self):
+        storage = WalletStorage(self.wallet_path)
+        txs = {"%064x" % i: "00" * 200 for i in range(100)}
+        storage.put('transactions', txs)
+        storage.put('labels', {'a': 'b'})
+        storage.write()
+        size = os.path.getsize(self.wallet_path)
+
+        txs["%064x" % 100] = "11" * 200
+        txs.pop("%064x" % 0)
+        storage.put('transactions', txs)
+        storage.put('labels', None)
+        storage.write()
+        # only the changed items are appended
+        self.assertLess(os.path.getsize(self.wallet_path) - size, 1000)
+
+        storage = WalletStorage(self.wallet_path, manual_upgrades=True)
+        self.assertEqual(txs, storage.get('transactions'))
+        self.assertEqual(None, storage.get('labels'))
+        self.assertEqual(FINAL_SEED_VERSION, storage.get('seed_version'))
+
+    def test_write_log_ignores_truncated_record(self):
+        storage = WalletStorage(self.wallet_path)
+        storage.put('a', 'b')
+        storage.write()
+        storage.put('c', 'd')
+        storage.write()
+        with open(self.wallet_path, "r+b") as f:
+            f.truncate(os.path.getsize(self.wallet_path) - 1)
+
+        storage = WalletStorage(self.wallet_path, manual_upgrades=True)
+        self.assertEqual('b', storage.get('a'))
+        self.assertEqual(None, storage.get('c'))
+        storage.put('e', 'f')
+        storage.write()
+        storage = WalletStorage(self.wallet_path, manual_upgrades=True)
+        self.assertEqual('f', storage.get('e'))
+
+    def test_read_log_corrupt_record(self):
+        storage = WalletStorage(self.wallet_path)
+        storage.put('a', 'b')
+        storage.write()
+        size = os.path.getsize(self.wallet_path)
+        storage.put('c', 'd')
+        storage.write()
+        storage.put('e', 'f')
+        storage.write()
+        with open(self.wallet_path, "rb") as f:
+            raw = f.read()
+        # flip a bit in the payload of the middle record
+        raw = raw[:size + 10] + bytes([raw[size + 10] ^ 1]) + raw[size + 11:]
+        with open(self.wallet_path, "wb") as f:
+            f.write(raw)
+        with self.assertRaises(WalletFileException):
+            WalletStorage(self.wallet_path, manual_upgrades=True)
+        with open(self.wallet_path, "rb") as f:
+            self.assertEqual(raw, f.read())
+
+    def test_convert_json_file_to_log(self):
+        some_dict = {"a": "b", "seed_version": 17}
+        with open(self.wallet_path, "w") as f:
+            f.write(json.dumps(some_dict))
+        storage = WalletStorage(self.wallet_path, manual_upgrades=True)
+        storage.put('c', 'd')
+        storage.write()
+        # not upgraded yet, so the file is still readable by older versions
+        with open(self.wallet_path, "rb") as f:
+            self.assertTrue(f.read().startswith(b'{'))
+        storage = WalletStorage(self.wallet_path, manual_upgrades=True)
+        self.assertTrue(storage.requires_upgrade())
+        storage.upgrade()
+        with open(self.wallet_path, "rb") as f:
+            self.assertFalse(f.read().startswith(b'{'))
+        storage = WalletStorage(self.wallet_path, manual_upgrades=True)
+        self.assertEqual('b', storage.get('a'))
+        self.assertEqual('d', storage.get('c'))
+        self.assertEqual(FINAL_SEED_VERSION, storage.get('seed_version'))
+
+    def test_write_log_encrypted(self):
+        storage = WalletStorage(self.wallet_path)
+        storage.set_password('secret', STO_EV_USER_PW)
+        storage.put('a', {'x': 1})
+        storage.write()
+        storage.put('a', {'x': 1, 'y': 2})
+        storage.write()
+
+        storage = WalletStorage(self.wallet_path, manual_upgrades=True)
+        self.assertTrue(storage.is_encrypted_with_user_pw())
+        self.assertFalse(storage.is_past_initial_decryption())
+        storage.decrypt('secret')
+        self.assertEqual({'x': 1, 'y': 2}, storage.get('a'))
@@ -8,7 +8,9 @@ from electrum import storage, bitcoin, keystore, constants
 from electrum import Transaction
 from electrum import SimpleConfig
 from electrum.wallet import TX_HEIGHT_UNCONFIRMED, TX_HEIGHT_UNCONF_PARENT, sweep, Multisig_Wallet, Standard_Wallet, Imported_Wallet
-from electrum.util import bfh, bh2u
+from electrum.util import bfh, bh2u, NotEnoughFunds
+from electrum.commands import Commands, MAX_RESERVE_ATTEMPTS
+from electrum.payout import PayoutEngine
 
 from electrum.plugins.trustedcoin import trustedcoin
 
@@ -67,6 +69,37 @@ class WalletIntegrityHelper:
         return w
 
 
+def create_funded_wallets(values):
+    """Returns a wallet with a coin of each of values, and another wallet."""
+    ks = keystore.from_seed('bitter grass shiver impose acquire brush forget axis eager alone wine silver', '', False)
+    wallet = WalletIntegrityHelper.create_standard_wallet(ks, gap_limit=len(values))
+    ks = keystore.from_seed('cycle rocket west magnet parrot shuffle foot correct salt library feed song', '', False)
+    recipient = WalletIntegrityHelper.create_standard_wallet(ks, gap_limit=2)
+    # a made up transaction paying values to as many addresses of
+    # wallet, as coins of the same address are spent together
+    raw_tx = '01000000' + '01' + '11' * 32 + '00000000' + '00' + 'ffffffff'
+    raw_tx += bitcoin.var_int(len(values))
+    for value, address in zip(values, wallet.get_receiving_addresses()):
+        script = bitcoin.address_to_script(address)
+        raw_tx += bitcoin.int_to_hex(value, 8) + bitcoin.var_int(len(script) // 2) + script
+    raw_tx += '00000000'
+    funding_tx = Transaction(raw_tx)
+    wallet.receive_tx_callback(funding_tx.txid(), funding_tx, TX_HEIGHT_UNCONFIRMED)
+    return wallet, recipient
+
+
+def make_spending_tx(prevout_hash, prevout_n, outputs):
+    """Returns a made up transaction spending one outpoint to outputs,
+    a list of (address, value)."""
+    raw_tx = '01000000' + '01' + bitcoin.rev_hex(prevout_hash) + bitcoin.int_to_hex(prevout_n, 4)
+    raw_tx += '00' + 'fdffffff' + bitcoin.var_int(len(outputs))
+    for address, value in outputs:
+        script = bitcoin.address_to_script(address)
+        raw_tx += bitcoin.int_to_hex(value, 8) + bitcoin.var_int(len(script) // 2) + script
+    raw_tx += '00000000'
+    return Transaction(raw_tx)
+
+
 # TODO passphrase/seed_extension
 class TestWalletKeystoreAddressIntegrityForMainnet(SequentialTestCase):
 
@@ -373,6 +406,98 @@ class TestWalletKeystoreAddressIntegrityForMainnet(SequentialTestCase):
         self.assertEqual(w.get_change_addresses()[0], 'bc1q0fj5mra96hhnum80kllklc52zqn6kppt3hyzr49yhr3ecr42z3tsrkg3gs')
 
 
+class TestDerivedPubkeys(SequentialTestCase):
+
+    @mock.patch.object(storage.WalletStorage, '_write')
+    def test_address_pubkeys_persisted(self, mock_write):
+        seed_words = 'cycle rocket west magnet parrot shuffle foot correct salt library feed song'
+        ks = keystore.from_seed(seed_words, '', False)
+        w = WalletIntegrityHelper.create_standard_wallet(ks, gap_limit=20)
+        self.assertEqual(20, len(w.get_receiving_addresses()))
+        for i, addr in enumerate(w.get_receiving_addresses()):
+            self.assertEqual(ks.derive_pubkey(0, i), w.get_public_key(addr))
+        self.assertEqual(w.address_pubkeys[False], w.storage.get('address_pubkeys')['receiving'])
+        # a reopened wallet does not derive known pubkeys again
+        w2 = Standard_Wallet(w.storage)
+        with mock.patch.object(keystore.BIP32_KeyStore, 'derive_pubkey', side_effect=AssertionError):
+            for addr in w.get_receiving_addresses() + w.get_change_addresses():
+                self.assertEqual(w.get_public_key(addr), w2.get_public_key(addr))
+
+    @mock.patch.object(storage.WalletStorage, '_write')
+    def test_corrupt_address_pubkeys(self, mock_write):
+        ks = keystore.from_seed('cycle rocket west magnet parrot shuffle foot correct salt library feed song', '', False)
+        w = WalletIntegrityHelper.create_standard_wallet(ks, gap_limit=5)
+        pubkeys = w.address_pubkeys[False]
+        wrong = ks.derive_pubkey(0, 100)
+        # the keystore keeps deriving pubkeys itself
+        w.storage.put('address_pubkeys', {'receiving': pubkeys[:2] + [wrong] + pubkeys[3:],
+                                          'change': w.address_pubkeys[True]})
+        w2 = Standard_Wallet(w.storage)
+        self.assertEqual(pubkeys[2], w2.keystore.derive_pubkey(0, 2))
+        self.assertEqual(pubkeys[3:], w2.address_pubkeys[False][3:])
+        # a wrong pubkey in the checked sample discards them all
+        w.storage.put('address_pubkeys', {'receiving': pubkeys[:4] + [wrong],
+                                          'change': w.address_pubkeys[True]})
+        w2 = Standard_Wallet(w.storage)
+        self.assertEqual([None] * 5, w2.address_pubkeys[False])
+        self.assertEqual(pubkeys[4], w2.get_public_key(w.get_receiving_addresses()[4]))
+        self.assertIsNone(w2.keystore.get_pubkey_derivation(wrong))
+
+    @mock.patch.object(storage.WalletStorage, '_write')
+    def test_address_scripthashes_persisted(self, mock_write):
+        ks = keystore.from_seed('cycle rocket west magnet parrot shuffle foot correct salt library feed song', '', False)
+        w = WalletIntegrityHelper.create_standard_wallet(ks, gap_limit=5)
+        addresses = w.get_addresses()
+        h2addr = w.get_scripthashes(addresses)
+        self.assertEqual({bitcoin.address_to_scripthash(addr): addr for addr in addresses}, h2addr)
+        # a reopened wallet does not compute them again
+        w2 = Standard_Wallet(w.storage)
+        with mock.patch.object(bitcoin, 'address_to_scripthash', side_effect=AssertionError):
+            self.assertEqual(h2addr, w2.get_scripthashes(addresses))
+
+    @mock.patch.object(storage.WalletStorage, '_write')
+    def test_corrupt_address_scripthashes(self, mock_write):
+        ks = keystore.from_seed('cycle rocket west magnet parrot shuffle foot correct salt library feed song', '', False)
+        w = WalletIntegrityHelper.create_standard_wallet(ks, gap_limit=5)
+        addresses = w.get_addresses()
+        h2addr = w.get_scripthashes(addresses)
+        d = dict(w.address_scripthashes)
+        d[addresses[-1]] = d[addresses[0]]
+        w.storage.put('address_scripthashes', d)
+        w2 = Standard_Wallet(w.storage)
+        self.assertEqual({}, w2.address_scripthashes)
+        self.assertEqual({}, w.storage.get('address_scripthashes'))
+        self.assertEqual(h2addr, w2.get_scripthashes(addresses))
+
+    @mock.patch.object(storage.WalletStorage, '_write')
+    def test_pubkey_derivation_index(self, mock_write):
+        ks = keystore.from_seed('cycle rocket west magnet parrot shuffle foot correct salt library feed song', '', False)
+        other = keystore.from_xpub('xpub661MyMwAqRbcGfCPEkkyo5WmcrhTq8mi3xuBS7VEZ3LYvsgY1cCFDbenT33bdD12axvrmXhuX3xkAbKci3yZY9ZEk8vhLic7KNhLjqdh5ec')
+        x_pubkey = ks.get_xpubkey(1, 300)
+        self.assertEqual([1, 300], ks.get_pubkey_derivation(x_pubkey))
+        self.assertEqual(ks.parse_xpubkey(x_pubkey)[1], ks.get_pubkey_derivation(x_pubkey))
+        fresh = keystore.from_seed('cycle rocket west magnet parrot shuffle foot correct salt library feed song', '', False)
+        self.assertEqual([1, 300], fresh.get_pubkey_derivation(x_pubkey))
+        self.assertIsNone(ks.get_pubkey_derivation(other.get_xpubkey(1, 300)))
+        pubkey = ks.derive_pubkey(0, 5)
+        self.assertIsNone(fresh.get_pubkey_derivation(pubkey))
+        self.assertEqual([0, 5], ks.get_pubkey_derivation(pubkey))
+        # a reopened wallet knows the pubkeys of its addresses
+        w = WalletIntegrityHelper.create_standard_wallet(fresh, gap_limit=3)
+        w2 = Standard_Wallet(w.storage)
+        addr = w2.get_change_addresses()[2]
+        self.assertEqual([1, 2], w2.keystore.get_pubkey_derivation(w.get_public_key(addr)))
+
+    @mock.patch.object(storage.WalletStorage, '_write')
+    def test_multisig_address_pubkeys(self, mock_write):
+        ks1 = keystore.from_seed('blast uniform dragon fiscal ensure vast young utility dinosaur abandon rookie sure', '', True)
+        ks2 = keystore.from_xpub('xpub661MyMwAqRbcGfCPEkkyo5WmcrhTq8mi3xuBS7VEZ3LYvsgY1cCFDbenT33bdD12axvrmXhuX3xkAbKci3yZY9ZEk8vhLic7KNhLjqdh5ec')
+        w = WalletIntegrityHelper.create_multisig_wallet([ks1, ks2], '2of2', gap_limit=5)
+        for i, addr in enumerate(w.get_receiving_addresses()):
+            self.assertEqual([ks1.derive_pubkey(0, i), ks2.derive_pubkey(0, i)], w.get_public_keys(addr))
+            self.assertEqual(addr, w.pubkeys_to_address(w.derive_pubkeys(0, i)))
+
+
 class TestWalletKeystoreAddressIntegrityForTestnet(TestCaseForTestnet):
 
     @mock.patch.object(storage.WalletStorage, '_write')
@@ -1494,6 +1619,201 @@ class TestWalletOfflineSigning(TestCaseForTestnet):
         self.assertEqual('4376fa5f1f6cb37b1f3956175d3bd4ef6882169294802b250a3c672f3ff431c1', tx.wtxid())
 
 
+class TestCoinReservation(TestCaseForTestnet):
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.electrum_path = tempfile.mkdtemp()
+        cls.config = SimpleConfig({'electrum_path': cls.electrum_path})
+
+    @classmethod
+    def tearDownClass(cls):
+        super().tearDownClass()
+        shutil.rmtree(cls.electrum_path)
+
+    @mock.patch.object(storage.WalletStorage, '_write')
+    def test_reserve_and_release(self, mock_write):
+        wallet, recipient = create_funded_wallets([100000] * 3)
+        coins = wallet.get_spendable_coins(None, self.config)
+        self.assertTrue(wallet.reserve_coins(coins[:2]))
+        self.assertFalse(wallet.reserve_coins(coins[1:]))
+        self.assertEqual(coins[2:], wallet.get_spendable_coins(None, self.config))
+        self.assertEqual(2, len(wallet.storage.get('reserved_coins')))
+        wallet.release_coins(coins[:1])
+        self.assertEqual([coins[0], coins[2]], wallet.get_spendable_coins(None, self.config))
+        self.assertEqual(1, len(wallet.storage.get('reserved_coins')))
+
+    @mock.patch.object(storage.WalletStorage, '_write')
+    def test_reservation_expires(self, mock_write):
+        wallet, recipient = create_funded_wallets([100000] * 2)
+        coins = wallet.get_spendable_coins(None, self.config)
+        with mock.patch('time.time', return_value=1000000):
+            self.assertTrue(wallet.reserve_coins(coins[:1], ttl=60))
+        with mock.patch('time.time', return_value=1000059):
+            self.assertEqual(coins[1:], wallet.get_spendable_coins(None, self.config))
+        with mock.patch('time.time', return_value=1000060):
+            self.assertEqual(coins, wallet.get_spendable_coins(None, self.config))
+            self.assertEqual({}, wallet.storage.get('reserved_coins'))
+
+    @mock.patch.object(storage.WalletStorage, '_write')
+    def test_released_when_spent(self, mock_write):
+        wallet, recipient = create_funded_wallets([100000] * 2)
+        outputs = [(bitcoin.TYPE_ADDRESS, recipient.get_receiving_address(), 30000)]
+        tx = wallet.mktx(outputs=outputs, password=None, config=self.config, fee=1000)
+        self.assertTrue(wallet.reserve_coins(tx.inputs()))
+        self.assertEqual(1, len(wallet.get_reserved_coins()))
+        wallet.receive_tx_callback(tx.txid(), tx, TX_HEIGHT_UNCONFIRMED)
+        self.assertEqual(set(), wallet.get_reserved_coins())
+
+    @mock.patch.object(storage.WalletStorage, '_write')
+    def test_payto_reserves_coins(self, mock_write):
+        wallet, recipient = create_funded_wallets([100000] * 2)
+
+        class NetworkMock:
+            def broadcast_transaction(self, tx):
+                return False, 'error: rejected'
+
+        cmds = Commands(config=self.config, wallet=wallet, network=NetworkMock())
+        address = recipient.get_receiving_address()
+        tx1 = Transaction(cmds.payto(address, '0.0003', fee='0.00001')['hex'])
+        tx2 = Transaction(cmds.payto(address, '0.0003', fee='0.00001')['hex'])
+        self.assertNotEqual(tx1.inputs()[0]['prevout_n'], tx2.inputs()[0]['prevout_n'])
+        with self.assertRaises(NotEnoughFunds):
+            cmds.payto(address, '0.0003', fee='0.00001')
+        # a failed broadcast releases the coins
+        self.assertEqual((False, 'error: rejected'), cmds.broadcast(str(tx1)))
+        tx3 = Transaction(cmds.payto(address, '0.0003', fee='0.00001')['hex'])
+        self.assertEqual(tx1.inputs()[0]['prevout_n'], tx3.inputs()[0]['prevout_n'])
+
+    @mock.patch.object(storage.WalletStorage, '_write')
+    def test_payto_preview_does_not_reserve(self, mock_write):
+        wallet, recipient = create_funded_wallets([100000])
+        cmds = Commands(config=self.config, wallet=wallet, network=None)
+        address = recipient.get_receiving_address()
+        tx1 = cmds.payto(address, '0.0003', fee='0.00001', unsigned=True)
+        tx2 = cmds.payto(address, '0.0003', fee='0.00001', noreserve=True)
+        self.assertTrue(Transaction(tx2['hex']).is_complete())
+        self.assertEqual(set(), wallet.get_reserved_coins())
+        tx3 = cmds.payto(address, '0.0003', fee='0.00001')
+        self.assertEqual(1, len(wallet.get_reserved_coins()))
+        self.assertEqual(tx2['hex'], tx3['hex'])
+
+    @mock.patch.object(storage.WalletStorage, '_write')
+    def test_payto_reserve_attempts_bounded(self, mock_write):
+        wallet, recipient = create_funded_wallets([100000])
+        cmds = Commands(config=self.config, wallet=wallet, network=None)
+        with mock.patch.object(wallet, 'reserve_coins', return_value=False) as reserve_coins:
+            with self.assertRaisesRegex(Exception, 'Could not reserve coins'):
+                cmds.payto(recipient.get_receiving_address(), '0.0003', fee='0.00001')
+        self.assertEqual(MAX_RESERVE_ATTEMPTS, reserve_coins.call_count)
+
+
+class TestPayoutEngine(TestCaseForTestnet):
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.electrum_path = tempfile.mkdtemp()
+        cls.config = SimpleConfig({'electrum_path': cls.electrum_path})
+
+    @classmethod
+    def tearDownClass(cls):
+        super().tearDownClass()
+        shutil.rmtree(cls.electrum_path)
+
+    def check_results(self, wallet, results, payments):
+        txs = {}
+        for result, (address, amount) in zip(results, payments):
+            self.assertNotIn('error', result)
+            tx = txs.setdefault(result['txid'], Transaction(result['hex']))
+            self.assertTrue(tx.is_complete())
+            self.assertEqual(result['txid'], tx.txid())
+            self.assertIn((bitcoin.TYPE_ADDRESS, address, amount), tx.outputs())
+        spent = [txin['prevout_hash'] + ':%d' % txin['prevout_n']
+                 for tx in txs.values() for txin in tx.inputs()]
+        self.assertEqual(len(spent), len(set(spent)))
+        return list(txs.values())
+
+    @mock.patch.object(storage.WalletStorage, '_write')
+    def test_max_outputs(self, mock_write):
+        wallet, recipient = create_funded_wallets([100000] * 6)
+        payments = [(addr, 40000) for addr in recipient.get_receiving_addresses()] * 4
+        engine = PayoutEngine(wallet, self.config, fee_per_kb=1000, max_outputs=3)
+        txs = self.check_results(wallet, engine.run(payments), payments)
+        self.assertEqual([4, 4, 3], [len(tx.outputs()) for tx in txs])
+
+    @mock.patch.object(storage.WalletStorage, '_write')
+    def test_max_size(self, mock_write):
+        wallet, recipient = create_funded_wallets([100000] * 6)
+        payments = [(addr, 20000) for addr in recipient.get_receiving_addresses()] * 4
+        engine = PayoutEngine(wallet, self.config, fee_per_kb=1000, max_size=200)
+        txs = self.check_results(wallet, engine.run(payments), payments)
+        self.assertEqual(4, len(txs))
+        self.assertTrue(all(tx.estimated_size() <= 200 for tx in txs))
+
+    @mock.patch.object(storage.WalletStorage, '_write')
+    def test_insufficient_funds(self, mock_write):
+        wallet, recipient = create_funded_wallets([100000] * 2)
+        address = recipient.get_receiving_address()
+        payments = [(address, 50000), (address, 500000), (address, 50000)]
+        engine = PayoutEngine(wallet, self.config, fee_per_kb=1000, max_outputs=1)
+        results = engine.run(payments)
+        self.assertEqual('Insufficient funds', results[1]['error'])
+        self.check_results(wallet, results[::2], payments[::2])
+
+    @mock.patch.object(storage.WalletStorage, '_write')
+    def test_coins_reserved_across_runs(self, mock_write):
+        wallet, recipient = create_funded_wallets([100000] * 2)
+        payments = [(recipient.get_receiving_address(), 30000)]
+        engine = PayoutEngine(wallet, self.config, fee_per_kb=1000)
+        tx1 = self.check_results(wallet, engine.run(payments), payments)[0]
+        tx2 = self.check_results(wallet, engine.run(payments), payments)[0]
+        self.assertNotEqual(tx1.inputs()[0]['prevout_n'], tx2.inputs()[0]['prevout_n'])
+        self.assertIn('error', engine.run(payments)[0])
+        # once the wallet has the transaction, its change can be spent
+        wallet.receive_tx_callback(tx1.txid(), tx1, TX_HEIGHT_UNCONFIRMED)
+        self.check_results(wallet, engine.run(payments), payments)
+
+    @mock.patch.object(storage.WalletStorage, '_write')
+    def test_reserve_attempts_bounded(self, mock_write):
+        wallet, recipient = create_funded_wallets([100000] * 2)
+        address = recipient.get_receiving_address()
+        payments = [(address, 30000), (address, 30000)]
+        engine = PayoutEngine(wallet, self.config, fee_per_kb=1000, max_outputs=1)
+        with mock.patch.object(wallet, 'reserve_coins', return_value=False) as reserve_coins:
+            results = engine.run(payments)
+        self.assertEqual(2 * MAX_RESERVE_ATTEMPTS, reserve_coins.call_count)
+        self.assertEqual(['Could not reserve coins, they are being spent by other transactions'] * 2,
+                         [result['error'] for result in results])
+
+    @mock.patch.object(storage.WalletStorage, '_write')
+    def test_paybatch_command(self, mock_write):
+        wallet, recipient = create_funded_wallets([100000] * 3)
+
+        class NetworkMock:
+            def __init__(self):
+                self.txs = []
+            def broadcast_transaction(self, tx):
+                self.txs.append(tx)
+                if len(self.txs) == 1:
+                    return False, 'error: rejected'
+                return True, tx.txid()
+
+        network = NetworkMock()
+        cmds = Commands(config=self.config, wallet=wallet, network=network)
+        address = recipient.get_receiving_address()
+        results = cmds.paybatch([[address, '0.0005']] * 3, feerate=1000, max_outputs=1)
+        self.assertEqual(3, len(network.txs))
+        self.assertEqual('error: rejected', results[0]['error'])
+        self.assertEqual([network.txs[1].txid(), network.txs[2].txid()],
+                         [result['txid'] for result in results[1:]])
+        # the coin of the rejected transaction can be spent again
+        results = cmds.paybatch([[address, '0.0005']], feerate=1000)
+        self.assertEqual(network.txs[3].txid(), results[0]['txid'])
+        self.assertEqual(network.txs[0].inputs()[0]['prevout_n'], network.txs[3].inputs()[0]['prevout_n'])
+
+
 class TestWalletHistory_SimpleRandomOrder(TestCaseForTestnet):
     transactions = {
         "0f4972c84974b908a58dda2614b68cf037e6c03e8291898c719766f213217b67": "01000000029d1bdbe67f0bd0d7bd700463f5c29302057c7b52d47de9e2ca5069761e139da2000000008b483045022100a146a2078a318c1266e42265a369a8eef8993750cb3faa8dd80754d8d541d5d202207a6ab8864986919fd1a7fd5854f1e18a8a0431df924d7a878ec3dc283e3d75340141045f7ba332df2a7b4f5d13f246e307c9174cfa9b8b05f3b83410a3c23ef8958d610be285963d67c7bc1feb082f168fa9877c25999963ff8b56b242a852b23e25edfeffffff9d1bdbe67f0bd0d7bd700463f5c29302057c7b52d47de9e2ca5069761e139da2010000008a47304402201c7fa37b74a915668b0244c01f14a9756bbbec1031fb69390bcba236148ab37e02206151581f9aa0e6758b503064c1e661a726d75c6be3364a5a121a8c12cf618f64014104dc28da82e141416aaf771eb78128d00a55fdcbd13622afcbb7a3b911e58baa6a99841bfb7b99bcb7e1d47904fda5d13fdf9675cdbbe73e44efcc08165f49bac6feffffff02b0183101000000001976a914ca14915184a2662b5d1505ce7142c8ca066c70e288ac005a6202000000001976a9145eb4eeaefcf9a709f8671444933243fbd05366a388ac54c51200",
@@ -1551,6 +1871,39 @@ class TestWalletHistory_SimpleRandomOrder(TestCaseForTestnet):
             w.receive_tx_callback(tx.txid(), tx, TX_HEIGHT_UNCONFIRMED)
         self.assertEqual(27633300, sum(w.get_balance()))
 
+    @mock.patch.object(storage.WalletStorage, '_write')
+    def test_utxo_index_matches_history(self, mock_write):
+        w = self.create_old_wallet()
+        w.debug_utxo_index = True
+        for i in [2, 12, 7, 9, 11, 10, 16, 6, 17, 1, 13, 15, 5, 8, 4, 0, 14, 18, 3]:
+            tx = Transaction(self.transactions[self.txid_list[i]])
+            w.receive_tx_callback(tx.txid(), tx, TX_HEIGHT_UNCONFIRMED)
+        self.assertEqual([], w.check_utxo_index())
+        self.assertEqual(27633300, sum(w.get_balance()))
+        # confirming a tx moves its coins from unconfirmed to confirmed
+        txid = self.txid_list[0]
+        w.add_unverified_tx(txid, 1230000)
+        self.assertEqual([], w.check_utxo_index())
+        self.assertEqual(27633300, sum(w.get_balance()))
+        w.remove_transaction(txid)
+        self.assertEqual([], w.check_utxo_index())
+        self.assertEqual(sum(x['value'] for x in w.get_utxos()), sum(w.get_balance()))
+
+    @mock.patch.object(storage.WalletStorage, '_write')
+    def test_history_cache_matches_recomputation(self, mock_write):
+        w = self.create_old_wallet()
+        order = [2, 12, 7, 9, 11, 10, 16, 6, 17, 1, 13, 15, 5, 8, 4, 0, 14, 18, 3]
+        for height, i in enumerate(order, start=1230000):
+            tx = Transaction(self.transactions[self.txid_list[i]])
+            w.receive_tx_callback(tx.txid(), tx, height)
+            self.assertEqual(w._compute_history(w.get_addresses()), w.get_history())
+        self.assertEqual(27633300, w.get_history()[-1][5])
+        # a reorg moves a tx back into the mempool
+        w.add_unverified_tx(self.txid_list[order[3]], TX_HEIGHT_UNCONFIRMED)
+        self.assertEqual(w._compute_history(w.get_addresses()), w.get_history())
+        w.remove_transaction(self.txid_list[order[-1]])
+        self.assertEqual(w._compute_history(w.get_addresses()), w.get_history())
+
 
 class TestWalletHistory_EvilGapLimit(TestCaseForTestnet):
     transactions = {
@@ -1601,3 +1954,47 @@ class TestWalletHistory_EvilGapLimit(TestCaseForTestnet):
                                    {})
         w.synchronize()
         self.assertEqual(9999788, sum(w.get_balance()))
+
+
+class TestTxGraph(TestCaseForTestnet):
+
+    def add_chain(self, wallet, prevout_hash, length, address):
+        # each tx spends output 0 of the previous one, and has a change output 1
+        txids = []
+        for i in range(length):
+            tx = make_spending_tx(prevout_hash, 0, [(address, 100000 - 10 * (i + 1)), (address, 1000)])
+            prevout_hash = tx.txid()
+            wallet.receive_tx_callback(prevout_hash, tx, TX_HEIGHT_UNCONFIRMED)
+            txids.append(prevout_hash)
+        return txids
+
+    @mock.patch.object(storage.WalletStorage, '_write')
+    def test_replace_long_chain(self, mock_write):
+        wallet, recipient = create_funded_wallets([100000])
+        address = wallet.get_receiving_address()
+        funding_txid, = wallet.transactions
+        chain = self.add_chain(wallet, funding_txid, 1000, address)
+        # a child paying for its parent, off the middle of the chain
+        cpfp = make_spending_tx(chain[499], 1, [(address, 500)])
+        wallet.receive_tx_callback(cpfp.txid(), cpfp, TX_HEIGHT_UNCONFIRMED)
+        self.assertEqual(1002, len(wallet.transactions))
+        self.assertEqual(2, len(wallet.transactions[chain[499]].outputs()))
+        self.assertEqual(cpfp.txid(), wallet.spent_outpoints.get(chain[499], 1))
+        self.assertEqual(set(chain[500:]) | {cpfp.txid()},
+                         wallet.get_depending_transactions(chain[499]))
+        self.assertEqual({chain[0]}, wallet.get_conflicting_transactions(
+            make_spending_tx(funding_txid, 0, [(address, 90000)])))
+        # replacing the first tx of the chain removes all its descendants
+        tx = make_spending_tx(funding_txid, 0, [(recipient.get_receiving_address(), 90000)])
+        wallet.receive_tx_callback(tx.txid(), tx, TX_HEIGHT_UNCONFIRMED)
+        self.assertEqual({funding_txid, tx.txid()}, set(wallet.transactions))
+        self.assertEqual({tx.txid()}, wallet.get_depending_transactions(funding_txid))
+        self.assertEqual({'11' * 32: {0: funding_txid}, funding_txid: {0: tx.txid()}},
+                         wallet.spent_outpoints.to_json())
+        self.assertEqual((0, 0, 0), wallet.get_balance())
+        # and a new chain can grow from the same coin
+        tx = make_spending_tx(funding_txid, 0, [(address, 99990)])
+        wallet.receive_tx_callback(tx.txid(), tx, TX_HEIGHT_UNCONFIRMED)
+        chain = self.add_chain(wallet, tx.txid(), 10, address)
+        self.assertEqual(12, len(wallet.transactions))
+        self.assertEqual((0, 99900 + 10 * 1000, 0), wallet.get_balance())
@@ -37,6 +37,8 @@ from .bitcoin import *
 import struct
 import traceback
 import sys
+import threading
+from collections import OrderedDict
 
 #
 # Workalike python implementation of Bitcoin's CDataStream class.
@@ -46,6 +48,13 @@ from .keystore import xpubkey_to_address, xpubkey_to_pubkey
 NO_SIGNATURE = 'ff'
 PARTIAL_TXN_HEADER_MAGIC = b'EPTF\xff'
 
+# transactions with fewer inputs to sign are not worth starting a process pool
+PARALLEL_SIGN_MIN_INPUTS = 20
+
+# debug: compare the cached txid, serialization and size of complete
+# transactions with a recomputation every time they are used
+CHECK_TX_CACHE = False
+
 
 class SerializationError(Exception):
     """ Thrown when there's a problem deserializing or serializing """
@@ -59,6 +68,10 @@ class NotRecognizedRedeemScript(Exception):
     pass
 
 
+# precompiled formats of the integers read and written by BCDataStream
+_STRUCTS = {f: struct.Struct(f) for f in ('<h', '<H', '<i', '<I', '<q', '<Q')}
+
+
 class BCDataStream(object):
     def __init__(self):
         self.input = None
@@ -72,7 +85,12 @@ class BCDataStream(object):
         if self.input is None:
             self.input = bytearray(_bytes)
         else:
-            self.input += bytearray(_bytes)
+            self.input += _bytes
+
+    def set_input(self, _bytes):
+        # read from _bytes in place; read_bytes then returns memoryviews
+        self.input = memoryview(_bytes)
+        self.read_cursor = 0
 
     def read_string(self, encoding='ascii'):
         # Strings are encoded depending on length:
@@ -103,6 +121,14 @@ class BCDataStream(object):
         except IndexError:
             raise SerializationError("attempt to read past end of buffer")
 
+    def skip_bytes(self, length):
+        # like read_bytes, but returns the position of the bytes instead
+        pos = self.read_cursor
+        if pos + length > len(self.input):
+            raise SerializationError("attempt to read past end of buffer")
+        self.read_cursor = pos + length
+        return pos
+
     def can_read_more(self) -> bool:
         if not self.input:
             return False
@@ -154,16 +180,16 @@ class BCDataStream(object):
             self._write_num('<Q', size)
 
     def _read_num(self, format):
+        s = _STRUCTS[format]
         try:
-            (i,) = struct.unpack_from(format, self.input, self.read_cursor)
-            self.read_cursor += struct.calcsize(format)
+            (i,) = s.unpack_from(self.input, self.read_cursor)
+            self.read_cursor += s.size
         except Exception as e:
             raise SerializationError(e)
         return i
 
     def _write_num(self, format, num):
-        s = struct.pack(format, num)
-        self.write(s)
+        self.write(_STRUCTS[format].pack(num))
 
 
 # enum-like type
@@ -424,6 +450,33 @@ def parse_redeemScript_multisig(redeem_script: bytes):
 
 
 def get_address_from_output_script(_bytes, *, net=None):
+    # fast path for the standard templates, recognized by their length
+    # and fixed bytes; anything else goes through the generic parser
+    n = len(_bytes)
+    if n == 25:
+        # DUP HASH160 20 BYTES:... EQUALVERIFY CHECKSIG
+        if _bytes[0:3] == b'\x76\xa9\x14' and _bytes[23:25] == b'\x88\xac':
+            return TYPE_ADDRESS, hash160_to_p2pkh(_bytes[3:23], net=net)
+    elif n == 23:
+        # HASH160 20 BYTES:... EQUAL
+        if _bytes[0:2] == b'\xa9\x14' and _bytes[22] == 0x87:
+            return TYPE_ADDRESS, hash160_to_p2sh(_bytes[2:22], net=net)
+    elif n == 22:
+        # 0 20 BYTES:...
+        if _bytes[0:2] == b'\x00\x14':
+            return TYPE_ADDRESS, hash_to_segwit_addr(_bytes[2:22], witver=0, net=net)
+    elif n == 34:
+        # 0 32 BYTES:...
+        if _bytes[0:2] == b'\x00\x20':
+            return TYPE_ADDRESS, hash_to_segwit_addr(_bytes[2:34], witver=0, net=net)
+    elif n == 35 or n == 67:
+        # 33 or 65 BYTES:... CHECKSIG
+        if _bytes[0] == n - 2 and _bytes[n-1] == 0xac:
+            return TYPE_PUBKEY, bh2u(_bytes[1:n-1])
+    return get_address_from_output_script_generic(_bytes, net=net)
+
+
+def get_address_from_output_script_generic(_bytes, *, net=None):
     decoded = [x for x in script_GetOp(_bytes)]
 
     # The Genesis Block, self-payments, and pay-by-IP-address payments look like:
@@ -453,33 +506,6 @@ def get_address_from_output_script(_bytes, *, net=None):
     return TYPE_SCRIPT, bh2u(_bytes)
 
 
-def parse_input(vds, full_parse: bool):
-    d = {}
-    prevout_hash = hash_encode(vds.read_bytes(32))
-    prevout_n = vds.read_uint32()
-    scriptSig = vds.read_bytes(vds.read_compact_size())
-    sequence = vds.read_uint32()
-    d['prevout_hash'] = prevout_hash
-    d['prevout_n'] = prevout_n
-    d['scriptSig'] = bh2u(scriptSig)
-    d['sequence'] = sequence
-    d['type'] = 'unknown' if prevout_hash != '00'*32 else 'coinbase'
-    d['address'] = None
-    d['num_sig'] = 0
-    if not full_parse:
-        return d
-    d['x_pubkeys'] = []
-    d['pubkeys'] = []
-    d['signatures'] = {}
-    if d['type'] != 'coinbase' and scriptSig:
-        try:
-            parse_scriptSig(d, scriptSig)
-        except BaseException:
-            traceback.print_exc(file=sys.stderr)
-            print_error('failed to parse scriptSig', bh2u(scriptSig))
-    return d
-
-
 def construct_witness(items: Sequence[Union[str, int, bytes]]) -> str:
     """Constructs a witness from the given stack items."""
     witness = var_int(len(items))
@@ -492,20 +518,12 @@ def construct_witness(items: Sequence[Union[str, int, bytes]]) -> str:
     return witness
 
 
-def parse_witness(vds, txin, full_parse: bool):
-    n = vds.read_compact_size()
-    if n == 0:
-        txin['witness'] = '00'
-        return
-    if n == 0xffffffff:
-        txin['value'] = vds.read_uint64()
-        txin['witness_version'] = vds.read_uint16()
-        n = vds.read_compact_size()
-    # now 'n' is the number of items in the witness
-    w = list(bh2u(vds.read_bytes(vds.read_compact_size())) for i in range(n))
+def parse_witness(txin, w, full_parse: bool):
+    # w: the witness items, as hex strings
     txin['witness'] = construct_witness(w)
     if not full_parse:
         return
+    n = len(w)
 
     try:
         if txin.get('witness_version', 0) != 0:
@@ -546,57 +564,187 @@ def parse_witness(vds, txin, full_parse: bool):
         print_error('failed to parse witness', txin.get('witness'))
 
 
-def parse_output(vds, i):
-    d = {}
-    d['value'] = vds.read_int64()
-    if d['value'] > TOTAL_COIN_SUPPLY_LIMIT_IN_BTC * COIN:
+class TxInput(object):
+    """An input of a deserialized transaction.
+
+    Scripts and witnesses are kept as positions in the raw transaction;
+    they are only copied and hex-encoded when asked for.
+    """
+
+    __slots__ = ('_raw', '_pos', '_script_pos', '_script_len', 'prevout_n', 'sequence',
+                 '_witness_pos', 'value', 'witness_version')
+
+    def __init__(self, raw, pos, script_pos, script_len, prevout_n, sequence):
+        self._raw = raw
+        self._pos = pos
+        self._script_pos = script_pos
+        self._script_len = script_len
+        self.prevout_n = prevout_n
+        self.sequence = sequence
+        self._witness_pos = None  # position of the witness, if segwit serialized
+        self.value = None  # only in partial txns
+        self.witness_version = None
+
+    @property
+    def prevout_hash(self):
+        return hash_encode(self._raw[self._pos:self._pos+32])
+
+    @property
+    def script_sig(self) -> bytes:
+        return self._raw[self._script_pos:self._script_pos+self._script_len]
+
+    def witness_items(self):
+        if self._witness_pos is None:
+            return None
+        vds = BCDataStream()
+        vds.set_input(self._raw)
+        vds.read_cursor = self._witness_pos
+        n = vds.read_compact_size()
+        items = []
+        for i in range(n):
+            length = vds.read_compact_size()
+            pos = vds.skip_bytes(length)
+            items.append(self._raw[pos:pos+length])
+        return items
+
+    def to_dict(self, full_parse: bool) -> dict:
+        d = {}
+        prevout_hash = self.prevout_hash
+        scriptSig = self.script_sig
+        d['prevout_hash'] = prevout_hash
+        d['prevout_n'] = self.prevout_n
+        d['scriptSig'] = bh2u(scriptSig)
+        d['sequence'] = self.sequence
+        d['type'] = 'unknown' if prevout_hash != '00'*32 else 'coinbase'
+        d['address'] = None
+        d['num_sig'] = 0
+        if full_parse:
+            d['x_pubkeys'] = []
+            d['pubkeys'] = []
+            d['signatures'] = {}
+            if d['type'] != 'coinbase' and scriptSig:
+                try:
+                    parse_scriptSig(d, scriptSig)
+                except BaseException:
+                    traceback.print_exc(file=sys.stderr)
+                    print_error('failed to parse scriptSig', bh2u(scriptSig))
+        items = self.witness_items()
+        if items is None:
+            return d
+        if self.witness_version is None and not items:
+            d['witness'] = '00'
+            return d
+        if self.witness_version is not None:
+            d['value'] = self.value
+            d['witness_version'] = self.witness_version
+        parse_witness(d, [bh2u(x) for x in items], full_parse=full_parse)
+        return d
+
+
+class TxOutput(object):
+    """An output of a deserialized transaction."""
+
+    __slots__ = ('_raw', '_script_pos', '_script_len', 'value', 'type', 'address')
+
+    def __init__(self, raw, script_pos, script_len, value):
+        self._raw = raw
+        self._script_pos = script_pos
+        self._script_len = script_len
+        self.value = value
+        self.type, self.address = get_address_from_output_script(self.script)
+
+    @property
+    def script(self) -> bytes:
+        return self._raw[self._script_pos:self._script_pos+self._script_len]
+
+    def to_dict(self, i) -> dict:
+        return {'value': self.value, 'type': self.type, 'address': self.address,
+                'scriptPubKey': bh2u(self.script), 'prevout_n': i}
+
+
+def parse_input(vds, raw):
+    pos = vds.skip_bytes(32)
+    prevout_n = vds.read_uint32()
+    script_len = vds.read_compact_size()
+    script_pos = vds.skip_bytes(script_len)
+    sequence = vds.read_uint32()
+    return TxInput(raw, pos, script_pos, script_len, prevout_n, sequence)
+
+
+def parse_witness_position(vds, txin):
+    pos = vds.read_cursor
+    n = vds.read_compact_size()
+    if n == 0xffffffff:
+        txin.value = vds.read_uint64()
+        txin.witness_version = vds.read_uint16()
+        pos = vds.read_cursor
+        n = vds.read_compact_size()
+    txin._witness_pos = pos
+    for i in range(n):
+        vds.skip_bytes(vds.read_compact_size())
+
+
+def parse_output(vds, raw):
+    value = vds.read_int64()
+    if value > TOTAL_COIN_SUPPLY_LIMIT_IN_BTC * COIN:
         raise SerializationError('invalid output amount (too large)')
-    if d['value'] < 0:
+    if value < 0:
         raise SerializationError('invalid output amount (negative)')
-    scriptPubKey = vds.read_bytes(vds.read_compact_size())
-    d['type'], d['address'] = get_address_from_output_script(scriptPubKey)
-    d['scriptPubKey'] = bh2u(scriptPubKey)
-    d['prevout_n'] = i
-    return d
+    script_len = vds.read_compact_size()
+    script_pos = vds.skip_bytes(script_len)
+    return TxOutput(raw, script_pos, script_len, value)
 
 
-def deserialize(raw: str, force_full_parse=False) -> dict:
+def deserialize_records(raw: str, force_full_parse=False) -> dict:
+    """Like deserialize, but inputs and outputs are TxInput and
+    TxOutput records, that refer to a single copy of the raw bytes.
+    Also returns these bytes, and the position of the witnesses."""
     raw_bytes = bfh(raw)
     d = {}
+    vds = BCDataStream()
+    vds.set_input(raw_bytes)
     if raw_bytes[:5] == PARTIAL_TXN_HEADER_MAGIC:
         d['partial'] = is_partial = True
         partial_format_version = raw_bytes[5]
         if partial_format_version != 0:
             raise SerializationError('unknown tx partial serialization format version: {}'
                                      .format(partial_format_version))
-        raw_bytes = raw_bytes[6:]
+        vds.read_cursor = 6
     else:
         d['partial'] = is_partial = False
-    full_parse = force_full_parse or is_partial
-    vds = BCDataStream()
-    vds.write(raw_bytes)
+    d['full_parse'] = force_full_parse or is_partial
     d['version'] = vds.read_int32()
     n_vin = vds.read_compact_size()
     is_segwit = (n_vin == 0)
     if is_segwit:
         marker = vds.read_bytes(1)
         if marker != b'\x01':
-            raise ValueError('invalid txn marker byte: {}'.format(marker))
+            raise ValueError('invalid txn marker byte: {}'.format(bytes(marker)))
         n_vin = vds.read_compact_size()
     d['segwit_ser'] = is_segwit
-    d['inputs'] = [parse_input(vds, full_parse=full_parse) for i in range(n_vin)]
+    d['inputs'] = [parse_input(vds, raw_bytes) for i in range(n_vin)]
     n_vout = vds.read_compact_size()
-    d['outputs'] = [parse_output(vds, i) for i in range(n_vout)]
+    d['outputs'] = [parse_output(vds, raw_bytes) for i in range(n_vout)]
+    d['raw_bytes'] = raw_bytes
+    d['witness_pos'] = vds.read_cursor
     if is_segwit:
-        for i in range(n_vin):
-            txin = d['inputs'][i]
-            parse_witness(vds, txin, full_parse=full_parse)
+        for txin in d['inputs']:
+            parse_witness_position(vds, txin)
     d['lockTime'] = vds.read_uint32()
     if vds.can_read_more():
         raise SerializationError('extra junk at the end')
     return d
 
 
+def deserialize(raw: str, force_full_parse=False) -> dict:
+    d = deserialize_records(raw, force_full_parse)
+    full_parse = d.pop('full_parse')
+    del d['raw_bytes'], d['witness_pos']
+    d['inputs'] = [txin.to_dict(full_parse) for txin in d['inputs']]
+    d['outputs'] = [o.to_dict(i) for i, o in enumerate(d['outputs'])]
+    return d
+
+
 # pay & redeem scripts
 
 
@@ -631,6 +779,11 @@ class Transaction:
             raise Exception("cannot initialize transaction", raw)
         self._inputs = None
         self._outputs = None
+        # TxInput records of a deserialized tx, until inputs() is called
+        self._txin_records = None
+        self._full_parse = False
+        self._cache = {}
+        self._preimage_cache = None
         self.locktime = 0
         self.version = 1
         # by default we assume this is a partial txn;
@@ -638,19 +791,56 @@ class Transaction:
         self.is_partial_originally = True
         self._segwit_ser = None  # None means "don't know"
 
+    @property
+    def locktime(self):
+        return self._locktime
+
+    @locktime.setter
+    def locktime(self, locktime):
+        self._locktime = locktime
+        self.invalidate_cache()
+
+    def invalidate_cache(self):
+        # must be called whenever inputs, outputs or signatures change
+        self._cache = {}
+        self._preimage_cache = None
+
+    def _is_complete_cached(self):
+        # completeness only changes with the signatures, which clear the cache
+        complete = self._cache.get('complete')
+        if complete is None:
+            complete = self._cache['complete'] = self.is_complete()
+        return complete
+
+    def _get_cached(self, key, compute):
+        # only complete transactions are immutable enough to be cached
+        if not self._is_complete_cached():
+            return compute()
+        value = self._cache.get(key)
+        if value is None:
+            value = self._cache[key] = compute()
+        elif CHECK_TX_CACHE:
+            assert value == compute(), "stale %s cache for tx %s" % (key, self._cache.get('txid'))
+        return value
+
     def update(self, raw):
         self.raw = raw
         self._inputs = None
-        self.deserialize()
+        self._txin_records = None
+        self.invalidate_cache()
+        self._parse()
 
     def inputs(self):
         if self._inputs is None:
-            self.deserialize()
+            self._parse()
+            if self._txin_records is not None:
+                self._inputs = [txin.to_dict(self._full_parse) for txin in self._txin_records]
+                self._txin_records = None
         return self._inputs
 
     def outputs(self):
         if self._outputs is None:
-            self.deserialize()
+            self._parse()
         return self._outputs
 
     @classmethod
@@ -707,25 +897,48 @@ class Transaction:
         self.raw = self.serialize()
 
     def add_signature_to_txin(self, i, signingPos, sig):
-        txin = self._inputs[i]
+        txin = self.inputs()[i]
         txin['signatures'][signingPos] = sig
         txin['scriptSig'] = None  # force re-serialization
         txin['witness'] = None    # force re-serialization
         self.raw = None
+        # signatures are not part of the sighash preimages
+        self._cache = {}
 
-    def deserialize(self, force_full_parse=False):
+    def _parse(self, force_full_parse=False):
+        # the inputs are kept as TxInput records; dicts are made on demand
         if self.raw is None:
             return
-            #self.raw = self.serialize()
-        if self._inputs is not None:
+        if self._inputs is not None or self._txin_records is not None:
             return
-        d = deserialize(self.raw, force_full_parse)
-        self._inputs = d['inputs']
-        self._outputs = [(x['type'], x['address'], x['value']) for x in d['outputs']]
+        d = deserialize_records(self.raw, force_full_parse)
+        self._txin_records = d['inputs']
+        self._full_parse = d.pop('full_parse')
+        self._outputs = [(o.type, o.address, o.value) for o in d['outputs']]
         self.locktime = d['lockTime']
         self.version = d['version']
         self.is_partial_originally = d['partial']
         self._segwit_ser = d['segwit_ser']
+        raw_bytes = d.pop('raw_bytes')
+        witness_pos = d.pop('witness_pos')
+        if not self.is_partial_originally:
+            # complete tx: the hashes are those of the raw bytes,
+            # there is no need to serialize it again
+            if self._segwit_ser:
+                stripped = raw_bytes[0:4] + raw_bytes[6:witness_pos] + raw_bytes[-4:]
+            else:
+                stripped = raw_bytes
+            self._cache['complete'] = True
+            self._cache['txid'] = bh2u(Hash(stripped)[::-1])
+            self._cache['wtxid'] = bh2u(Hash(raw_bytes)[::-1])
+        return d
+
+    def deserialize(self, force_full_parse=False):
+        d = self._parse(force_full_parse)
+        if d is None:
+            return
+        d['inputs'] = self.inputs()
+        d['outputs'] = [o.to_dict(i) for i, o in enumerate(d['outputs'])]
         return d
 
     @classmethod
@@ -967,11 +1180,13 @@ class Transaction:
         nSequence = 0xffffffff - (2 if rbf else 1)
         for txin in self.inputs():
             txin['sequence'] = nSequence
+        self.invalidate_cache()
 
     def BIP_LI01_sort(self):
         # See https://github.com/kristovatlas/rfc/blob/master/bips/bip-li01.mediawiki
-        self._inputs.sort(key = lambda i: (i['prevout_hash'], i['prevout_n']))
-        self._outputs.sort(key = lambda o: (o[2], self.pay_script(o[0], o[1])))
+        self.inputs().sort(key = lambda i: (i['prevout_hash'], i['prevout_n']))
+        self.outputs().sort(key = lambda o: (o[2], self.pay_script(o[0], o[1])))
+        self.invalidate_cache()
 
     def serialize_output(self, output):
         output_type, addr, amount = output
@@ -981,27 +1196,70 @@ class Transaction:
         s += script
         return s
 
+    @classmethod
+    def write_input(self, vds, txin, script: bytes):
+        # bytes counterpart of serialize_input
+        vds.write(bfh(txin['prevout_hash'])[::-1])
+        vds.write_uint32(txin['prevout_n'])
+        vds.write_compact_size(len(script))
+        vds.write(script)
+        vds.write_uint32(txin.get('sequence', 0xffffffff - 1))
+
+    def write_output(self, vds, output):
+        # bytes counterpart of serialize_output
+        output_type, addr, amount = output
+        script = bfh(self.pay_script(output_type, addr))
+        vds.write_int64(amount)
+        vds.write_compact_size(len(script))
+        vds.write(script)
+
+    def get_preimage_cache(self):
+        # serialized outpoints, sequences and outputs are the same in the
+        # preimage of every input, so they are computed once per transaction.
+        # The cache is reset when inputs, outputs or sequences change.
+        c = self._preimage_cache
+        if c is None:
+            inputs = self.inputs()
+            outputs = self.outputs()
+            c = self._preimage_cache = {
+                'outpoints': [self.serialize_outpoint(txin) for txin in inputs],
+                'sequences': [int_to_hex(txin.get('sequence', 0xffffffff - 1), 4) for txin in inputs],
+                'outputs': ''.join(self.serialize_output(o) for o in outputs),
+            }
+        return c
+
+    def get_bip143_hashes(self):
+        c = self.get_preimage_cache()
+        if 'hashPrevouts' not in c:
+            c['hashPrevouts'] = bh2u(Hash(bfh(''.join(c['outpoints']))))
+            c['hashSequence'] = bh2u(Hash(bfh(''.join(c['sequences']))))
+            c['hashOutputs'] = bh2u(Hash(bfh(c['outputs'])))
+        return c['hashPrevouts'], c['hashSequence'], c['hashOutputs']
+
     def serialize_preimage(self, i):
         nVersion = int_to_hex(self.version, 4)
         nHashType = int_to_hex(1, 4)
         nLocktime = int_to_hex(self.locktime, 4)
         inputs = self.inputs()
-        outputs = self.outputs()
         txin = inputs[i]
+        c = self.get_preimage_cache()
         # TODO: py3 hex
         if self.is_segwit_input(txin):
-            hashPrevouts = bh2u(Hash(bfh(''.join(self.serialize_outpoint(txin) for txin in inputs))))
-            hashSequence = bh2u(Hash(bfh(''.join(int_to_hex(txin.get('sequence', 0xffffffff - 1), 4) for txin in inputs))))
-            hashOutputs = bh2u(Hash(bfh(''.join(self.serialize_output(o) for o in outputs))))
-            outpoint = self.serialize_outpoint(txin)
+            hashPrevouts, hashSequence, hashOutputs = self.get_bip143_hashes()
+            outpoint = c['outpoints'][i]
             preimage_script = self.get_preimage_script(txin)
             scriptCode = var_int(len(preimage_script) // 2) + preimage_script
             amount = int_to_hex(txin['value'], 8)
-            nSequence = int_to_hex(txin.get('sequence', 0xffffffff - 1), 4)
+            nSequence = c['sequences'][i]
             preimage = nVersion + hashPrevouts + hashSequence + outpoint + scriptCode + amount + nSequence + hashOutputs + nLocktime + nHashType
         else:
-            txins = var_int(len(inputs)) + ''.join(self.serialize_input(txin, self.get_preimage_script(txin) if i==k else '') for k, txin in enumerate(inputs))
-            txouts = var_int(len(outputs)) + ''.join(self.serialize_output(o) for o in outputs)
+            if 'empty_inputs' not in c:
+                c['empty_inputs'] = [o + '00' + s for o, s in zip(c['outpoints'], c['sequences'])]
+            empty_inputs = c['empty_inputs']
+            preimage_script = self.get_preimage_script(txin)
+            txin_ser = c['outpoints'][i] + var_int(len(preimage_script) // 2) + preimage_script + c['sequences'][i]
+            txins = var_int(len(inputs)) + ''.join(empty_inputs[:i]) + txin_ser + ''.join(empty_inputs[i+1:])
+            txouts = var_int(len(self.outputs())) + c['outputs']
             preimage = nVersion + txins + txouts + nLocktime + nHashType
         return preimage
 
@@ -1021,46 +1279,56 @@ class Transaction:
             return network_ser
 
     def serialize_to_network(self, estimate_size=False, witness=True):
-        nVersion = int_to_hex(self.version, 4)
-        nLocktime = int_to_hex(self.locktime, 4)
+        return bh2u(self.serialize_to_network_bytes(estimate_size, witness))
+
+    def serialize_to_network_bytes(self, estimate_size=False, witness=True) -> bytes:
+        return self._get_cached(('ser', estimate_size, witness),
+                                lambda: self._serialize_to_network_bytes(estimate_size, witness))
+
+    def _serialize_to_network_bytes(self, estimate_size, witness):
         inputs = self.inputs()
         outputs = self.outputs()
-        txins = var_int(len(inputs)) + ''.join(self.serialize_input(txin, self.input_script(txin, estimate_size)) for txin in inputs)
-        txouts = var_int(len(outputs)) + ''.join(self.serialize_output(o) for o in outputs)
         use_segwit_ser_for_estimate_size = estimate_size and self.is_segwit(guess_for_address=True)
         use_segwit_ser_for_actual_use = not estimate_size and \
                                         (self.is_segwit() or any(txin['type'] == 'address' for txin in inputs))
         use_segwit_ser = use_segwit_ser_for_estimate_size or use_segwit_ser_for_actual_use
+        vds = BCDataStream()
+        vds.write_int32(self.version)
         if witness and use_segwit_ser:
-            marker = '00'
-            flag = '01'
-            witness = ''.join(self.serialize_witness(x, estimate_size) for x in inputs)
-            return nVersion + marker + flag + txins + txouts + witness + nLocktime
-        else:
-            return nVersion + txins + txouts + nLocktime
+            vds.write(b'\x00\x01')  # marker, flag
+        vds.write_compact_size(len(inputs))
+        for txin in inputs:
+            self.write_input(vds, txin, bfh(self.input_script(txin, estimate_size)))
+        vds.write_compact_size(len(outputs))
+        for o in outputs:
+            self.write_output(vds, o)
+        if witness and use_segwit_ser:
+            for txin in inputs:
+                vds.write(bfh(self.serialize_witness(txin, estimate_size)))
+        vds.write_uint32(self.locktime)
+        return bytes(vds.input)
 
     def txid(self):
-        self.deserialize()
-        all_segwit = all(self.is_segwit_input(x) for x in self.inputs())
-        if not all_segwit and not self.is_complete():
+        self._parse()
+        if not self._is_complete_cached() and not all(self.is_segwit_input(x) for x in self.inputs()):
             return None
-        ser = self.serialize_to_network(witness=False)
-        return bh2u(Hash(bfh(ser))[::-1])
+        return self._get_cached('txid', lambda: bh2u(Hash(self.serialize_to_network_bytes(witness=False))[::-1]))
 
     def wtxid(self):
-        self.deserialize()
-        if not self.is_complete():
+        self._parse()
+        if not self._is_complete_cached():
             return None
-        ser = self.serialize_to_network(witness=True)
-        return bh2u(Hash(bfh(ser))[::-1])
+        return self._get_cached('wtxid', lambda: bh2u(Hash(self.serialize_to_network_bytes(witness=True))[::-1]))
 
     def add_inputs(self, inputs):
-        self._inputs.extend(inputs)
+        self.inputs().extend(inputs)
         self.raw = None
+        self.invalidate_cache()
 
     def add_outputs(self, outputs):
-        self._outputs.extend(outputs)
+        self.outputs().extend(outputs)
         self.raw = None
+        self.invalidate_cache()
 
     def input_value(self):
         return sum(x['value'] for x in self.inputs())
@@ -1082,8 +1350,7 @@ class Transaction:
         If we wanted sub-byte precision, fee calculation should use transaction
         weights, but for simplicity we approximate that with (virtual_size)x4
         """
-        weight = self.estimated_weight()
-        return self.virtual_size_from_weight(weight)
+        return self._get_cached('estimated_size', lambda: self.virtual_size_from_weight(self.estimated_weight()))
 
     @classmethod
     def estimated_input_weight(cls, txin, is_segwit_tx):
@@ -1111,7 +1378,9 @@ class Transaction:
 
     def estimated_total_size(self):
         """Return an estimated total transaction size in bytes."""
-        return len(self.serialize(True)) // 2 if not self.is_complete() or self.raw is None else len(self.raw) // 2  # ASCII hex string
+        if not self.is_complete() or self.raw is None:
+            return len(self.serialize_to_network_bytes(estimate_size=True))
+        return len(self.raw) // 2  # ASCII hex string
 
     def estimated_witness_size(self):
         """Return an estimate of witness size in bytes."""
@@ -1150,13 +1419,23 @@ class Transaction:
         s, r = self.signature_count()
         return r == s
 
-    def sign(self, keypairs) -> None:
+    def sign(self, keypairs, num_processes=0) -> None:
         # keypairs:  (x_)pubkey -> secret_bytes
+        # All preimages are hashed first, then signed, serially or in
+        # num_processes worker processes, and the signatures are added
+        # back in input order.
+        jobs = []  # (txin index, signing position, preimage hash, secret)
         for i, txin in enumerate(self.inputs()):
+            if self.is_txin_complete(txin):
+                continue
+            missing = txin.get('num_sig', 1) - len(list(filter(None, txin['signatures'])))
             pubkeys, x_pubkeys = self.get_sorted_pubkeys(txin)
+            pre_hash = None
             for j, (pubkey, x_pubkey) in enumerate(zip(pubkeys, x_pubkeys)):
-                if self.is_txin_complete(txin):
+                if missing <= 0:
                     break
+                if txin['signatures'][j]:
+                    continue
                 if pubkey in keypairs:
                     _pubkey = pubkey
                 elif x_pubkey in keypairs:
@@ -1165,8 +1444,18 @@ class Transaction:
                     continue
                 print_error("adding signature for", _pubkey)
                 sec, compressed = keypairs.get(_pubkey)
-                sig = self.sign_txin(i, sec)
-                self.add_signature_to_txin(i, j, sig)
+                if pre_hash is None:
+                    pre_hash = Hash(bfh(self.serialize_preimage(i)))
+                jobs.append((i, j, pre_hash, sec))
+                missing -= 1
+
+        hashes = [(pre_hash, sec) for i, j, pre_hash, sec in jobs]
+        if num_processes > 1 and len(jobs) >= PARALLEL_SIGN_MIN_INPUTS:
+            sigs = sign_hashes_parallel(hashes, num_processes)
+        else:
+            sigs = sign_hashes(hashes)
+        for (i, j, pre_hash, sec), sig in zip(jobs, sigs):
+            self.add_signature_to_txin(i, j, sig)
 
         print_error("is_complete", self.is_complete())
         self.raw = self.serialize()
@@ -1202,7 +1491,7 @@ class Transaction:
     def as_dict(self):
         if self.raw is None:
             self.raw = self.serialize()
-        self.deserialize()
+        self._parse()
         out = {
             'hex': self.raw,
             'complete': self.is_complete(),
@@ -1211,6 +1500,123 @@ class Transaction:
         return out
 
 
+def sign_hashes(jobs):
+    # jobs: list of (preimage hash, secret bytes). Module level, so that
+    # it can be pickled and run in a worker process.
+    return [bh2u(ecc.ECPrivkey(sec).sign_transaction(pre_hash)) + '01'
+            for pre_hash, sec in jobs]
+
+
+def sign_hashes_parallel(jobs, num_processes):
+    # Note that the private keys are pickled and sent to the worker
+    # processes, so they leave the memory of this process. Frozen
+    # builds need multiprocessing.freeze_support(), see run_electrum.
+    from concurrent.futures import ProcessPoolExecutor
+    from concurrent.futures.process import BrokenProcessPool
+    size = -(-len(jobs) // num_processes)
+    chunks = [jobs[k:k+size] for k in range(0, len(jobs), size)]
+    try:
+        with ProcessPoolExecutor(max_workers=len(chunks)) as executor:
+            return [sig for sigs in executor.map(sign_hashes, chunks) for sig in sigs]
+    except (OSError, NotImplementedError, BrokenProcessPool) as e:
+        # e.g. no working multiprocessing on this platform
+        print_error("parallel signing failed, signing serially:", repr(e))
+        return sign_hashes(jobs)
+
+
+class TxStore(object):
+    """Mapping of txid -> Transaction.
+
+    Transactions are kept serialized, as bytes. Only the most recently
+    used ones are kept as parsed Transaction objects; older ones are
+    parsed again when looked up.
+    """
+
+    def __init__(self, max_parsed=1000):
+        self.lock = threading.Lock()
+        self.max_parsed = max_parsed
+        self._raw = {}  # txid -> bytes
+        self._parsed = OrderedDict()  # txid -> Transaction, least recently used first
+
+    def _cache(self, txid, tx):
+        self._parsed[txid] = tx
+        self._parsed.move_to_end(txid)
+        while len(self._parsed) > self.max_parsed:
+            self._parsed.popitem(last=False)
+
+    def __setitem__(self, txid, tx):
+        raw = bfh(str(tx))
+        with self.lock:
+            self._raw[txid] = raw
+            self._cache(txid, tx)
+
+    def __getitem__(self, txid):
+        with self.lock:
+            tx = self._parsed.get(txid)
+            if tx is not None:
+                self._parsed.move_to_end(txid)
+                return tx
+            tx = Transaction(bh2u(self._raw[txid]))
+            self._cache(txid, tx)
+            return tx
+
+    def __contains__(self, txid):
+        return txid in self._raw
+
+    def __len__(self):
+        return len(self._raw)
+
+    def __iter__(self):
+        return iter(self.keys())
+
+    def keys(self):
+        with self.lock:
+            return list(self._raw.keys())
+
+    def get(self, txid, default=None):
+        try:
+            return self[txid]
+        except KeyError:
+            return default
+
+    def pop(self, txid, *default):
+        with self.lock:
+            tx = self._parsed.pop(txid, None)
+            raw = self._raw.pop(txid, None)
+        if raw is None:
+            if default:
+                return default[0]
+            raise KeyError(txid)
+        return tx if tx is not None else Transaction(bh2u(raw))
+
+    def items(self):
+        for txid in self.keys():
+            tx = self.get(txid)
+            if tx is not None:
+                yield txid, tx
+
+    def values(self):
+        for txid, tx in self.items():
+            yield tx
+
+    def set_raw(self, txid, raw: str):
+        """Adds a serialized transaction without parsing it."""
+        with self.lock:
+            self._raw[txid] = bfh(raw)
+            self._parsed.pop(txid, None)
+
+    def get_raw(self, txid):
+        raw = self._raw.get(txid)
+        return bh2u(raw) if raw is not None else None
+
+    def raw_items(self):
+        """Yields (txid, serialized tx) pairs without parsing them."""
+        with self.lock:
+            items = list(self._raw.items())
+        for txid, raw in items:
+            yield txid, bh2u(raw)
+
+
 def tx_from_str(txt):
     "json or raw hexadecimal"
     import json
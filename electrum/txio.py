@@ -0,0 +1,280 @@
+# -*- coding: utf-8 -*-
+#
+# Electrum - lightweight Bitcoin client
+# Copyright (C) 2018 The Electrum developers
+#
+# Permission is hereby granted, free of charge, to any person
+# obtaining a copy of this software and associated documentation files
+# (the "Software"), to deal in the Software without restriction,
+# including without limitation the rights to use, copy, modify, merge,
+# publish, distribute, sublicense, and/or sell copies of the Software,
+# and to permit persons to whom the Software is furnished to do so,
+# subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be
+# included in all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+# EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF
+# MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND
+# NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS
+# BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN
+# ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN
+# CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+# In-memory tables of the wallet inputs and outputs of each transaction
+# (wallet.txi, wallet.txo) and of who spends what (wallet.spent_outpoints).
+# Txids are kept as 32 bytes and outpoints as (txid, n) rather than
+# "txid:n" strings. The methods take and return hex txids, and the
+# to_json/from_json methods read and write the format used in wallet files.
+
+import sys
+
+from .util import bfh, bh2u
+
+
+def outpoint_key(prevout_hash, prevout_n):
+    return bfh(prevout_hash) + prevout_n.to_bytes(4, 'little')
+
+
+class TxiRecord(object):
+    """A wallet coin spent by a transaction."""
+    __slots__ = ('address', 'prevout_hash', 'prevout_n', 'value')
+
+    def __init__(self, address, prevout_hash, prevout_n, value):
+        self.address = sys.intern(address)
+        self.prevout_hash = prevout_hash  # bytes
+        self.prevout_n = prevout_n
+        self.value = value
+
+    def prevout(self):
+        return bh2u(self.prevout_hash) + ':%d' % self.prevout_n
+
+    def __eq__(self, other):
+        return (isinstance(other, TxiRecord)
+                and self.address == other.address
+                and self.prevout_hash == other.prevout_hash
+                and self.prevout_n == other.prevout_n
+                and self.value == other.value)
+
+    def __repr__(self):
+        return "TxiRecord(%s, %s, %d)" % (self.address, self.prevout(), self.value)
+
+
+class TxoRecord(object):
+    """A transaction output paying to the wallet."""
+    __slots__ = ('address', 'value', 'is_coinbase')
+
+    def __init__(self, address, value, is_coinbase):
+        self.address = sys.intern(address)
+        self.value = value
+        self.is_coinbase = is_coinbase
+
+    def __eq__(self, other):
+        return (isinstance(other, TxoRecord)
+                and self.address == other.address
+                and self.value == other.value
+                and self.is_coinbase == other.is_coinbase)
+
+    def __repr__(self):
+        return "TxoRecord(%s, %d, %s)" % (self.address, self.value, self.is_coinbase)
+
+
+class _TxidMap(object):
+    # dict keyed by binary txid, with a hex interface
+
+    def __init__(self):
+        self._d = {}
+
+    def __contains__(self, txid):
+        return bfh(txid) in self._d
+
+    def __iter__(self):
+        return (bh2u(k) for k in list(self._d))
+
+    def __len__(self):
+        return len(self._d)
+
+    def __bool__(self):
+        return bool(self._d)
+
+    def pop(self, txid, default=None):
+        return self._d.pop(bfh(txid), default)
+
+
+class TxInputs(_TxidMap):
+    """txid -> list of TxiRecord
+
+    A txid is present (with a possibly empty list) once the transaction
+    has been added to the wallet.
+    """
+
+    def get(self, txid, default=None):
+        return self._d.get(bfh(txid), default)
+
+    def new_tx(self, txid):
+        self._d[bfh(txid)] = l = []
+        return l
+
+    def add(self, txid, address, prevout_hash, prevout_n, value):
+        """Records that txid spends prevout_hash:prevout_n.
+        Returns False if it was already recorded.
+        """
+        l = self._d.setdefault(bfh(txid), [])
+        prevout_hash = bfh(prevout_hash)
+        for r in l:
+            if r.prevout_hash == prevout_hash and r.prevout_n == prevout_n:
+                return False
+        l.append(TxiRecord(address, prevout_hash, prevout_n, value))
+        return True
+
+    def addresses(self, txid):
+        return set(r.address for r in self._d.get(bfh(txid), []))
+
+    def items(self):
+        for k, l in self._d.items():
+            yield bh2u(k), l
+
+    def to_json(self):
+        # txid -> address -> [[prevout, value]]
+        out = {}
+        for txid, l in self.items():
+            d = out[txid] = {}
+            for r in l:
+                d.setdefault(r.address, []).append([r.prevout(), r.value])
+        return out
+
+    @classmethod
+    def from_json(cls, d):
+        self = cls()
+        for txid, dd in d.items():
+            l = self._d[bfh(txid)] = []
+            for addr, lst in dd.items():
+                for ser, v in lst:
+                    prevout_hash, prevout_n = ser.split(':')
+                    r = TxiRecord(addr, bfh(prevout_hash), int(prevout_n), v)
+                    if r not in l:
+                        l.append(r)
+        return self
+
+
+class TxOutputs(_TxidMap):
+    """txid -> {n -> TxoRecord}
+
+    A txid is present (with a possibly empty dict) once the transaction
+    has been added to the wallet.
+    """
+
+    def get(self, txid, default=None):
+        return self._d.get(bfh(txid), default)
+
+    def get_output(self, txid, n):
+        if txid is None:
+            return None
+        d = self._d.get(bfh(txid))
+        return d.get(n) if d else None
+
+    def new_tx(self, txid):
+        self._d[bfh(txid)] = d = {}
+        return d
+
+    def addresses(self, txid):
+        return set(r.address for r in self._d.get(bfh(txid), {}).values())
+
+    def items(self):
+        for k, d in self._d.items():
+            yield bh2u(k), d
+
+    def to_json(self):
+        # txid -> address -> [[n, value, is_coinbase]]
+        out = {}
+        for txid, d in self.items():
+            dd = out[txid] = {}
+            for n, r in sorted(d.items()):
+                dd.setdefault(r.address, []).append([n, r.value, r.is_coinbase])
+        return out
+
+    @classmethod
+    def from_json(cls, d):
+        self = cls()
+        for txid, dd in d.items():
+            outputs = self._d[bfh(txid)] = {}
+            for addr, lst in dd.items():
+                for n, v, is_cb in lst:
+                    outputs[n] = TxoRecord(addr, v, is_cb)
+        return self
+
+
+class SpentOutpoints(object):
+    """outpoint -> spending txid
+
+    Outpoints are keyed by their 36 byte serialization (txid + n).
+    Only spent outpoints are held. The outpoints are also indexed by
+    spender and by parent txid, so that the spends of a tx and its
+    children are found in time proportional to their number.
+    """
+
+    def __init__(self):
+        self._d = {}
+        self._by_spender = {}  # spender -> set of outpoints
+        self._by_parent = {}  # parent txid -> set of outpoints
+
+    def __len__(self):
+        return len(self._d)
+
+    def get(self, prevout_hash, prevout_n):
+        spender = self._d.get(outpoint_key(prevout_hash, prevout_n))
+        return bh2u(spender) if spender is not None else None
+
+    def add(self, prevout_hash, prevout_n, txid):
+        k = outpoint_key(prevout_hash, prevout_n)
+        spender = bfh(txid)
+        old = self._d.get(k)
+        if old == spender:
+            return
+        if old is not None:
+            self._unlink(self._by_spender, old, k)
+        self._d[k] = spender
+        self._by_spender.setdefault(spender, set()).add(k)
+        self._by_parent.setdefault(k[:32], set()).add(k)
+
+    def remove(self, prevout_hash, prevout_n):
+        self._remove(outpoint_key(prevout_hash, prevout_n))
+
+    def _remove(self, k):
+        spender = self._d.pop(k, None)
+        if spender is None:
+            return
+        self._unlink(self._by_spender, spender, k)
+        self._unlink(self._by_parent, k[:32], k)
+
+    @staticmethod
+    def _unlink(index, key, k):
+        s = index[key]
+        s.discard(k)
+        if not s:
+            del index[key]
+
+    def remove_spender(self, txid):
+        """Removes every outpoint spent by txid."""
+        for k in list(self._by_spender.get(bfh(txid), ())):
+            self._remove(k)
+
+    def get_spenders(self, txid):
+        """Returns the set of txids spending outputs of txid."""
+        return set(bh2u(self._d[k]) for k in self._by_parent.get(bfh(txid), ()))
+
+    def to_json(self):
+        out = {}
+        for k, s in self._d.items():
+            out.setdefault(bh2u(k[:32]), {})[int.from_bytes(k[32:], 'little')] = bh2u(s)
+        return out
+
+    @classmethod
+    def from_json(cls, d):
+        self = cls()
+        for prevout_hash, dd in d.items():
+            for n, s in dd.items():
+                self.add(prevout_hash, int(n), s)
+        return self
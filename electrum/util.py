@@ -22,7 +22,7 @@
 # SOFTWARE.
 import binascii
 import os, sys, re, json
-from collections import defaultdict
+from collections import defaultdict, OrderedDict
 from datetime import datetime
 import decimal
 from decimal import Decimal
@@ -317,6 +317,41 @@ def profiler(func):
     return lambda *args, **kw_args: do_profile(func, args, kw_args)
 
 
+class LRUCache(object):
+    """Bounded, thread-safe mapping; the least recently used
+    entries are dropped first."""
+
+    def __init__(self, max_size):
+        self.max_size = max_size
+        self.lock = threading.Lock()
+        self._d = OrderedDict()
+
+    def get(self, key, compute, *args):
+        """Returns the value cached for key, or compute(*args),
+        which is then cached. Exceptions are not cached."""
+        with self.lock:
+            try:
+                value = self._d[key]
+            except KeyError:
+                pass
+            else:
+                self._d.move_to_end(key)
+                return value
+        value = compute(*args)
+        with self.lock:
+            self._d[key] = value
+            if len(self._d) > self.max_size:
+                self._d.popitem(last=False)
+        return value
+
+    def clear(self):
+        with self.lock:
+            self._d.clear()
+
+    def __len__(self):
+        return len(self._d)
+
+
 def android_ext_dir():
     import jnius
     env = jnius.autoclass('android.os.Environment')
@@ -761,7 +796,8 @@ class SocketPipe:
             if response is not None:
                 return response
             try:
-                data = self.socket.recv(1024)
+                # batch responses can be large
+                data = self.socket.recv(65536)
             except socket.timeout:
                 raise timeout
             except ssl.SSLError:
@@ -770,8 +806,10 @@ class SocketPipe:
                 if err.errno == 60:
                     raise timeout
                 elif err.errno in [11, 35, 10035]:
-                    print_error("socket errno %d (resource temporarily unavailable)"% err.errno)
-                    time.sleep(0.2)
+                    # expected when a non-blocking socket has been drained
+                    if self.socket.gettimeout() != 0:
+                        print_error("socket errno %d (resource temporarily unavailable)"% err.errno)
+                        time.sleep(0.2)
                     raise timeout
                 else:
                     print_error("pipe: socket error", err)
@@ -40,6 +40,7 @@ from collections import defaultdict
 from numbers import Number
 from decimal import Decimal
 import itertools
+import bisect
 
 import sys
 
@@ -51,11 +52,12 @@ from .util import (NotEnoughFunds, PrintError, UserCancelled, profiler,
 
 from .bitcoin import *
 from .version import *
-from .keystore import load_keystore, Hardware_KeyStore
+from .keystore import load_keystore, Hardware_KeyStore, Software_KeyStore, Xpub
 from .storage import multisig_type, STO_EV_PLAINTEXT, STO_EV_USER_PW, STO_EV_XPUB_PW
 
 from . import transaction, bitcoin, coinchooser, paymentrequest, contacts
-from .transaction import Transaction
+from .transaction import Transaction, TxStore
+from .txio import TxInputs, TxOutputs, TxiRecord, TxoRecord, SpentOutpoints
 from .plugin import run_hook
 from .synchronizer import Synchronizer
 from .verifier import SPV
@@ -75,6 +77,13 @@ TX_HEIGHT_LOCAL = -2
 TX_HEIGHT_UNCONF_PARENT = -1
 TX_HEIGHT_UNCONFIRMED = 0
 
+# times a transaction is rebuilt when its coins were reserved meanwhile
+MAX_RESERVE_ATTEMPTS = 10
+
+
+def coin_key(coin):
+    return coin['prevout_hash'] + ':%d' % coin['prevout_n']
+
 
 def relayfee(network):
     from .simple_config import FEERATE_DEFAULT_RELAY
@@ -154,7 +163,7 @@ def sweep(privkeys, network, config, recipient, fee=None, imax=100):
     tx = Transaction.from_io(inputs, outputs, locktime=locktime)
     tx.BIP_LI01_sort()
     tx.set_rbf(True)
-    tx.sign(keypairs)
+    tx.sign(keypairs, config.get('sign_processes', 0) if config else 0)
     return tx
 
 
@@ -177,6 +186,11 @@ class Abstract_Wallet(PrintError):
     """
 
     max_change_outputs = 3
+    # seconds before a coin reservation expires, see reserve_coins
+    coin_reservation_ttl = 600
+    # if set, lookups in the per-address UTXO index are compared
+    # against a recomputation from the address history
+    debug_utxo_index = False
 
     def __init__(self, storage):
         self.electrum_version = ELECTRUM_VERSION
@@ -191,6 +205,7 @@ class Abstract_Wallet(PrintError):
         # locks: if you need to take multiple ones, acquire them in the order they are defined here!
         self.lock = threading.RLock()
         self.transaction_lock = threading.RLock()
+        self.reservation_lock = threading.Lock()
 
         # saved fields
         self.use_change            = storage.get('use_change', True)
@@ -200,6 +215,8 @@ class Abstract_Wallet(PrintError):
         self.history               = storage.get('addr_history',{})        # address -> list(txid, height)
         self.fiat_value            = storage.get('fiat_value', {})
         self.receive_requests      = storage.get('payment_requests', {})
+        self.address_scripthashes  = storage.get('address_scripthashes', {})  # address -> scripthash
+        self.reserved_coins        = storage.get('reserved_coins', {})        # 'txid:n' -> expiry time
 
         # Verified transactions.  txid -> (height, timestamp, block_pos).  Access with self.lock.
         self.verified_tx = storage.get('verified_tx3', {})
@@ -209,8 +226,11 @@ class Abstract_Wallet(PrintError):
         self.load_keystore()
         self.load_addresses()
         self.test_addresses_sanity()
+        self.check_address_scripthashes()
         self.load_transactions()
         self.load_local_history()
+        self.load_history_cache()
+        self.load_utxo_index()
         self.check_history()
         self.load_unverified_transactions()
         self.remove_local_transactions_we_dont_have()
@@ -241,28 +261,19 @@ class Abstract_Wallet(PrintError):
     @profiler
     def load_transactions(self):
         # load txi, txo, tx_fees
-        self.txi = self.storage.get('txi', {})
-        for txid, d in list(self.txi.items()):
-            for addr, lst in d.items():
-                self.txi[txid][addr] = set([tuple(x) for x in lst])
-        self.txo = self.storage.get('txo', {})
+        self.txi = TxInputs.from_json(self.storage.get('txi', {}))
+        self.txo = TxOutputs.from_json(self.storage.get('txo', {}))
         self.tx_fees = self.storage.get('tx_fees', {})
         tx_list = self.storage.get('transactions', {})
         # load transactions
-        self.transactions = {}
+        self.transactions = TxStore()
         for tx_hash, raw in tx_list.items():
-            tx = Transaction(raw)
-            self.transactions[tx_hash] = tx
-            if self.txi.get(tx_hash) is None and self.txo.get(tx_hash) is None:
+            if tx_hash not in self.txi and tx_hash not in self.txo:
                 self.print_error("removing unreferenced tx", tx_hash)
-                self.transactions.pop(tx_hash)
+                continue
+            self.transactions.set_raw(tx_hash, raw)
         # load spent_outpoints
-        _spent_outpoints = self.storage.get('spent_outpoints', {})
-        self.spent_outpoints = defaultdict(dict)
-        for prevout_hash, d in _spent_outpoints.items():
-            for prevout_n_str, spending_txid in d.items():
-                prevout_n = int(prevout_n_str)
-                self.spent_outpoints[prevout_hash][prevout_n] = spending_txid
+        self.spent_outpoints = SpentOutpoints.from_json(self.storage.get('spent_outpoints', {}))
 
     @profiler
     def load_local_history(self):
@@ -270,6 +281,23 @@ class Abstract_Wallet(PrintError):
         for txid in itertools.chain(self.txi, self.txo):
             self._add_tx_to_local_history(txid)
 
+    @profiler
+    def load_utxo_index(self):
+        self._addr_received = {}  # address -> {"txid:n" -> (txid, n, value, is_cb)}
+        self._addr_sent = {}  # address -> {"txid:n" -> spending txid}
+        self._addr_balance_cache = {}  # address -> (height_dependent, local_height, (c, u, x))
+        for txid in itertools.chain(self.txi, self.txo):
+            self._add_tx_to_utxo_index(txid)
+
+    def load_history_cache(self):
+        # sorted history of the whole wallet, patched as transactions change
+        self._history_rows = []  # sorted list of (txpos, txid)
+        self._history_keys = {}  # txid -> its current row in _history_rows
+        self._history_deltas = {}  # txid -> effect of tx on the wallet
+        self._history_balances = []  # running balance after each row; may be shorter than _history_rows
+        self._history_max_timestamps = []  # running max of the row timestamps, for bisection
+        self._history_dirty = set(self.txi) | set(self.txo)
+
     def remove_local_transactions_we_dont_have(self):
         txid_set = set(self.txi) | set(self.txo)
         for txid in txid_set:
@@ -280,15 +308,13 @@ class Abstract_Wallet(PrintError):
     @profiler
     def save_transactions(self, write=False):
         with self.transaction_lock:
-            tx = {}
-            for k,v in self.transactions.items():
-                tx[k] = str(v)
+            tx = dict(self.transactions.raw_items())
             self.storage.put('transactions', tx)
-            self.storage.put('txi', self.txi)
-            self.storage.put('txo', self.txo)
+            self.storage.put('txi', self.txi.to_json())
+            self.storage.put('txo', self.txo.to_json())
             self.storage.put('tx_fees', self.tx_fees)
             self.storage.put('addr_history', self.history)
-            self.storage.put('spent_outpoints', self.spent_outpoints)
+            self.storage.put('spent_outpoints', self.spent_outpoints.to_json())
             if write:
                 self.storage.write()
 
@@ -301,13 +327,17 @@ class Abstract_Wallet(PrintError):
     def clear_history(self):
         with self.lock:
             with self.transaction_lock:
-                self.txi = {}
-                self.txo = {}
+                self.txi = TxInputs()
+                self.txo = TxOutputs()
                 self.tx_fees = {}
-                self.spent_outpoints = defaultdict(dict)
+                self.spent_outpoints = SpentOutpoints()
                 self.history = {}
                 self.verified_tx = {}
-                self.transactions = {}
+                self.transactions = TxStore()
+                self._addr_received = {}
+                self._addr_sent = {}
+                self._addr_balance_cache = {}
+                self.load_history_cache()
                 self.save_transactions()
 
     @profiler
@@ -352,6 +382,19 @@ class Abstract_Wallet(PrintError):
             if not bitcoin.is_address(addrs[0]):
                 raise WalletFileException('The addresses in this wallet are not bitcoin addresses.')
 
+    def check_address_scripthashes(self):
+        '''Checks the first and last persisted scripthashes against their
+        addresses, to detect a corrupt wallet file without computing all of
+        them again. They are all dropped if one does not match.'''
+        d = self.address_scripthashes
+        items = list(d.items())
+        for addr, scripthash in {items[0], items[-1]} if items else ():
+            if scripthash != bitcoin.address_to_scripthash(addr):
+                self.print_error("address scripthashes do not match the addresses, computing them again")
+                self.address_scripthashes = {}
+                self.storage.put('address_scripthashes', {})
+                return
+
     def synchronize(self):
         pass
 
@@ -446,12 +489,15 @@ class Abstract_Wallet(PrintError):
                 and tx_hash in self.verified_tx:
             with self.lock:
                 self.verified_tx.pop(tx_hash)
+                self._invalidate_balance_cache(tx_hash)
             if self.verifier:
                 self.verifier.remove_spv_proof_for_tx(tx_hash)
 
         # tx will be verified only if height > 0
         if tx_hash not in self.verified_tx:
             with self.lock:
+                if self.unverified_tx.get(tx_hash) != tx_height:
+                    self._invalidate_balance_cache(tx_hash)
                 self.unverified_tx[tx_hash] = tx_height
 
     def add_verified_tx(self, tx_hash, info):
@@ -459,6 +505,7 @@ class Abstract_Wallet(PrintError):
         with self.lock:
             self.unverified_tx.pop(tx_hash, None)
             self.verified_tx[tx_hash] = info  # (tx_height, timestamp, pos)
+            self._invalidate_balance_cache(tx_hash)
         height, conf, timestamp = self.get_tx_height(tx_hash)
         self.network.trigger_callback('verified', tx_hash, height, conf, timestamp)
 
@@ -478,6 +525,7 @@ class Abstract_Wallet(PrintError):
                     # fixme: use block hash, not timestamp
                     if not header or header.get('timestamp') != timestamp:
                         self.verified_tx.pop(tx_hash, None)
+                        self._invalidate_balance_cache(tx_hash)
                         txs.add(tx_hash)
         return txs
 
@@ -522,24 +570,22 @@ class Abstract_Wallet(PrintError):
         "effect of tx on address"
         delta = 0
         # substract the value of coins sent from address
-        d = self.txi.get(tx_hash, {}).get(address, [])
-        for n, v in d:
-            delta -= v
+        for r in self.txi.get(tx_hash, []):
+            if r.address == address:
+                delta -= r.value
         # add the value of the coins received at address
-        d = self.txo.get(tx_hash, {}).get(address, [])
-        for n, v, cb in d:
-            delta += v
+        for r in self.txo.get(tx_hash, {}).values():
+            if r.address == address:
+                delta += r.value
         return delta
 
     def get_tx_value(self, txid):
         " effect of tx on the entire domain"
         delta = 0
-        for addr, d in self.txi.get(txid, {}).items():
-            for n, v in d:
-                delta -= v
-        for addr, d in self.txo.get(txid, {}).items():
-            for n, v, cb in d:
-                delta += v
+        for r in self.txi.get(txid, []):
+            delta -= r.value
+        for r in self.txo.get(txid, {}).values():
+            delta += r.value
         return delta
 
     def get_wallet_delta(self, tx):
@@ -554,17 +600,11 @@ class Abstract_Wallet(PrintError):
             if self.is_mine(addr):
                 is_mine = True
                 is_relevant = True
-                d = self.txo.get(txin['prevout_hash'], {}).get(addr, [])
-                for n, v, cb in d:
-                    if n == txin['prevout_n']:
-                        value = v
-                        break
-                else:
-                    value = None
-                if value is None:
+                r = self.txo.get_output(txin['prevout_hash'], txin['prevout_n'])
+                if r is None or r.address != addr:
                     is_pruned = True
                 else:
-                    v_in += value
+                    v_in += r.value
             else:
                 is_partial = True
         if not is_mine:
@@ -603,7 +643,7 @@ class Abstract_Wallet(PrintError):
         height = conf = timestamp = None
         tx_hash = tx.txid()
         if tx.is_complete():
-            if tx_hash in self.transactions.keys():
+            if tx_hash in self.transactions:
                 label = self.get_label(tx_hash)
                 height, conf, timestamp = self.get_tx_height(tx_hash)
                 if height > 0:
@@ -644,49 +684,84 @@ class Abstract_Wallet(PrintError):
         return tx_hash, status, label, can_broadcast, can_bump, amount, fee, height, conf, timestamp, exp_n
 
     def get_addr_io(self, address):
+        received, sent = self._get_addr_io_from_index(address)
+        if self.debug_utxo_index:
+            assert (received, sent) == self._get_addr_io_from_history(address), address
+        return received, sent
+
+    def _get_addr_io_from_index(self, address):
+        # heights are looked up on each call; the index only tracks which
+        # outpoints were received at, and spent from, the address
+        with self.lock, self.transaction_lock:
+            received = {}
+            for ser, (tx_hash, n, v, is_cb) in self._addr_received.get(address, {}).items():
+                received[ser] = (self.get_tx_height(tx_hash)[0], v, is_cb)
+            sent = {}
+            for ser, tx_hash in self._addr_sent.get(address, {}).items():
+                sent[ser] = self.get_tx_height(tx_hash)[0]
+        return received, sent
+
+    def _get_addr_io_from_history(self, address):
         h = self.get_address_history(address)
         received = {}
         sent = {}
         for tx_hash, height in h:
-            l = self.txo.get(tx_hash, {}).get(address, [])
-            for n, v, is_cb in l:
-                received[tx_hash + ':%d'%n] = (height, v, is_cb)
+            for n, r in self.txo.get(tx_hash, {}).items():
+                if r.address == address:
+                    received[tx_hash + ':%d'%n] = (height, r.value, r.is_coinbase)
         for tx_hash, height in h:
-            l = self.txi.get(tx_hash, {}).get(address, [])
-            for txi, v in l:
-                sent[txi] = height
+            for r in self.txi.get(tx_hash, []):
+                if r.address == address:
+                    sent[r.prevout()] = height
         return received, sent
 
     def get_addr_utxo(self, address):
-        coins, spent = self.get_addr_io(address)
-        for txi in spent:
-            coins.pop(txi)
         out = {}
-        for txo, v in coins.items():
-            tx_height, value, is_cb = v
-            prevout_hash, prevout_n = txo.split(':')
-            x = {
-                'address':address,
-                'value':value,
-                'prevout_n':int(prevout_n),
-                'prevout_hash':prevout_hash,
-                'height':tx_height,
-                'coinbase':is_cb
-            }
-            out[txo] = x
+        with self.lock, self.transaction_lock:
+            spent = self._addr_sent.get(address, {})
+            for txo, (tx_hash, n, value, is_cb) in self._addr_received.get(address, {}).items():
+                if txo in spent:
+                    continue
+                x = {
+                    'address':address,
+                    'value':value,
+                    'prevout_n':n,
+                    'prevout_hash':tx_hash,
+                    'height':self.get_tx_height(tx_hash)[0],
+                    'coinbase':is_cb
+                }
+                out[txo] = x
         return out
 
     # return the total amount ever received by an address
     def get_addr_received(self, address):
-        received, sent = self.get_addr_io(address)
-        return sum([v for height, v, is_cb in received.values()])
+        with self.transaction_lock:
+            return sum([v for tx_hash, n, v, is_cb in self._addr_received.get(address, {}).values()])
 
     # return the balance of a bitcoin address: confirmed and matured, unconfirmed, unmatured
     def get_addr_balance(self, address):
+        with self.lock:
+            cached = self._addr_balance_cache.get(address)
+            if cached is not None:
+                height_dependent, local_height, balance = cached
+                if not height_dependent or local_height == self.get_local_height():
+                    if self.debug_utxo_index:
+                        assert balance == self._compute_addr_balance(address)[1], address
+                    return balance
+            height_dependent, balance = self._compute_addr_balance(address)
+            local_height = self.get_local_height() if height_dependent else None
+            self._addr_balance_cache[address] = (height_dependent, local_height, balance)
+            return balance
+
+    def _compute_addr_balance(self, address):
         received, sent = self.get_addr_io(address)
         c = u = x = 0
+        # coinbase maturity depends on the local height
+        height_dependent = False
         local_height = self.get_local_height()
         for txo, (tx_height, v, is_cb) in received.items():
+            if is_cb:
+                height_dependent = True
             if is_cb and tx_height + COINBASE_MATURITY > local_height:
                 x += v
             elif tx_height > 0:
@@ -698,11 +773,74 @@ class Abstract_Wallet(PrintError):
                     c -= v
                 else:
                     u -= v
-        return c, u, x
+        return height_dependent, (c, u, x)
+
+    def check_utxo_index(self, domain=None):
+        """Compares the per-address UTXO index against a recomputation
+        from the address history. Returns the addresses that differ."""
+        if domain is None:
+            domain = self.get_addresses()
+        bad = []
+        with self.lock, self.transaction_lock:
+            for addr in domain:
+                if self._get_addr_io_from_index(addr) != self._get_addr_io_from_history(addr):
+                    bad.append(addr)
+                    continue
+                cached = self._addr_balance_cache.get(addr)
+                if cached is not None and cached[2] != self._compute_addr_balance(addr)[1]:
+                    bad.append(addr)
+        return bad
 
     def get_spendable_coins(self, domain, config):
         confirmed_only = config.get('confirmed_only', False)
-        return self.get_utxos(domain, exclude_frozen=True, mature=True, confirmed_only=confirmed_only)
+        coins = self.get_utxos(domain, exclude_frozen=True, mature=True, confirmed_only=confirmed_only)
+        reserved = self.get_reserved_coins()
+        if reserved:
+            coins = [coin for coin in coins if coin_key(coin) not in reserved]
+        return coins
+
+    def _expire_reservations(self):
+        # call with self.reservation_lock
+        now = time.time()
+        expired = [key for key, expiry in self.reserved_coins.items() if expiry <= now]
+        for key in expired:
+            del self.reserved_coins[key]
+        return bool(expired)
+
+    def get_reserved_coins(self):
+        """Returns the set of 'txid:n' of the coins that are reserved."""
+        with self.reservation_lock:
+            if self._expire_reservations():
+                self.storage.put('reserved_coins', self.reserved_coins)
+            return set(self.reserved_coins)
+
+    def reserve_coins(self, coins, ttl=None):
+        """Reserves coins for a transaction that is not broadcast yet, so
+        that they are not selected for other transactions.  Reservations
+        expire after ttl seconds, and are released when the wallet sees
+        the coins spent.  Returns False, reserving none of the coins, if
+        any of them is reserved already."""
+        if ttl is None:
+            ttl = self.coin_reservation_ttl
+        keys = [coin_key(coin) for coin in coins]
+        expiry = time.time() + ttl
+        with self.reservation_lock:
+            self._expire_reservations()
+            if any(key in self.reserved_coins for key in keys):
+                return False
+            for key in keys:
+                self.reserved_coins[key] = expiry
+            self.storage.put('reserved_coins', self.reserved_coins)
+        return True
+
+    def release_coins(self, coins):
+        """Releases the reservation of coins, e.g. when the transaction
+        spending them could not be broadcast."""
+        keys = [coin_key(coin) for coin in coins]
+        with self.reservation_lock:
+            released = [self.reserved_coins.pop(key) for key in keys if key in self.reserved_coins]
+            if released:
+                self.storage.put('reserved_coins', self.reserved_coins)
 
     def get_utxos(self, domain = None, exclude_frozen = False, mature = False, confirmed_only = False):
         coins = []
@@ -759,14 +897,14 @@ class Abstract_Wallet(PrintError):
 
     def _add_tx_to_local_history(self, txid):
         with self.transaction_lock:
-            for addr in itertools.chain(self.txi.get(txid, []), self.txo.get(txid, [])):
+            for addr in self.txi.addresses(txid) | self.txo.addresses(txid):
                 cur_hist = self._history_local.get(addr, set())
                 cur_hist.add(txid)
                 self._history_local[addr] = cur_hist
 
     def _remove_tx_from_local_history(self, txid):
         with self.transaction_lock:
-            for addr in itertools.chain(self.txi.get(txid, []), self.txo.get(txid, [])):
+            for addr in self.txi.addresses(txid) | self.txo.addresses(txid):
                 cur_hist = self._history_local.get(addr, set())
                 try:
                     cur_hist.remove(txid)
@@ -775,18 +913,49 @@ class Abstract_Wallet(PrintError):
                 else:
                     self._history_local[addr] = cur_hist
 
+    def _add_tx_to_utxo_index(self, txid):
+        with self.transaction_lock:
+            self._history_dirty.add(txid)
+            for n, r in self.txo.get(txid, {}).items():
+                d = self._addr_received.setdefault(r.address, {})
+                d[txid + ':%d' % n] = (txid, n, r.value, r.is_coinbase)
+                self._addr_balance_cache.pop(r.address, None)
+            for r in self.txi.get(txid, []):
+                d = self._addr_sent.setdefault(r.address, {})
+                d[r.prevout()] = txid
+                self._addr_balance_cache.pop(r.address, None)
+
+    def _remove_tx_from_utxo_index(self, txid):
+        with self.transaction_lock:
+            self._history_dirty.add(txid)
+            for n, r in self.txo.get(txid, {}).items():
+                d = self._addr_received.get(r.address, {})
+                d.pop(txid + ':%d' % n, None)
+                if not d:
+                    self._addr_received.pop(r.address, None)
+                self._addr_balance_cache.pop(r.address, None)
+            for r in self.txi.get(txid, []):
+                d = self._addr_sent.get(r.address, {})
+                ser = r.prevout()
+                if d.get(ser) == txid:
+                    d.pop(ser)
+                if not d:
+                    self._addr_sent.pop(r.address, None)
+                self._addr_balance_cache.pop(r.address, None)
+
+    def _invalidate_balance_cache(self, txid):
+        """Called when the height of txid changes."""
+        with self.transaction_lock:
+            self._history_dirty.add(txid)
+            for addr in self.txi.addresses(txid) | self.txo.addresses(txid):
+                self._addr_balance_cache.pop(addr, None)
+
     def get_txin_address(self, txi):
         addr = txi.get('address')
         if addr and addr != "(pubkey)":
             return addr
-        prevout_hash = txi.get('prevout_hash')
-        prevout_n = txi.get('prevout_n')
-        dd = self.txo.get(prevout_hash, {})
-        for addr, l in dd.items():
-            for n, v, is_cb in l:
-                if n == prevout_n:
-                    return addr
-        return None
+        r = self.txo.get_output(txi.get('prevout_hash'), txi.get('prevout_n'))
+        return r.address if r else None
 
     def get_txout_address(self, txo):
         _type, x, v = txo
@@ -811,7 +980,7 @@ class Abstract_Wallet(PrintError):
                     continue
                 prevout_hash = txin['prevout_hash']
                 prevout_n = txin['prevout_n']
-                spending_tx_hash = self.spent_outpoints[prevout_hash].get(prevout_n)
+                spending_tx_hash = self.spent_outpoints.get(prevout_hash, prevout_n)
                 if spending_tx_hash is None:
                     continue
                 # this outpoint has already been spent, by spending_tx
@@ -875,48 +1044,35 @@ class Abstract_Wallet(PrintError):
                 for tx_hash2 in to_remove:
                     self.remove_transaction(tx_hash2)
             # add inputs
-            def add_value_from_prev_output():
-                dd = self.txo.get(prevout_hash, {})
-                # note: this nested loop takes linear time in num is_mine outputs of prev_tx
-                for addr, outputs in dd.items():
-                    # note: instead of [(n, v, is_cb), ...]; we could store: {n -> (v, is_cb)}
-                    for n, v, is_cb in outputs:
-                        if n == prevout_n:
-                            if addr and self.is_mine(addr):
-                                if d.get(addr) is None:
-                                    d[addr] = set()
-                                d[addr].add((ser, v))
-                            return
-            self.txi[tx_hash] = d = {}
+            self._remove_tx_from_utxo_index(tx_hash)
+            l = self.txi.new_tx(tx_hash)
             for txi in tx.inputs():
                 if txi['type'] == 'coinbase':
                     continue
                 prevout_hash = txi['prevout_hash']
                 prevout_n = txi['prevout_n']
-                ser = prevout_hash + ':%d' % prevout_n
-                self.spent_outpoints[prevout_hash][prevout_n] = tx_hash
-                add_value_from_prev_output()
+                self.spent_outpoints.add(prevout_hash, prevout_n, tx_hash)
+                if self.reserved_coins:
+                    self.release_coins([txi])
+                r = self.txo.get_output(prevout_hash, prevout_n)
+                if r and self.is_mine(r.address):
+                    l.append(TxiRecord(r.address, bfh(prevout_hash), prevout_n, r.value))
             # add outputs
-            self.txo[tx_hash] = d = {}
+            d = self.txo.new_tx(tx_hash)
             for n, txo in enumerate(tx.outputs()):
                 v = txo[2]
-                ser = tx_hash + ':%d'%n
                 addr = self.get_txout_address(txo)
                 if addr and self.is_mine(addr):
-                    if d.get(addr) is None:
-                        d[addr] = []
-                    d[addr].append((n, v, is_coinbase))
+                    d[n] = TxoRecord(addr, v, is_coinbase)
                     # give v to txi that spends me
-                    next_tx = self.spent_outpoints[tx_hash].get(n)
+                    next_tx = self.spent_outpoints.get(tx_hash, n)
                     if next_tx is not None:
-                        dd = self.txi.get(next_tx, {})
-                        if dd.get(addr) is None:
-                            dd[addr] = set()
-                        if (ser, v) not in dd[addr]:
-                            dd[addr].add((ser, v))
+                        self.txi.add(next_tx, addr, tx_hash, n, v)
                         self._add_tx_to_local_history(next_tx)
+                        self._add_tx_to_utxo_index(next_tx)
             # add to local history
             self._add_tx_to_local_history(tx_hash)
+            self._add_tx_to_utxo_index(tx_hash)
             # save
             self.transactions[tx_hash] = tx
             return True
@@ -928,29 +1084,19 @@ class Abstract_Wallet(PrintError):
                 for txin in tx.inputs():
                     if txin['type'] == 'coinbase':
                         continue
-                    prevout_hash = txin['prevout_hash']
-                    prevout_n = txin['prevout_n']
-                    self.spent_outpoints[prevout_hash].pop(prevout_n, None)
-                    if not self.spent_outpoints[prevout_hash]:
-                        self.spent_outpoints.pop(prevout_hash)
-            else:  # expensive but always works
-                for prevout_hash, d in list(self.spent_outpoints.items()):
-                    for prevout_n, spending_txid in d.items():
-                        if spending_txid == tx_hash:
-                            self.spent_outpoints[prevout_hash].pop(prevout_n, None)
-                            if not self.spent_outpoints[prevout_hash]:
-                                self.spent_outpoints.pop(prevout_hash)
-            # Remove this tx itself; if nothing spends from it.
-            # It is not so clear what to do if other txns spend from it, but it will be
-            # removed when those other txns are removed.
-            if not self.spent_outpoints[tx_hash]:
-                self.spent_outpoints.pop(tx_hash)
+                    self.spent_outpoints.remove(txin['prevout_hash'], txin['prevout_n'])
+            else:
+                self.spent_outpoints.remove_spender(tx_hash)
+            # Outpoints of this tx spent by other txns are kept. It is not so
+            # clear what to do in that case, but they will be removed when
+            # those other txns are removed.
 
         with self.transaction_lock:
             self.print_error("removing tx from history", tx_hash)
             tx = self.transactions.pop(tx_hash, None)
             remove_from_spent_outpoints()
             self._remove_tx_from_local_history(tx_hash)
+            self._remove_tx_from_utxo_index(tx_hash)
             self.txi.pop(tx_hash, None)
             self.txo.pop(tx_hash, None)
 
@@ -966,6 +1112,7 @@ class Abstract_Wallet(PrintError):
                     # make tx local
                     self.unverified_tx.pop(tx_hash, None)
                     self.verified_tx.pop(tx_hash, None)
+                    self._invalidate_balance_cache(tx_hash)
                     if self.verifier:
                         self.verifier.remove_spv_proof_for_tx(tx_hash)
             self.history[addr] = hist
@@ -983,9 +1130,11 @@ class Abstract_Wallet(PrintError):
         self.tx_fees.update(tx_fees)
 
     def get_history(self, domain=None):
-        # get domain
-        if domain is None:
-            domain = self.get_addresses()
+        if domain is None or set(domain) == set(self.get_addresses()):
+            return self._get_wallet_history()
+        return self._compute_history(domain)
+
+    def _compute_history(self, domain):
         domain = set(domain)
         # 1. Get the history of each address in the domain, maintain the
         #    delta of a tx as the sum of its deltas on domain addresses
@@ -1027,13 +1176,79 @@ class Abstract_Wallet(PrintError):
 
         return h2
 
+    def _update_history_cache(self):
+        """Re-sorts the rows of transactions that changed since the last
+        call, and extends the running balances up to the last row."""
+        with self.lock, self.transaction_lock:
+            rows = self._history_rows
+            first_changed = len(rows)
+            for txid in self._history_dirty:
+                key = self._history_keys.pop(txid, None)
+                if key is not None:
+                    i = bisect.bisect_left(rows, key)
+                    del rows[i]
+                    first_changed = min(first_changed, i)
+                    self._history_deltas.pop(txid)
+                relevant = False
+                delta = 0
+                for r in self.txi.get(txid, []):
+                    if self.is_mine(r.address):
+                        relevant = True
+                        delta -= r.value
+                for r in self.txo.get(txid, {}).values():
+                    if self.is_mine(r.address):
+                        relevant = True
+                        delta += r.value
+                if not relevant:
+                    continue
+                key = (self.get_txpos(txid), txid)
+                i = bisect.bisect_left(rows, key)
+                rows.insert(i, key)
+                first_changed = min(first_changed, i)
+                self._history_keys[txid] = key
+                self._history_deltas[txid] = delta
+            self._history_dirty = set()
+            del self._history_balances[first_changed:]
+            del self._history_max_timestamps[first_changed:]
+            balances = self._history_balances
+            max_timestamps = self._history_max_timestamps
+            balance = balances[-1] if balances else 0
+            max_ts = max_timestamps[-1] if max_timestamps else 0
+            for txpos, txid in rows[len(balances):]:
+                balance += self._history_deltas[txid]
+                timestamp = self.get_tx_height(txid)[2]
+                # unconfirmed transactions sort after all confirmed ones
+                max_ts = max(max_ts, timestamp if timestamp else float('inf'))
+                balances.append(balance)
+                max_timestamps.append(max_ts)
+
+    def _get_wallet_history(self):
+        with self.lock, self.transaction_lock:
+            self._update_history_cache()
+            h = []
+            for (txpos, tx_hash), balance in zip(self._history_rows, self._history_balances):
+                height, conf, timestamp = self.get_tx_height(tx_hash)
+                h.append((tx_hash, height, conf, timestamp, self._history_deltas[tx_hash], balance))
+        # fixme: this may happen if history is incomplete
+        if h and h[-1][5] != sum(self.get_balance()):
+            self.print_error("Error: history not synchronized")
+            return []
+        return h
+
     def balance_at_timestamp(self, domain, target_timestamp):
-        h = self.get_history(domain)
-        for tx_hash, height, conf, timestamp, value, balance in h:
-            if timestamp > target_timestamp:
-                return balance - value
-        # return last balance
-        return balance
+        if domain is not None and set(domain) != set(self.get_addresses()):
+            h = self._compute_history(domain)
+            balance = 0
+            for tx_hash, height, conf, timestamp, value, balance in h:
+                if timestamp > target_timestamp:
+                    return balance - value
+            # return last balance
+            return balance
+        with self.lock, self.transaction_lock:
+            self._update_history_cache()
+            # first row whose timestamp, or that of an earlier row, is after target
+            i = bisect.bisect_right(self._history_max_timestamps, target_timestamp)
+            return self._history_balances[i - 1] if i > 0 else 0
 
     @profiler
     def get_full_history(self, domain=None, from_timestamp=None, to_timestamp=None, fx=None, show_addresses=False):
@@ -1134,10 +1349,9 @@ class Abstract_Wallet(PrintError):
         return label
 
     def get_default_label(self, tx_hash):
-        if self.txi.get(tx_hash) == {}:
-            d = self.txo.get(tx_hash, {})
+        if self.txi.get(tx_hash) == []:
             labels = []
-            for addr in d.keys():
+            for addr in self.txo.addresses(tx_hash):
                 label = self.labels.get(addr)
                 if label:
                     labels.append(label)
@@ -1268,7 +1482,7 @@ class Abstract_Wallet(PrintError):
     def mktx(self, outputs, password, config, fee=None, change_addr=None, domain=None):
         coins = self.get_spendable_coins(domain, config)
         tx = self.make_unsigned_transaction(coins, outputs, config, fee, change_addr)
-        self.sign_transaction(tx, password)
+        self.sign_transaction(tx, password, config.get('sign_processes', 0))
         return tx
 
     def is_frozen(self, addr):
@@ -1491,7 +1705,7 @@ class Abstract_Wallet(PrintError):
                 info[addr] = index, sorted_xpubs, self.m if isinstance(self, Multisig_Wallet) else None
         tx.output_info = info
 
-    def sign_transaction(self, tx, password):
+    def sign_transaction(self, tx, password, num_processes=0):
         if self.is_watching_only():
             return
         self.add_input_info_to_all_inputs(tx)
@@ -1501,7 +1715,11 @@ class Abstract_Wallet(PrintError):
         # sign. start with ready keystores.
         for k in sorted(self.get_keystores(), key=lambda ks: ks.ready_to_sign(), reverse=True):
             try:
-                if k.can_sign(tx):
+                if not k.can_sign(tx):
+                    continue
+                if isinstance(k, Software_KeyStore):
+                    k.sign_transaction(tx, password, num_processes)
+                else:
                     k.sign_transaction(tx, password)
             except UserCancelled:
                 continue
@@ -1700,6 +1918,19 @@ class Abstract_Wallet(PrintError):
     def can_delete_address(self):
         return False
 
+    def get_scripthashes(self, addresses):
+        '''Returns a dict scripthash -> address. The scripthashes of
+        the wallet's addresses are saved, so that they are not computed
+        again each time the wallet is opened.'''
+        with self.lock:
+            d = self.address_scripthashes
+            missing = [addr for addr in addresses if addr not in d]
+            for addr in missing:
+                d[addr] = bitcoin.address_to_scripthash(addr)
+            if missing:
+                self.storage.put('address_scripthashes', d)
+            return {d[addr]: addr for addr in addresses}
+
     def add_address(self, address):
         if address not in self.history:
             self.history[address] = []
@@ -1779,21 +2010,21 @@ class Abstract_Wallet(PrintError):
     def get_depending_transactions(self, tx_hash):
         """Returns all (grand-)children of tx_hash in this wallet."""
         children = set()
-        # TODO rewrite this to use self.spent_outpoints
-        for other_hash, tx in self.transactions.items():
-            for input in (tx.inputs()):
-                if input["prevout_hash"] == tx_hash:
-                    children.add(other_hash)
-                    children |= self.get_depending_transactions(other_hash)
+        with self.transaction_lock:
+            todo = [tx_hash]
+            while todo:
+                for child in self.spent_outpoints.get_spenders(todo.pop()):
+                    if child not in children and child in self.transactions:
+                        children.add(child)
+                        todo.append(child)
         return children
 
     def txin_value(self, txin):
         txid = txin['prevout_hash']
         prev_n = txin['prevout_n']
-        for address, d in self.txo.get(txid, {}).items():
-            for n, v, cb in d:
-                if n == prev_n:
-                    return v
+        r = self.txo.get_output(txid, prev_n)
+        if r is not None:
+            return r.value
         # may occur if wallet is not synchronized
         return None
 
@@ -1814,10 +2045,9 @@ class Abstract_Wallet(PrintError):
         """ Average acquisition price of the inputs of a transaction """
         input_value = 0
         total_price = 0
-        for addr, d in self.txi.get(txid, {}).items():
-            for ser, v in d:
-                input_value += v
-                total_price += self.coin_price(ser.split(':')[0], price_func, ccy, v)
+        for r in self.txi.get(txid, []):
+            input_value += r.value
+            total_price += self.coin_price(bh2u(r.prevout_hash), price_func, ccy, r.value)
         return total_price / (input_value/Decimal(COIN))
 
     def coin_price(self, txid, price_func, ccy, txin_value):
@@ -1831,7 +2061,7 @@ class Abstract_Wallet(PrintError):
         result = self.coin_price_cache.get(cache_key, None)
         if result is not None:
             return result
-        if self.txi.get(txid, {}) != {}:
+        if self.txi.get(txid):
             result = self.average_price(txid, price_func, ccy) * txin_value/Decimal(COIN)
             self.coin_price_cache[cache_key] = result
             return result
@@ -1965,7 +2195,11 @@ class Imported_Wallet(Simple_Wallet):
                         transactions_new.add(tx_hash)
             transactions_to_remove -= transactions_new
             self.history.pop(address, None)
+            if self.address_scripthashes.pop(address, None):
+                self.storage.put('address_scripthashes', self.address_scripthashes)
 
+            # deltas of txs shared with other addresses change too
+            self._history_dirty |= transactions_new
             for tx_hash in transactions_to_remove:
                 self.remove_transaction(tx_hash)
                 self.tx_fees.pop(tx_hash, None)
@@ -2086,6 +2320,7 @@ class Deterministic_Wallet(Abstract_Wallet):
             k = self.num_unused_trailing_addresses(addresses)
             n = len(addresses) - k + value
             self.receiving_addresses = self.receiving_addresses[0:n]
+            self.address_pubkeys[False] = self.address_pubkeys[False][0:n]
             self.gap_limit = value
             self.storage.put('gap_limit', self.gap_limit)
             self.save_addresses()
@@ -2121,31 +2356,90 @@ class Deterministic_Wallet(Abstract_Wallet):
             self._addr_to_addr_index[addr] = (False, i)
         for i, addr in enumerate(self.change_addresses):
             self._addr_to_addr_index[addr] = (True, i)
+        # pubkeys of each address, as returned by derive_pubkeys, so that
+        # they are not derived again. None where not known yet.
+        d = self.storage.get('address_pubkeys', {})
+        self.address_pubkeys = {}
+        for for_change, name, addresses in [(False, 'receiving', self.receiving_addresses),
+                                            (True, 'change', self.change_addresses)]:
+            pubkeys = d.get(name, [])[0:len(addresses)]
+            self.address_pubkeys[for_change] = pubkeys + [None] * (len(addresses) - len(pubkeys))
+        if not self.check_address_pubkeys():
+            self.print_error("address pubkeys do not match the keystore, deriving them again")
+            for for_change in (False, True):
+                self.address_pubkeys[for_change] = [None] * len(self.address_pubkeys[for_change])
+        # let keystores recognize these pubkeys in transactions. They are
+        # not used as derived pubkeys, the keystores derive those themselves
+        keystores = self.get_keystores()
+        for for_change in (False, True):
+            for i, x in enumerate(self.address_pubkeys[for_change]):
+                if x is None:
+                    continue
+                for k, pubkey in zip(keystores, x if type(x) is list else [x]):
+                    if isinstance(k, Xpub):
+                        k.add_pubkey_derivation(for_change, i, pubkey)
+
+    def check_address_pubkeys(self):
+        '''Checks the first and last persisted pubkeys of each branch
+        against the keystores and the addresses, to detect a corrupt
+        wallet file without deriving all the pubkeys again.'''
+        for for_change, addresses in [(False, self.receiving_addresses),
+                                      (True, self.change_addresses)]:
+            pubkeys = self.address_pubkeys[for_change]
+            for i in {0, len(pubkeys) - 1} if pubkeys else ():
+                if pubkeys[i] is None:
+                    continue
+                if (pubkeys[i] != self.derive_pubkeys(for_change, i)
+                        or self.pubkeys_to_address(pubkeys[i]) != addresses[i]):
+                    return False
+        return True
+
+    def save_addresses(self):
+        super().save_addresses()
+        self.storage.put('address_pubkeys', {'receiving': self.address_pubkeys[False],
+                                             'change': self.address_pubkeys[True]})
+
+    def get_address_pubkeys(self, c, i):
+        pubkeys = self.address_pubkeys[bool(c)]
+        x = pubkeys[i] if i < len(pubkeys) else None
+        if x is None:
+            x = self.derive_pubkeys(c, i)
+            if i < len(pubkeys):
+                pubkeys[i] = x
+        return x
 
     def create_new_address(self, for_change=False):
+        return self.create_new_addresses(for_change, 1)[0]
+
+    def create_new_addresses(self, for_change, count):
         assert type(for_change) is bool
         with self.lock:
             addr_list = self.change_addresses if for_change else self.receiving_addresses
             n = len(addr_list)
-            x = self.derive_pubkeys(for_change, n)
-            address = self.pubkeys_to_address(x)
-            addr_list.append(address)
-            self._addr_to_addr_index[address] = (for_change, n)
+            new_addresses = []
+            for i, x in enumerate(self.derive_pubkey_range(for_change, n, n + count), n):
+                address = self.pubkeys_to_address(x)
+                addr_list.append(address)
+                self.address_pubkeys[for_change].append(x)
+                self._addr_to_addr_index[address] = (for_change, i)
+                new_addresses.append(address)
             self.save_addresses()
-            self.add_address(address)
-            return address
+            for address in new_addresses:
+                self.add_address(address)
+            return new_addresses
 
     def synchronize_sequence(self, for_change):
         limit = self.gap_limit_for_change if for_change else self.gap_limit
-        while True:
-            addresses = self.get_change_addresses() if for_change else self.get_receiving_addresses()
-            if len(addresses) < limit:
-                self.create_new_address(for_change)
-                continue
-            if list(map(lambda a: self.address_is_old(a), addresses[-limit:] )) == limit*[False]:
+        addresses = self.get_change_addresses() if for_change else self.get_receiving_addresses()
+        # the last `limit` addresses must be unused; new ones are
+        # created in one batch
+        unused = 0
+        for a in reversed(addresses[-limit:]):
+            if self.address_is_old(a):
                 break
-            else:
-                self.create_new_address(for_change)
+            unused += 1
+        if unused < limit:
+            self.create_new_addresses(for_change, limit - unused)
 
     def synchronize(self):
         with self.lock:
@@ -2201,7 +2495,7 @@ class Simple_Deterministic_Wallet(Simple_Wallet, Deterministic_Wallet):
         self.txin_type = 'p2pkh' if xtype == 'standard' else xtype
 
     def get_pubkey(self, c, i):
-        return self.derive_pubkeys(c, i)
+        return self.get_address_pubkeys(c, i)
 
     def add_input_sig_info(self, txin, address):
         derivation = self.get_address_index(address)
@@ -2216,6 +2510,9 @@ class Simple_Deterministic_Wallet(Simple_Wallet, Deterministic_Wallet):
     def derive_pubkeys(self, c, i):
         return self.keystore.derive_pubkey(c, i)
 
+    def derive_pubkey_range(self, c, start, stop):
+        return self.keystore.derive_pubkey_range(c, start, stop)
+
 
 
 
@@ -2238,7 +2535,7 @@ class Multisig_Wallet(Deterministic_Wallet):
         Deterministic_Wallet.__init__(self, storage)
 
     def get_pubkeys(self, c, i):
-        return self.derive_pubkeys(c, i)
+        return self.get_address_pubkeys(c, i)
 
     def get_public_keys(self, address):
         sequence = self.get_address_index(address)
@@ -2259,6 +2556,10 @@ class Multisig_Wallet(Deterministic_Wallet):
     def derive_pubkeys(self, c, i):
         return [k.derive_pubkey(c, i) for k in self.get_keystores()]
 
+    def derive_pubkey_range(self, c, start, stop):
+        per_keystore = [k.derive_pubkey_range(c, start, stop) for k in self.get_keystores()]
+        return [list(x) for x in zip(*per_keystore)]
+
     def load_keystore(self):
         self.keystores = {}
         for i in range(self.n):